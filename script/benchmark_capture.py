@@ -0,0 +1,95 @@
+# benchmark_capture.py
+# 旧方式（リスト追記 + np.array）と CaptureBuffer のメモリ使用量・停止時間を比較
+# あわせてコールバック内のレベル計測（LevelMeter）の処理時間をブロック周期と比較
+import sys
+import time
+import argparse
+import tracemalloc
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "src"))
+from capture_buffer import CaptureBuffer
+from level_meter import LevelMeter
+
+def make_blocks(block_size, channels):
+    """コールバックに渡されるブロックを模擬"""
+    return np.random.default_rng(0).uniform(-0.5, 0.5, (block_size, channels)).astype(np.float32)
+
+def run_list_path(n_blocks, block):
+    """旧方式: recorded_data.extend(indata.copy()) → np.array()"""
+    recorded_data = []
+    start = time.perf_counter()
+    for _ in range(n_blocks):
+        recorded_data.extend(block.copy())
+    callback_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    audio = np.array(recorded_data)
+    stop_time = time.perf_counter() - start
+    return audio, callback_time, stop_time
+
+def run_buffer_path(n_blocks, block, sample_rate, channels):
+    """新方式: CaptureBuffer.append() → finalize()"""
+    buffer = CaptureBuffer(sample_rate, channels, 'float32')
+    start = time.perf_counter()
+    for _ in range(n_blocks):
+        buffer.append(block)
+    callback_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    audio = buffer.finalize()
+    stop_time = time.perf_counter() - start
+    return audio, callback_time, stop_time
+
+def measure(label, func, *args):
+    """tracemallocでピークメモリを計測しつつ実行"""
+    tracemalloc.start()
+    audio, callback_time, stop_time = func(*args)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    print(f"{label}")
+    print(f"   ピークメモリ    : {peak / 1024 / 1024:8.1f} MB")
+    print(f"   コールバック合計: {callback_time * 1000:8.1f} ms")
+    print(f"   停止処理        : {stop_time * 1000:8.1f} ms")
+    print(f"   結果 dtype/shape: {audio.dtype} {audio.shape}")
+    return peak, stop_time
+
+def measure_meter(n_blocks, block, sample_rate):
+    """LevelMeter.process() の1ブロックあたりの処理時間"""
+    meter = LevelMeter(sample_rate)
+    for _ in range(n_blocks):
+        meter.process(block)
+    overhead = meter.overhead()
+    print("🎚️ LevelMeter")
+    print(f"   平均処理時間    : {overhead['mean_ms'] * 1000:8.1f} µs")
+    print(f"   最大処理時間    : {overhead['max_ms'] * 1000:8.1f} µs")
+    print(f"   ブロック周期    : {overhead['block_period_ms']:8.2f} ms")
+    print(f"   周期に対する割合: {overhead['load_percent']:8.3f} %")
+
+def main():
+    parser = argparse.ArgumentParser(description="録音バッファのベンチマーク")
+    parser.add_argument("--seconds", type=float, default=120, help="模擬録音の長さ（秒）")
+    parser.add_argument("--sample-rate", type=int, default=44100)
+    parser.add_argument("--channels", type=int, default=1)
+    parser.add_argument("--block-size", type=int, default=512)
+    args = parser.parse_args()
+
+    n_blocks = int(args.seconds * args.sample_rate / args.block_size)
+    block = make_blocks(args.block_size, args.channels)
+
+    print(f"🎙️ 模擬録音: {args.seconds:.0f} 秒 / {n_blocks} ブロック")
+    print("=" * 50)
+    list_peak, list_stop = measure("📋 リスト方式", run_list_path, n_blocks, block)
+    buffer_peak, buffer_stop = measure("📦 CaptureBuffer", run_buffer_path,
+                                      n_blocks, block, args.sample_rate, args.channels)
+    print("=" * 50)
+    print(f"📊 メモリ削減率: {(1 - buffer_peak / list_peak) * 100:.1f}%")
+    print(f"📊 停止処理の高速化: {list_stop / max(buffer_stop, 1e-9):.0f} 倍")
+    print("=" * 50)
+    measure_meter(n_blocks, block, args.sample_rate)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,848 @@
+# benchmark_suite.py
+# 音声デバイスなしで録音・保存・セッション・同期・クリーンアップの性能を計測し、JSONで出力する
+#
+#   python script/benchmark_suite.py                          # 全ベンチマーク
+#   python script/benchmark_suite.py --quick                  # 小さい規模で短時間に実行
+#   python script/benchmark_suite.py --only session sync      # 一部のみ
+#   python script/benchmark_suite.py --compare old.json       # 以前の結果と比較
+#
+# sounddevice は fake_sounddevice に差し替え、合成した音声ブロックをコールバックへ送る。
+# 各ベンチマークは一時ディレクトリ内で実行するため、実際の dataset/ や data/ には触れない。
+import io
+import os
+import sys
+import json
+import time
+import multiprocessing
+import types
+import random
+import argparse
+import platform
+import tempfile
+import threading
+import contextlib
+import subprocess
+from pathlib import Path
+
+import numpy as np
+
+SCRIPT_DIR = Path(__file__).resolve().parent
+sys.path.insert(0, str(SCRIPT_DIR.parent / "src"))
+sys.path.append(str(SCRIPT_DIR))   # script/ の同名ファイルより src/ を優先
+import fake_sounddevice
+fake_sounddevice.install()
+
+import main as main_module
+from audio_recorder import AudioRecorder
+from text_manager import TextManager
+from metadata_store import MetadataStore
+from take_store import FlacEncoder
+from dataset_index import DatasetIndex, split_dataset
+import audio_io
+
+SAMPLE_RATE = 44100
+BLOCK_SIZE = fake_sounddevice.BLOCK_SIZE
+
+FULL_SIZES = {
+    'callback_blocks': 20000,
+    'jitter_seconds': 3.0,
+    'take_seconds': [10, 60, 300],
+    'corpus_lines': [1000, 10000, 100000],
+    'dataset_files': [100, 1000, 5000],
+    'metadata_entries': [1000, 10000, 100000],
+    'driver_moves': 200,
+    'startup_lines': [10000, 100000],
+    'ui_moves': 200,
+    'service_stations': [8, 64],
+    'station_counts': [1, 2, 4, 8],
+    'station_takes': 20,
+    'retake_lines': 50,
+    'retake_rounds': 7,
+    'flac_lines': 100,
+    'flac_take_seconds': 5,
+    'index_takes': [10000, 100000],
+}
+QUICK_SIZES = {
+    'callback_blocks': 2000,
+    'jitter_seconds': 1.0,
+    'take_seconds': [5, 30],
+    'corpus_lines': [1000, 10000],
+    'dataset_files': [100, 1000],
+    'metadata_entries': [1000, 10000],
+    'driver_moves': 50,
+    'startup_lines': [10000],
+    'ui_moves': 50,
+    'service_stations': [8],
+    'station_counts': [1, 2, 4],
+    'station_takes': 8,
+    'retake_lines': 20,
+    'retake_rounds': 7,
+    'flac_lines': 30,
+    'flac_take_seconds': 3,
+    'index_takes': [20000],
+}
+
+def summarize(values, scale=1.0):
+    """平均・パーセンタイル・最大値"""
+    if len(values) == 0:
+        return None
+    a = np.asarray(values, dtype=np.float64) * scale
+    return {
+        'count': int(len(a)),
+        'mean': float(a.mean()),
+        'p50': float(np.percentile(a, 50)),
+        'p95': float(np.percentile(a, 95)),
+        'p99': float(np.percentile(a, 99)),
+        'max': float(a.max())
+    }
+
+@contextlib.contextmanager
+def workspace():
+    """一時ディレクトリをカレントディレクトリにして実行（data/ と dataset/ を分離）"""
+    previous = os.getcwd()
+    with tempfile.TemporaryDirectory(prefix="bench_") as path:
+        os.chdir(path)
+        try:
+            yield Path(path)
+        finally:
+            os.chdir(previous)
+
+@contextlib.contextmanager
+def quiet():
+    """計測対象の print を抑制"""
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        yield
+
+def timed(func, *args, **kwargs):
+    """実行時間（ミリ秒）と返り値"""
+    start = time.perf_counter()
+    result = func(*args, **kwargs)
+    return (time.perf_counter() - start) * 1000, result
+
+def make_corpus(lines, name="bench.txt"):
+    """data/input に合成原稿を作成"""
+    Path("data/input").mkdir(parents=True, exist_ok=True)
+    with open(Path("data/input") / name, 'w', encoding='utf-8') as f:
+        for i in range(lines):
+            f.write(f"ベンチマーク用の台本その{i}です。今日は良い天気ですね。\n")
+
+def record_take(recorder, blocks):
+    """模擬ストリームで指定ブロック数だけ録音し、ストリームを返す"""
+    fake_sounddevice.max_blocks = blocks
+    recorder.start_recording()
+    stream = fake_sounddevice.streams[-1]
+    stream.wait_blocks(blocks, timeout=600)
+    fake_sounddevice.max_blocks = None
+    return stream
+
+def bench_callback(sizes):
+    """コールバックのスループットと処理時間、実時間モードでのジッタ"""
+    results = {}
+    with workspace():
+        for mode, stream_to_disk in (('memory', False), ('stream', True)):
+            fake_sounddevice.speed = 0
+            recorder = AudioRecorder(stream_to_disk=stream_to_disk)
+            start = time.perf_counter()
+            stream = record_take(recorder, sizes['callback_blocks'])
+            elapsed = time.perf_counter() - start
+            buffer = recorder.capture_buffer
+            with quiet():
+                take = recorder.stop_recording()
+            recorder.discard_take(take)
+            audio_seconds = stream.blocks_sent * BLOCK_SIZE / SAMPLE_RATE
+            results[mode] = {
+                'blocks': stream.blocks_sent,
+                'dropped_blocks': buffer.dropped_blocks,   # 実時間より速く送るため確保が間に合わないことがある
+                'realtime_factor': audio_seconds / elapsed,
+                'callback_us': summarize(stream.callback_ns, 1e-3),
+                'block_period_us': BLOCK_SIZE / SAMPLE_RATE * 1e6
+            }
+
+        # 実時間で送った場合のコールバック呼び出し時刻のずれ
+        fake_sounddevice.speed = 1
+        recorder = AudioRecorder()
+        recorder.start_recording()
+        stream = fake_sounddevice.streams[-1]
+        time.sleep(sizes['jitter_seconds'])
+        with quiet():
+            recorder.stop_recording()
+        fake_sounddevice.speed = 0
+        results['realtime_jitter_ms'] = summarize(stream.jitter_ms)
+    return results
+
+def bench_stop_save(sizes):
+    """テイクの長さに対する停止・保存の所要時間"""
+    results = {}
+    with workspace():
+        Path("dataset/audio_files").mkdir(parents=True)
+        for mode, stream_to_disk in (('memory', False), ('stream', True)):
+            rows = []
+            for seconds in sizes['take_seconds']:
+                recorder = AudioRecorder(stream_to_disk=stream_to_disk)
+                record_take(recorder, int(seconds * SAMPLE_RATE / BLOCK_SIZE))
+                buffer = recorder.capture_buffer
+                with quiet():
+                    stop_ms, take = timed(recorder.stop_recording)
+                save_ms, _ = timed(recorder.save_audio, take, f"audio_{seconds}_{mode}.wav")
+                rows.append({'take_seconds': seconds, 'stop_ms': stop_ms, 'save_ms': save_ms,
+                             'dropped_blocks': buffer.dropped_blocks})
+            results[mode] = rows
+    return results
+
+def bench_session(sizes):
+    """原稿の行数に対する読み込み・セッション保存・カーソル移動の所要時間"""
+    rows = []
+    for lines in sizes['corpus_lines']:
+        with workspace():
+            make_corpus(lines)
+            cold_ms, _ = timed(TextManager().load_all_texts)   # 行位置索引の作成を含む
+
+            manager = TextManager()
+            load_ms, _ = timed(manager.load_all_texts)
+            for i in range(0, lines, 10):
+                manager._set_recorded(i, f"audio_{i}.wav")
+            save_ms, _ = timed(manager.save_session)
+
+            moves = min(1000, lines)
+            start = time.perf_counter()
+            for i in range(moves):
+                manager.move_to(i)
+            move_us = (time.perf_counter() - start) / moves * 1e6
+            manager.close_session()
+
+            restore = TextManager()
+            restore_ms, _ = timed(restore.load_session)
+            restore.close_session()
+            rows.append({'lines': lines, 'index_build_ms': cold_ms, 'load_ms': load_ms,
+                         'save_session_ms': save_ms, 'move_to_us': move_us,
+                         'load_session_ms': restore_ms,
+                         'session_bytes': os.path.getsize("data/session.json")})
+    return rows
+
+def bench_sync(sizes):
+    """録音ファイル数に対する同期の所要時間（初回・キャッシュあり）"""
+    rows = []
+    for files in sizes['dataset_files']:
+        with workspace():
+            make_corpus(files * 2 + 1)
+            audio_dir = Path("dataset/audio_files")
+            meta_dir = Path("dataset/meta_files")
+            audio_dir.mkdir(parents=True)
+            meta_dir.mkdir(parents=True)
+            store = MetadataStore()
+            for i in range(1, files + 1):
+                text = f"ベンチマーク用の台本その{i * 2}です。今日は良い天気ですね。"
+                (audio_dir / f"audio_{i}.wav").write_bytes(b"")
+                (meta_dir / f"meta_{i}.txt").write_text(text, encoding='utf-8')
+                store.upsert(f"audio_{i}.wav", text)
+            store.close()
+
+            manager = TextManager()
+            manager.load_all_texts()
+            with quiet():
+                cold_ms, _ = timed(manager.sync_with_actual_files)
+                warm_ms, _ = timed(manager.sync_with_actual_files)
+            rows.append({'files': files, 'cold_ms': cold_ms, 'cached_ms': warm_ms,
+                         'matched': manager.recorded_index.recorded_count})
+            manager.close_session()
+    return rows
+
+def bench_cleanup(sizes):
+    """metadata.txt のエントリ数に対するクリーンアップ（コンパクション）の所要時間"""
+    rows = []
+    rng = random.Random(0)
+    for entries in sizes['metadata_entries']:
+        with workspace():
+            path = Path("dataset/metadata.txt")
+            path.parent.mkdir(parents=True)
+            with open(path, 'w', encoding='utf-8') as f:
+                names = list(range(1, entries + 1))
+                rng.shuffle(names)
+                for i in names:
+                    f.write(f"audio_{i}.wav|ベンチマーク用の台本その{i}です。\n")
+                for i in rng.sample(range(1, entries + 1), entries // 5):
+                    f.write(f"audio_{i}.wav|再録音した台本その{i}です。\n")
+            load_ms, store = timed(MetadataStore, path, compact_threshold=10 ** 9)
+            compact_ms, kept = timed(store.compact)
+            rows.append({'entries': entries, 'duplicates': entries // 5, 'load_ms': load_ms,
+                         'compact_ms': compact_ms, 'kept': kept})
+    return rows
+
+class ScriptedInput:
+    """input() の代わりに台本どおりの入力を返し、コマンドごとの処理時間を記録"""
+
+    def __init__(self, commands):
+        self.commands = list(commands)
+        self.lock = threading.Lock()
+        self.latencies = {}
+        self._last = None
+
+    def __call__(self, prompt=""):
+        with self.lock:
+            now = time.perf_counter()
+            if "コマンド" in prompt:
+                # 前のコマンドを返してから次のコマンド入力を求められるまで = 処理 + 画面描画
+                if self._last is not None:
+                    command, returned = self._last
+                    self.latencies.setdefault(command, []).append((now - returned) * 1000)
+                command = self.commands.pop(0) if self.commands else 'q'
+                self._last = (command, time.perf_counter())
+                return command
+            # Enter待ち・行番号入力・録音中のメーター表示など
+            return self.commands.pop(0) if self.commands else ''
+
+def shim_module(module, **overrides):
+    """モジュールの一部の関数だけを差し替えた代用品"""
+    namespace = {name: getattr(module, name) for name in dir(module) if not name.startswith('__')}
+    namespace.update(overrides)
+    return types.SimpleNamespace(**namespace)
+
+def bench_driver(sizes):
+    """台本どおりのコマンド操作で AudioDatasetCreator を動かし、コマンドごとの応答時間を計測"""
+    moves = sizes['driver_moves']
+    commands = (['n'] * moves + ['b'] * (moves // 2) + ['j', str(moves * 2)] + ['u'] * 10
+                + ['status', ''] + ['r', '', 'p'] + ['sync', ''] + ['cleanup', ''] + ['q'])
+    scripted = ScriptedInput(commands)
+
+    original = (main_module.time, main_module.os, main_module.input if hasattr(main_module, 'input') else None,
+                main_module.sys)
+    main_module.time = shim_module(time, sleep=lambda seconds: None)
+    main_module.os = shim_module(os, system=lambda command: 0)
+    # 端末から実行しても録音中のメーター表示は台本の入力で戻る
+    main_module.sys = shim_module(sys, stdin=io.StringIO())
+    main_module.input = scripted
+    try:
+        with workspace():
+            make_corpus(max(1000, moves * 4))
+            with quiet():
+                app = main_module.AudioDatasetCreator()
+                app.countdown = lambda seconds=3: None
+                total_ms, _ = timed(app.run)
+    finally:
+        main_module.time, main_module.os, main_module.sys = original[0], original[1], original[3]
+        if original[2] is None:
+            del main_module.input
+        else:
+            main_module.input = original[2]
+
+    return {
+        'total_ms': total_ms,
+        'commands': {command: summarize(values) for command, values in sorted(scripted.latencies.items())}
+    }
+
+@contextlib.contextmanager
+def devnull_fd(fd=1):
+    """子プロセス（clear コマンドなど）の出力も含めて fd を /dev/null へ向ける"""
+    sys.stdout.flush()
+    saved = os.dup(fd)
+    null = os.open(os.devnull, os.O_WRONLY)
+    os.dup2(null, fd)
+    try:
+        yield
+    finally:
+        os.dup2(saved, fd)
+        os.close(saved)
+        os.close(null)
+
+def bench_ui(sizes):
+    """1行移動あたりの画面更新（従来の全画面再表示と、変わった行だけの書き換え）"""
+    from terminal_ui import TerminalFrontend, Screen
+    moves = sizes['ui_moves']
+    with workspace():
+        make_corpus(max(1000, moves * 2))
+        with quiet():
+            app = main_module.AudioDatasetCreator()
+            app.start()
+
+        classic = []
+        with quiet(), devnull_fd():
+            for _ in range(moves):
+                start = time.perf_counter()
+                app.go_to_line(app.text_manager.current_line + 1)
+                app.display_interface()
+                classic.append((time.perf_counter() - start) * 1000)
+
+        class NullOut(io.StringIO):
+            def fileno(self):
+                raise OSError
+        screen = Screen(NullOut())
+        frontend = TerminalFrontend(app, screen=screen)
+        frontend.refresh()
+        incremental = []
+        written = screen.bytes_written
+        for _ in range(moves):
+            start = time.perf_counter()
+            frontend.handle_key('n')
+            frontend.refresh()
+            incremental.append((time.perf_counter() - start) * 1000)
+        bytes_per_move = (screen.bytes_written - written) / moves
+
+        with quiet():
+            app.shutdown()
+    return {
+        'moves': moves,
+        'classic_ms': summarize(classic),
+        'incremental_ms': summarize(incremental),
+        'incremental_bytes_per_move': bytes_per_move,
+    }
+
+def bench_startup(sizes):
+    """main.py を別プロセスで起動し、最初のコマンド入力までの時間を計測（初回・セッション復元時）"""
+    rows = []
+    main_path = SCRIPT_DIR.parent / "src" / "main.py"
+    for lines in sizes['startup_lines']:
+        with workspace():
+            make_corpus(lines)
+            row = {'lines': lines}
+            for run in ('first', 'restore'):
+                if run == 'restore':
+                    # 3行に1行が録音済みのセッションを用意
+                    manager = TextManager()
+                    manager.load_all_texts()
+                    for i in range(0, lines, 3):
+                        manager._set_recorded(i, f"audio_{i}.wav")
+                    manager.move_to(lines // 2)
+                    manager.save_session()
+                    manager.close_session()
+                start = time.perf_counter()
+                subprocess.run([sys.executable, str(main_path), '--metrics'], input="q\n",
+                               capture_output=True, text=True, env=dict(os.environ, TERM='dumb'))
+                row[f'{run}_wall_ms'] = (time.perf_counter() - start) * 1000
+                with open("data/metrics/metrics.jsonl", 'r', encoding='utf-8') as f:
+                    snapshot = json.loads(f.readlines()[-1])
+                row[f'{run}_prompt_ms'] = snapshot['gauges'].get('startup_seconds', float('nan')) * 1000
+            rows.append(row)
+    return rows
+
+def bench_service(sizes):
+    """録音サービスへ複数端末から同時に最大速度で音声を送信（1端末3テイク × 4秒）"""
+    import asyncio
+    from recording_service import RecordingService
+    from service_client import run_clients, http_json
+
+    async def session(service, stations):
+        ready = asyncio.Event()
+        server = asyncio.create_task(service.serve(port=0, ready=ready))
+        await ready.wait()
+        result = await run_clients("127.0.0.1", service.port, stations, 3, 4.0, speed=0)
+        _, stats = await http_json("127.0.0.1", service.port, 'GET', '/stats')
+        server.cancel()
+        return result, stats
+
+    rows = []
+    for stations in sizes['service_stations']:
+        with workspace():
+            make_corpus(stations * 4)
+            with quiet():
+                service = RecordingService(max_clients=stations)
+                service.start()
+                result, stats = asyncio.run(session(service, stations))
+                close_ms, _ = timed(service.close)
+            rows.append({
+                'stations': stations,
+                'takes': len(result['saved']),
+                'errors': len(result['errors']),
+                'elapsed_ms': result['elapsed'] * 1000,
+                'realtime_factor': result['audio_seconds'] / result['elapsed'],
+                'ingest_mb': stats['bytes'] / 1e6,
+                'drain_ms': close_ms,
+                'saved_entries': len(MetadataStore().entries),
+                'max_rss_mb': stats.get('max_rss_bytes', 0) / 1e6,
+            })
+    return rows
+
+def station_worker(station, takes, barrier, results):
+    """1台の録音端末（別プロセス）: 次の未録音行を予約 → 1秒録音（20倍速） → 保存、を繰り返す"""
+    fake_sounddevice.speed = 20
+    blocks = SAMPLE_RATE // BLOCK_SIZE
+    with quiet():
+        app = main_module.AudioDatasetCreator(station=station)
+        app.start()
+        app.wait_for_sync()
+    barrier.wait()
+    start = time.perf_counter()
+    saved = conflicts = 0
+    while saved < takes:
+        index = app.next_unrecorded_line()
+        if index is None:
+            break
+        app.go_to_line(index)
+        if app.claim_current_line() is not None:
+            conflicts += 1   # 行を選んでから予約するまでに他の端末が予約した
+            continue
+        record_take(app.audio_recorder, blocks)
+        with quiet():
+            if app.save_take():
+                saved += 1
+    with quiet():
+        app.shutdown()
+    results.put({'saved': saved, 'conflicts': conflicts, 'elapsed': time.perf_counter() - start})
+
+def bench_stations(sizes):
+    """複数の録音端末（プロセス）が同じデータセットへ同時に録音したときのスループットと整合性"""
+    rows = []
+    baseline = None
+    context = multiprocessing.get_context()
+    for count in sizes['station_counts']:
+        with workspace():
+            make_corpus(count * sizes['station_takes'] * 2)
+            barrier = context.Barrier(count)
+            results = context.Queue()
+            workers = [context.Process(target=station_worker,
+                                       args=(f"station{i + 1}", sizes['station_takes'], barrier, results))
+                       for i in range(count)]
+            for worker in workers:
+                worker.start()
+            reports = [results.get(timeout=600) for _ in workers]
+            for worker in workers:
+                worker.join()
+
+            saved = sum(r['saved'] for r in reports)
+            elapsed = max(r['elapsed'] for r in reports)
+            store = MetadataStore()
+            texts = [store.get(name) for name in store.entries]
+            manager = TextManager()
+            manager.load_session()
+            throughput = saved / elapsed
+            baseline = baseline or throughput
+            rows.append({
+                'stations': count,
+                'takes': saved,
+                'elapsed_ms': elapsed * 1000,
+                'takes_per_second': throughput,
+                'speedup': throughput / baseline,
+                'lease_conflicts': sum(r['conflicts'] for r in reports),
+                'lost_writes': saved - len(store.entries),
+                'duplicate_lines': len(texts) - len(set(texts)),
+                'session_recorded': manager.recorded_index.recorded_count,
+                'audio_files': len(list(Path("dataset/audio_files").glob("audio_*.wav"))),
+            })
+            manager.close_session()
+    return rows
+
+def bench_retake(sizes):
+    """撮り直し（テイク保管庫経由の保存）・ロールバック・GC の処理時間と保管庫の容量
+
+    全行を retake_rounds 回録音し直す。テイクの長さを行・回ごとに変えて内容を別にし、
+    最後に直前と同じ長さのテイクを録音して重複排除を確認する。
+    """
+    fake_sounddevice.speed = 0
+    blocks = SAMPLE_RATE // BLOCK_SIZE
+    lines = sizes['retake_lines']
+    rounds = []
+    with workspace():
+        make_corpus(lines)
+        with quiet():
+            app = main_module.AudioDatasetCreator()
+            app.start()
+            app.wait_for_sync()
+        store = app.take_store
+
+        def save_and_flush():
+            app.save_take()
+            app.save_pipeline.flush()
+
+        for round_number in range(sizes['retake_rounds']):
+            save_ms = []
+            for index in range(lines):
+                app.go_to_line(index)
+                record_take(app.audio_recorder, blocks + round_number * lines + index)
+                with quiet():
+                    ms, _ = timed(save_and_flush)
+                save_ms.append(ms)
+            stats = store.stats()
+            rounds.append({
+                'round': round_number + 1,
+                'save_ms': summarize(save_ms),
+                'store_takes': stats['takes'],
+                'store_mb': stats['bytes'] / 1e6,
+                'audio_files': len(list(Path("dataset/audio_files").glob("audio_*.wav"))),
+            })
+
+        before = store.stats()['takes']
+        app.go_to_line(0)
+        record_take(app.audio_recorder, blocks + (sizes['retake_rounds'] - 1) * lines)
+        with quiet():
+            save_and_flush()
+        dedup_new_takes = store.stats()['takes'] - before
+
+        rollback_ms = []
+        for index in range(lines):
+            versions, _ = app.text_manager.get_takes(index)
+            ms, error = timed(app.rollback_take, index, versions[0])
+            rollback_ms.append(ms)
+            assert error is None, error
+        gc_ms, gc_result = timed(store.gc, app.text_manager.referenced_takes(), 0)
+        result = {
+            'rounds': rounds,
+            'dedup_new_takes': dedup_new_takes,
+            'rollback_ms': summarize(rollback_ms),
+            'gc_ms': gc_ms,
+            'gc_removed': gc_result['removed'],
+            'gc_freed_mb': gc_result['freed_bytes'] / 1e6,
+            'store_takes_after_gc': store.stats()['takes'],
+            'max_versions_per_line': max(len(app.text_manager.get_takes(i)[0]) for i in range(lines)),
+        }
+        with quiet():
+            app.shutdown()
+    return result
+
+def audio_bytes(audio_dir="dataset/audio_files"):
+    """公開中のテイク（WAV・FLAC）の合計サイズ"""
+    return sum(entry.stat().st_size for entry in audio_io.scan_audio(audio_dir).values())
+
+def read_all_ms(names, audio_dir="dataset/audio_files"):
+    """テイクを audio_io で読み込んだときの1テイクあたりの時間（ミリ秒）"""
+    read_ms = []
+    for name in names:
+        def read():
+            samples, _ = audio_io.read_pcm16(Path(audio_dir) / name)
+            return int(np.asarray(samples).sum())   # メモリマップもすべて読ませる
+        ms, _ = timed(read)
+        read_ms.append(ms)
+    return summarize(read_ms)
+
+def bench_flac(sizes):
+    """FLAC 圧縮（--flac）の保存時間・圧縮速度・容量・読み込み時間
+
+    同じ長さのテイクを WAV のみと --flac の2通りで保存して比較する。WAV のみの
+    データセットは、保存後に FlacEncoder.sweep でまとめて圧縮して圧縮速度を測る。
+    合成音声はノイズが多いため、実際の録音より圧縮率は低めに出る。
+    """
+    fake_sounddevice.speed = 0
+    blocks = SAMPLE_RATE * sizes['flac_take_seconds'] // BLOCK_SIZE
+    lines = sizes['flac_lines']
+    result = {'takes': lines, 'take_seconds': sizes['flac_take_seconds']}
+    for mode in ('wav', 'flac'):
+        with workspace():
+            make_corpus(lines)
+            with quiet():
+                app = main_module.AudioDatasetCreator(flac=mode == 'flac')
+                app.start()
+                app.wait_for_sync()
+
+            submit_ms, save_ms = [], []
+            for index in range(lines):
+                app.go_to_line(index)
+                record_take(app.audio_recorder, blocks + index)   # 長さを変えて内容を別にする
+                with quiet():
+                    ms, _ = timed(app.save_take)
+                    flush_ms, _ = timed(app.save_pipeline.flush)
+                submit_ms.append(ms)
+                save_ms.append(ms + flush_ms)
+            # submit: 画面へ戻るまで / save: ファイルの公開・セッションへの反映まで
+            result[f'submit_ms_{mode}'] = summarize(submit_ms)
+            result[f'save_ms_{mode}'] = summarize(save_ms)
+            names = sorted(app.text_manager.audio_files.values())
+
+            if mode == 'wav':
+                result['bytes_wav'] = audio_bytes()
+                result['read_ms_wav'] = read_all_ms(names)
+                encoder = FlacEncoder(app.take_store)
+                with quiet():
+                    encode_ms, _ = timed(lambda: (encoder.sweep(app.text_manager.published_takes()),
+                                                  encoder.wait()))
+                encoder.close()
+                audio_seconds = encoder.counts['encoded'] * blocks * BLOCK_SIZE / SAMPLE_RATE
+                result['sweep_encoded'] = encoder.counts['encoded']
+                result['sweep_failed'] = encoder.counts['failed']
+                result['encode_mb_per_s'] = encoder.counts['bytes_before'] / 1e6 / (encode_ms / 1000)
+                result['encode_realtime_factor'] = audio_seconds / (encode_ms / 1000)
+                result['bytes_after_sweep'] = audio_bytes()
+            else:
+                drain_ms, _ = timed(app.flac_encoder.wait)
+                result['flac_drain_ms'] = drain_ms
+                result['flac_failed'] = app.flac_encoder.counts['failed']
+                result['bytes_flac'] = audio_bytes()
+                result['flac_files'] = sum(entry.name.endswith('.flac')
+                                           for entry in audio_io.scan_audio("dataset/audio_files").values())
+                result['read_ms_flac'] = read_all_ms(names)
+                result['store'] = app.take_store.stats()
+            with quiet():
+                app.shutdown()
+    result['reduction_percent'] = 100 * (1 - result['bytes_flac'] / result['bytes_wav'])
+    return result
+
+def make_indexed_dataset(takes, sources=8):
+    """索引用の合成データセット（metadata.txt・session.json・ヘッダのみの WAV）
+
+    WAV はヘッダの後を疎ファイルで伸ばすだけなので、件数が多くてもすぐに作れる。
+    2行ずつ同じテキスト（同じ原稿内の重複）にし、10行に1行は録り直し済みにする。
+    原稿ファイルごとに別の話者とする対応表も作る。
+    """
+    audio_dir = Path("dataset/audio_files")
+    audio_dir.mkdir(parents=True)
+    recorded, take_table = [], []
+    with open("dataset/metadata.txt", 'w', encoding='utf-8') as f:
+        for i in range(1, takes + 1):
+            name = f"audio_{i}.wav"
+            source, line = f"src{(i // 2) % sources}.txt", i
+            f.write(f"{name}|ベンチマーク用の台本その{i // 2}です。今日は良い天気ですね。\n")
+            recorded.append([source, line, name])
+            if i % 10 == 0:
+                take_table.append([source, line, [f"{i:032x}", f"{i + 1:032x}"], f"{i + 1:032x}"])
+            frames = SAMPLE_RATE * (1 + i % 12)
+            with open(audio_dir / name, 'wb') as wav:
+                wav.write(b'RIFF' + (36 + frames * 2).to_bytes(4, 'little') + b'WAVEfmt '
+                          + (16).to_bytes(4, 'little')
+                          + np.array([1, 1], dtype='<u2').tobytes()
+                          + np.array([SAMPLE_RATE, SAMPLE_RATE * 2], dtype='<u4').tobytes()
+                          + np.array([2, 16], dtype='<u2').tobytes()
+                          + b'data' + (frames * 2).to_bytes(4, 'little'))
+                wav.truncate(44 + frames * 2)
+    Path("data").mkdir(exist_ok=True)
+    with open("data/session.json", 'w', encoding='utf-8') as f:
+        json.dump({'version': 2, 'current_index': 0, 'cursors': {}, 'recorded': recorded,
+                   'takes': take_table}, f, ensure_ascii=False)
+    with open("dataset/speakers.tsv", 'w', encoding='utf-8') as f:
+        for s in range(sources):
+            f.write(f"src{s}.txt\tspeaker{s}\n")
+
+def bench_index(sizes):
+    """テイク数に対する索引の作成・キャッシュからの読み込み・絞り込み・分割の所要時間
+
+    絞り込みは音声ファイルを開かずに索引の列だけで行う。追加後の再作成は、1テイク
+    追加した状態での読み込み（他のテイクはヘッダを読み直さない）。
+    """
+    queries = {
+        'source': lambda index: index.filter(source='src3.txt'),
+        'duration_range': lambda index: index.filter(min_duration=2, max_duration=10),
+        'first_take_only': lambda index: index.filter(in_session=True, max_takes=1),
+        'combined_sort_sample': lambda index: index.filter(
+            source=['src1.txt', 'src2.txt'], min_duration=2, max_duration=10, max_takes=1
+        ).sort('duration', descending=True).sample(n=1000, seed=1),
+    }
+    rows = []
+    for takes in sizes['index_takes']:
+        with workspace():
+            make_indexed_dataset(takes)
+            cold_ms, index = timed(DatasetIndex.load)
+            warm_ms, index = timed(DatasetIndex.load)
+
+            row = {'takes': takes, 'build_ms': cold_ms, 'cached_load_ms': warm_ms,
+                   'cache_bytes': os.path.getsize("dataset/index_cache.npz")}
+            for name, query in queries.items():
+                samples = []
+                for _ in range(20):
+                    ms, result = timed(query, index)
+                    samples.append(ms)
+                row[f'query_ms_{name}'] = summarize(samples)
+                row[f'query_rows_{name}'] = len(result)
+            row['text_contains_ms'], _ = timed(index.filter, text_contains='その123です')
+
+            for disjoint in (('text',), ('speaker', 'text')):
+                ms, (splits, report) = timed(split_dataset, index, disjoint=disjoint, seed=0)
+                _, (again, _) = timed(split_dataset, index, disjoint=disjoint, seed=0)
+                key = '_'.join(disjoint)
+                row[f'split_ms_{key}'] = ms
+                row[f'split_takes_{key}'] = {name: len(part) for name, part in splits.items()}
+                row[f'split_overlap_{key}'] = report['overlap']
+                row[f'split_deterministic_{key}'] = all(
+                    np.array_equal(splits[name].rows, again[name].rows) for name in splits)
+
+            # 1テイク追加（metadata.txt への追記・WAV・ジャーナル）してから読み込み
+            new_name = f"audio_{takes + 1}.wav"
+            with open("dataset/metadata.txt", 'a', encoding='utf-8') as f:
+                f.write(f"{new_name}|追加したテイクです。\n")
+            (Path("dataset/audio_files") / f"audio_{takes}.wav").rename(
+                Path("dataset/audio_files") / new_name)
+            with open("data/session.journal", 'w', encoding='utf-8') as f:
+                f.write(json.dumps({'op': 'recorded', 'file': 'src0.txt', 'line_number': takes + 1,
+                                    'audio_file': new_name, 'recorded': True}) + "\n")
+            row['rebuild_after_add_ms'], index = timed(DatasetIndex.load)
+            row['rebuilt_takes'] = len(index)
+            rows.append(row)
+    return rows
+
+BENCHMARKS = {
+    'callback': bench_callback,
+    'stop_save': bench_stop_save,
+    'session': bench_session,
+    'sync': bench_sync,
+    'cleanup': bench_cleanup,
+    'driver': bench_driver,
+    'startup': bench_startup,
+    'ui': bench_ui,
+    'service': bench_service,
+    'stations': bench_stations,
+    'retake': bench_retake,
+    'flac': bench_flac,
+    'index': bench_index,
+}
+
+def environment():
+    """結果の比較用に実行環境を記録"""
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=SCRIPT_DIR,
+                                capture_output=True, text=True).stdout.strip() or None
+    except OSError:
+        commit = None
+    return {
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'commit': commit,
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count()
+    }
+
+def flatten(value, prefix=""):
+    """比較用に入れ子の結果を「キー.キー → 数値」へ展開"""
+    if isinstance(value, dict):
+        items = {}
+        for key, item in value.items():
+            items.update(flatten(item, f"{prefix}.{key}" if prefix else str(key)))
+        return items
+    if isinstance(value, list):
+        items = {}
+        for i, item in enumerate(value):
+            items.update(flatten(item, f"{prefix}[{i}]"))
+        return items
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return {prefix: float(value)}
+    return {}
+
+def compare(base_path, results, threshold):
+    """以前の結果と比較し、時間が threshold 倍以上に増えた項目を表示"""
+    with open(base_path, 'r', encoding='utf-8') as f:
+        base = flatten(json.load(f)['results'])
+    current = flatten(results)
+    regressions = 0
+    for key, value in current.items():
+        old = base.get(key)
+        if old is None or old <= 0 or not key.endswith(('_ms', '_us', 'mean', 'p50', 'p95', 'p99')):
+            continue
+        ratio = value / old
+        if ratio >= threshold:
+            regressions += 1
+            print(f"⚠️ {key}: {old:.3f} → {value:.3f} ({ratio:.2f} 倍)")
+    print(f"📊 比較: {base_path} に対して悪化 {regressions} 件（{threshold:.2f} 倍以上）")
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description="音声デバイス不要のベンチマーク")
+    parser.add_argument("--only", nargs='+', choices=sorted(BENCHMARKS), help="実行するベンチマーク")
+    parser.add_argument("--quick", action="store_true", help="小さい規模で実行")
+    parser.add_argument("--output", default="benchmark_results.json", help="結果のJSONファイル")
+    parser.add_argument("--compare", help="比較対象の以前の結果（JSON）")
+    parser.add_argument("--threshold", type=float, default=1.2, help="悪化とみなす倍率")
+    args = parser.parse_args()
+
+    output = Path(args.output).resolve()
+    sizes = QUICK_SIZES if args.quick else FULL_SIZES
+    results = {}
+    for name in args.only or BENCHMARKS:
+        print(f"⏱️ {name} ...", end="", flush=True)
+        elapsed, results[name] = timed(BENCHMARKS[name], sizes)
+        print(f" {elapsed / 1000:.1f} 秒")
+
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump({'environment': environment(), 'quick': args.quick, 'results': results},
+                  f, ensure_ascii=False, indent=2)
+    print(f"💾 結果を保存しました: {output}")
+
+    if args.compare:
+        compare(args.compare, results, args.threshold)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,42 @@
+# convert_audio.py
+# 録音済みテイクを学習用のサンプルレート・チャンネル数・ビット深度へ一括変換する
+#
+#   python script/convert_audio.py                          # 22.05kHz / モノラル / 16bit
+#   python script/convert_audio.py --rate 16000 22050       # 複数の仕様をまとめて出力
+#   python script/convert_audio.py --normalize loudness --level-db -23
+#
+# 出力先は dataset/converted/<仕様名>/ 。変換元の内容が変わっていないファイルはスキップする。
+import sys
+import time
+import argparse
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "src"))
+from audio_convert import make_spec, convert_dataset, SUBTYPES
+
+def main():
+    parser = argparse.ArgumentParser(description="録音ファイルの一括リサンプリング・形式変換")
+    parser.add_argument("--input", default="dataset/audio_files", help="入力ディレクトリ")
+    parser.add_argument("--output", default="dataset/converted", help="出力先のルートディレクトリ")
+    parser.add_argument("--rate", type=int, nargs='+', default=[22050], help="変換後のサンプルレート（複数指定可）")
+    parser.add_argument("--channels", type=int, default=1, help="変換後のチャンネル数")
+    parser.add_argument("--bit-depth", type=int, default=16, choices=sorted(SUBTYPES), help="変換後のビット深度")
+    parser.add_argument("--normalize", choices=['peak', 'loudness'], help="正規化方式")
+    parser.add_argument("--level-db", type=float, help="正規化の目標レベル（dBFS）")
+    parser.add_argument("--workers", type=int, default=None, help="並列数（既定: CPUコア数）")
+    args = parser.parse_args()
+
+    for rate in args.rate:
+        spec = make_spec(rate, args.channels, args.bit_depth, args.normalize, args.level_db)
+        start = time.perf_counter()
+        result = convert_dataset(spec, args.input, args.output, args.workers,
+                                 progress=lambda i, n: print(f"   {i}/{n} 件完了") if i % 100 == 0 else None)
+        elapsed = time.perf_counter() - start
+        counts = result['counts']
+        for error in result['errors']:
+            print(f"❌ {error}")
+        print(f"✅ {result['output_dir']}: 変換 {counts['done']} / スキップ {counts['skipped']}"
+              f" / 失敗 {counts['failed']} ({elapsed:.1f} 秒)")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,138 @@
+# dataset_index.py
+# 録音済みテイクの索引から条件に合うテイクを抽出し、学習用の分割マニフェストを書き出す
+#
+#   python script/dataset_index.py                                     # 概要
+#   python script/dataset_index.py query --source cocoro.txt --min-duration 2 --max-duration 10
+#   python script/dataset_index.py query --first-take-only --sort duration --limit 20
+#   python script/dataset_index.py split --output dataset/splits --fractions 0.8 0.1 0.1 --seed 0
+#   python script/dataset_index.py split --disjoint speaker text --format jsonl
+#
+# 絞り込みのオプションはサブコマンドの後に書く。
+# 話者は dataset/speakers.tsv（1行に「パターン<TAB>話者名」）で原稿ファイル名・音声ファイル名から決める。
+# 対応表がなければ全テイクが同じ話者 default になる。
+import sys
+import time
+import argparse
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "src"))
+from dataset_index import DatasetIndex, split_dataset, write_manifests, SPLIT_NAMES
+
+def apply_filters(index, args):
+    """共通の絞り込みオプションを適用"""
+    conditions = {}
+    if args.source:
+        conditions['source'] = args.source
+    if args.speaker:
+        conditions['speaker'] = args.speaker
+    if args.min_duration is not None:
+        conditions['min_duration'] = args.min_duration
+    if args.max_duration is not None:
+        conditions['max_duration'] = args.max_duration
+    if args.sample_rate is not None:
+        conditions['sample_rate'] = args.sample_rate
+    if args.first_take_only:
+        conditions['max_takes'] = 1
+    if args.contains:
+        conditions['text_contains'] = args.contains
+    # 音声ファイルがないテイクと、録り直しで行から外れた古いテイクは常に除く
+    index = index.filter(exists=True, in_session=True, **conditions)
+    if args.sample is not None:
+        index = index.sample(n=args.sample, seed=args.seed)
+    return index
+
+def print_summary(index):
+    summary = index.summary()
+    print(f"📊 テイク: {summary['takes']} 件 / 合計 {summary['hours']:.2f} 時間"
+          f"（FLAC {summary['flac']} 件, 音声なし {summary['missing_audio']} 件）")
+    for source, count in summary['sources'].items():
+        print(f"   📄 {source or '(セッションに記録なし)'}: {count} 件")
+    for speaker, count in summary['speakers'].items():
+        print(f"   🗣️ {speaker}: {count} 件")
+
+def main():
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument("--dataset-dir", default="dataset")
+    common.add_argument("--session", default="data/session.json")
+    common.add_argument("--speakers", default=None, help="話者の対応表（既定: dataset/speakers.tsv）")
+    common.add_argument("--rebuild", action="store_true", help="キャッシュを使わずに索引を作り直す")
+    common.add_argument("--source", action="append", help="原稿ファイル名（複数指定可）")
+    common.add_argument("--speaker", action="append", help="話者名（複数指定可）")
+    common.add_argument("--min-duration", type=float, default=None, help="最短の長さ（秒）")
+    common.add_argument("--max-duration", type=float, default=None, help="最長の長さ（秒）")
+    common.add_argument("--sample-rate", type=int, default=None)
+    common.add_argument("--first-take-only", action="store_true", help="録り直した行を除く")
+    common.add_argument("--contains", default=None, help="テキストに含む文字列")
+    common.add_argument("--sample", type=int, default=None, help="ランダムに抽出する件数")
+    common.add_argument("--seed", type=int, default=0)
+
+    parser = argparse.ArgumentParser(description="録音データセットの索引・分割", parents=[common])
+    commands = parser.add_subparsers(dest="command")
+    query = commands.add_parser("query", parents=[common], help="条件に合うテイクを一覧表示")
+    query.add_argument("--sort", nargs='+', default=["name"], help="並べ替える列")
+    query.add_argument("--descending", action="store_true")
+    query.add_argument("--limit", type=int, default=50)
+    query.add_argument("--names-only", action="store_true", help="音声ファイル名だけを出力")
+    split = commands.add_parser("split", parents=[common], help="学習・検証・評価用のマニフェストを書き出す")
+    split.add_argument("--output", default="dataset/splits", help="出力ディレクトリ")
+    split.add_argument("--fractions", type=float, nargs=len(SPLIT_NAMES), default=[0.8, 0.1, 0.1],
+                       metavar=tuple(n.upper() for n in SPLIT_NAMES))
+    split.add_argument("--disjoint", nargs='*', default=None, choices=["speaker", "text"],
+                       help="複数の分割にまたがらせないもの（既定: 話者が複数なら speaker text、1人なら text）")
+    split.add_argument("--format", choices=["txt", "jsonl"], default="txt")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    index = DatasetIndex.load(args.dataset_dir, args.session, speaker_map=args.speakers, rebuild=args.rebuild)
+    loaded = time.perf_counter()
+    try:
+        selected = apply_filters(index, args)
+    except ValueError as e:
+        print(f"❌ {e}")
+        sys.exit(1)
+    elapsed_ms = (time.perf_counter() - loaded) * 1000
+    print(f"🗂️ 索引: {len(index)} テイク（読み込み {loaded - start:.2f} 秒, 絞り込み {elapsed_ms:.1f} ms）"
+          f" → {len(selected)} 件", file=sys.stderr)
+
+    if args.command == "query":
+        try:
+            selected = selected.sort(*args.sort, descending=args.descending)
+        except ValueError as e:
+            print(f"❌ {e}")
+            sys.exit(1)
+        shown = selected.head(args.limit)
+        for record in shown.records():
+            if args.names_only:
+                print(record['name'])
+            else:
+                print(f"{record['name']}\t{record['duration']:.2f}s\t{record['source']}:{record['line']}"
+                      f"\t{record['speaker']}\t{record['text']}")
+        if len(selected) > len(shown):
+            print(f"... 他 {len(selected) - len(shown)} 件（--limit で変更）", file=sys.stderr)
+    elif args.command == "split":
+        disjoint = args.disjoint
+        if disjoint is None:
+            disjoint = ["speaker", "text"] if len(set(selected['speaker'].tolist())) > 1 else ["text"]
+        splits, report = split_dataset(selected, args.fractions, SPLIT_NAMES, disjoint, args.seed)
+        report['filters'] = {key: value for key, value in vars(args).items()
+                             if key in ('source', 'speaker', 'min_duration', 'max_duration', 'sample_rate',
+                                        'first_take_only', 'contains', 'sample') and value not in (None, False)}
+        paths = write_manifests(splits, report, args.output, args.format)
+        for name, part in report['splits'].items():
+            print(f"✂️ {name}: {part['takes']} 件 / {part['hours']:.2f} 時間"
+                  f"（目標 {part['target']:.0%}, 話者 {part['speakers']}, テキスト {part['texts']}）")
+        if report['groups'] < len(SPLIT_NAMES):
+            print(f"⚠️ 話者・テキストでまとめたグループが {report['groups']} 個しかないため、"
+                  f"空の分割があります（--disjoint を見直してください）")
+        elif report['largest_group_share'] > min(args.fractions) / sum(args.fractions):
+            print(f"⚠️ 最大のグループが全体の {report['largest_group_share']:.0%} を占めるため、"
+                  f"比率どおりに分割できません")
+        for key in report['disjoint']:
+            if report['overlap'][key]:
+                print(f"❌ {key} が複数の分割にまたがっています: {report['overlap'][key]} 件")
+        print(f"💾 {', '.join(str(p) for p in paths)}")
+    else:
+        print_summary(selected)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,56 @@
+# export_shards.py
+# 録音済みテイクを学習用の大きなシャードファイルへまとめて書き出す
+#
+#   python script/export_shards.py                    # 新規・変更されたテイクを追記
+#   python script/export_shards.py --shard-size-mb 512
+#   python script/export_shards.py --verify           # チェックサムを検証
+#   python script/export_shards.py --compact-ratio 0  # 参照されなくなったデータを必ず回収
+#
+# 読み出し側は ShardReader を使う:
+#   reader = ShardReader("dataset/shards")
+#   samples = reader["audio_1.wav"]   # int16 のメモリマップスライス（コピーなし）
+import sys
+import time
+import argparse
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "src"))
+from metadata_store import MetadataStore
+from shard_export import export_dataset, ShardReader, COMPACT_RATIO
+
+def main():
+    parser = argparse.ArgumentParser(description="録音データセットのシャード書き出し")
+    parser.add_argument("--audio-dir", default="dataset/audio_files")
+    parser.add_argument("--metadata", default="dataset/metadata.txt")
+    parser.add_argument("--output", default="dataset/shards", help="出力ディレクトリ")
+    parser.add_argument("--shard-size-mb", type=int, default=1024, help="1シャードの最大サイズ（MB）")
+    parser.add_argument("--compact-ratio", type=float, default=COMPACT_RATIO,
+                        help="録り直し・削除で参照されなくなったデータがこの割合を超えたらシャードを詰め直す")
+    parser.add_argument("--verify", action="store_true", help="書き出し後に全テイクのチェックサムを検証")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    result = export_dataset(args.audio_dir, MetadataStore(args.metadata), args.output, args.shard_size_mb,
+                            args.compact_ratio)
+    elapsed = time.perf_counter() - start
+
+    for error in result['errors']:
+        print(f"❌ {error}")
+    print(f"📦 シャード書き出し: 追加 {result['added']} / 変更なし {result['skipped']}"
+          f" / 削除 {result['removed']} / 失敗 {len(result['errors'])} ({elapsed:.2f} 秒)")
+    if result['reclaimed']:
+        print(f"🧹 シャードを詰め直し: {result['reclaimed'] / (1024 * 1024):.1f} MB 回収")
+
+    reader = ShardReader(args.output)
+    shards = reader.manifest['shards']
+    total_mb = sum(shard['bytes'] for shard in shards) / (1024 * 1024)
+    print(f"💾 {args.output}: {len(reader)} テイク / {len(shards)} シャード / {total_mb:.1f} MB")
+
+    if args.verify:
+        bad = reader.verify()
+        for name in bad:
+            print(f"⚠️ チェックサム不一致: {name}")
+        print(f"🔍 検証完了: 不一致 {len(bad)} 件")
+
+if __name__ == "__main__":
+    main()
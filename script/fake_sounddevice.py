@@ -0,0 +1,136 @@
+# fake_sounddevice.py
+# 音声デバイスのない環境でのベンチマーク用に sounddevice を模擬する
+#
+#   import fake_sounddevice
+#   fake_sounddevice.install(stream_speed=0)   # audio_recorder を import する前に呼ぶ
+#
+# InputStream は合成した音声ブロックを別スレッドからコールバックへ送る。
+# speed=1 で実時間、speed=N で N 倍速、speed=0 で待ち時間なし（最大速度）。
+import sys
+import time
+import threading
+import functools
+
+import numpy as np
+
+BLOCK_SIZE = 512
+speed = 0.0
+max_blocks = None   # 1ストリームで送るブロック数の上限（None なら停止まで送り続ける）
+streams = []        # 作成された InputStream（計測結果の参照用）
+played = []         # play() に渡された (フレーム数, サンプルレート)
+
+class CallbackFlags:
+    """sounddevice.CallbackFlags の代わり"""
+
+    def __init__(self, input_overflow=False, input_underflow=False):
+        self.input_overflow = input_overflow
+        self.input_underflow = input_underflow
+
+    def __bool__(self):
+        return self.input_overflow or self.input_underflow
+
+    def __str__(self):
+        flags = [name for name in ('input overflow', 'input underflow')
+                 if getattr(self, name.replace(' ', '_'))]
+        return ', '.join(flags)
+
+class CallbackStop(Exception):
+    pass
+
+@functools.lru_cache(maxsize=8)
+def synth_blocks(sample_rate, channels, dtype, block_size, seed=0):
+    """無音と発話（振幅変調したノイズ）を交互に繰り返すブロックの列（ストリーム間で共有）"""
+    rng = np.random.default_rng(seed)
+    seconds = 4
+    n = sample_rate * seconds
+    t = np.arange(n) / sample_rate
+    envelope = np.where((t % 2.0) < 1.4, 0.3 * (0.6 + 0.4 * np.sin(2 * np.pi * 4 * t)), 0.002)
+    signal = (rng.standard_normal((n, channels)) * envelope[:, None]).clip(-1, 1).astype(np.float32)
+    if np.dtype(dtype) == np.int16:
+        signal = (signal * 32767).astype(np.int16)
+    return [signal[i:i + block_size] for i in range(0, n - block_size + 1, block_size)]
+
+class InputStream:
+    """合成ブロックを一定周期でコールバックへ送る入力ストリーム"""
+
+    def __init__(self, callback=None, samplerate=44100, channels=1, dtype='float32',
+                 blocksize=None, **kwargs):
+        self.callback = callback
+        self.samplerate = samplerate
+        self.channels = channels
+        self.blocksize = blocksize or BLOCK_SIZE
+        self.speed = speed
+        self.max_blocks = max_blocks
+        self._blocks = synth_blocks(samplerate, channels, dtype, self.blocksize)
+        self._stop = threading.Event()
+        self._thread = None
+        self.active = False
+
+        # 計測結果
+        self.blocks_sent = 0
+        self.callback_ns = []   # 1ブロックごとのコールバック処理時間
+        self.jitter_ms = []     # 予定時刻からの遅れ（実時間・倍速モードのみ）
+        streams.append(self)
+
+    def _run(self):
+        period = self.blocksize / self.samplerate / self.speed if self.speed else 0.0
+        start = time.perf_counter()
+        flags = CallbackFlags()
+        while not self._stop.is_set():
+            if self.max_blocks is not None and self.blocks_sent >= self.max_blocks:
+                break
+            if period:
+                due = start + self.blocks_sent * period
+                delay = due - time.perf_counter()
+                if delay > 0 and self._stop.wait(delay):
+                    break
+                self.jitter_ms.append((time.perf_counter() - due) * 1000)
+            block = self._blocks[self.blocks_sent % len(self._blocks)]
+            t0 = time.perf_counter_ns()
+            try:
+                self.callback(block, len(block), None, flags)
+            except CallbackStop:
+                break
+            self.callback_ns.append(time.perf_counter_ns() - t0)
+            self.blocks_sent += 1
+
+    def start(self):
+        self.active = True
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        self.active = False
+
+    def close(self):
+        self.stop()
+
+    def wait_blocks(self, count, timeout=60):
+        """指定ブロック数を送り終えるまで待つ"""
+        deadline = time.perf_counter() + timeout
+        count = min(count, self.max_blocks) if self.max_blocks is not None else count
+        while self.blocks_sent < count and time.perf_counter() < deadline:
+            time.sleep(0.001)
+
+def play(data, samplerate=None, **kwargs):
+    played.append((len(data), samplerate))
+
+def wait():
+    pass
+
+def stop():
+    pass
+
+def query_devices(device=None, kind=None):
+    info = {'name': 'Fake Input', 'max_input_channels': 2, 'max_output_channels': 2,
+            'default_samplerate': 44100.0}
+    return info if (device is not None or kind is not None) else [info]
+
+def install(stream_speed=0.0):
+    """sys.modules の sounddevice を差し替える（stream_speed: 入力ストリームの速度）"""
+    global speed
+    speed = stream_speed
+    sys.modules['sounddevice'] = sys.modules[__name__]
@@ -1,11 +1,194 @@
+# noiser.py
+# dataset/audio_files 以下の全テイク（WAV・FLAC）をプロセスプールで並列にノイズ除去する
+#
+#   python script/noiser.py                       # 全ファイルを処理
+#   python script/noiser.py --workers 4           # ワーカー数を指定
+#   python script/noiser.py --file audio_1.wav    # 1ファイルのみ
+#
+# 処理済みファイルは音声の内容のハッシュで管理し、変更のないファイル（FLAC に圧縮されただけの
+# ファイルを含む）はスキップする。サイズと更新時刻が前回の記録と同じファイルはハッシュも
+# 計算せずにスキップし、違う場合だけ内容を読んで比較する。出力は常に WAV で、ファイル名は audio_N.wav のまま。
+# 中断しても、再実行すれば未処理のファイルから再開される。
+import os
+import sys
+import json
+import time
+import argparse
+from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
 import noisereduce as nr
 import soundfile as sf
 
-# 録音後のWAVファイルを読み込む
-data, rate = sf.read('dataset/audio_files/audio_1.wav')
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "src"))
+from audio_io import AUDIO_SUFFIXES, logical_name, pcm_hash, resolve
+
+CACHE_NAME = ".denoise_cache.jsonl"
+
+def reduce_block(block, noise, rate, prop_decrease):
+    """1ブロック分のノイズ除去（block: (フレーム数, チャンネル数)）"""
+    if block.shape[1] == 1:
+        return nr.reduce_noise(y=block[:, 0], sr=rate, y_noise=noise[:, 0],
+                               prop_decrease=prop_decrease)[:, None]
+    return nr.reduce_noise(y=block.T, sr=rate, y_noise=noise.T,
+                           prop_decrease=prop_decrease).T
+
+def denoise_file(src, dst, chunk_seconds, overlap_seconds, noise_seconds, prop_decrease):
+    """長いファイルも一定メモリで処理できるよう、重なりを持たせたチャンク単位でノイズ除去"""
+    temp = dst.with_name(f".{dst.name}.tmp")
+    with sf.SoundFile(str(src)) as f:
+        rate = f.samplerate
+        chunk_frames = int(rate * chunk_seconds)
+        overlap_frames = int(rate * overlap_seconds)
+
+        # 最初の noise_seconds 秒をノイズプロファイルとして使う
+        noise = f.read(int(rate * noise_seconds), dtype='float32', always_2d=True)
+        f.seek(0)
+
+        with sf.SoundFile(str(temp), 'w', rate, f.channels, subtype=f.subtype, format='WAV') as out:
+            tail = None
+            for block in f.blocks(blocksize=chunk_frames + overlap_frames, overlap=overlap_frames,
+                                  dtype='float32', always_2d=True):
+                reduced = reduce_block(block, noise, rate, prop_decrease)
+
+                # 前のチャンクと重なる部分はクロスフェードでつなぐ
+                if tail is not None:
+                    n = min(len(tail), len(reduced))
+                    fade = np.linspace(0.0, 1.0, n, dtype=np.float32)[:, None]
+                    reduced[:n] = tail[:n] * (1 - fade) + reduced[:n] * fade
+
+                if len(block) < chunk_frames + overlap_frames:
+                    out.write(reduced)
+                    tail = None
+                else:
+                    out.write(reduced[:-overlap_frames])
+                    tail = reduced[-overlap_frames:]
+            if tail is not None:
+                out.write(tail)
+
+    os.replace(temp, dst)
+
+def process(src, dst, cached_hash, params):
+    """ワーカープロセスで1ファイルを処理（返り値: (状態, ハッシュ)）"""
+    digest = pcm_hash(src)
+    if digest == cached_hash and dst.exists():
+        return 'skipped', digest
+    dst.parent.mkdir(parents=True, exist_ok=True)
+    denoise_file(src, dst, **params)
+    return 'done', digest
+
+def cache_record(rel, digest, st, params_key):
+    """処理済みファイルの記録（入力のサイズ・更新時刻はハッシュを省くための目印）"""
+    return {'file': rel, 'hash': digest, 'size': st.st_size, 'mtime': st.st_mtime_ns, 'params': params_key}
+
+def unchanged(record, st):
+    """前回の記録からサイズ・更新時刻が変わっていないか（古い形式の記録は False）"""
+    return record is not None and (record.get('size'), record.get('mtime')) == (st.st_size, st.st_mtime_ns)
+
+def load_cache(cache_path, params_key):
+    """処理済みファイルの一覧を読み込み（パラメータが異なる記録は無視）"""
+    cache = {}
+    if cache_path.exists():
+        with open(cache_path, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    continue  # 中断時の書きかけの行
+                if record.get('params') == params_key:
+                    cache[record['file']] = record
+    return cache
+
+def compact_cache(cache_path, cache, params_key):
+    """処理済みファイルの一覧を1ファイル1行に詰め直す"""
+    temp = cache_path.with_suffix('.tmp')
+    with open(temp, 'w', encoding='utf-8') as f:
+        for rel, record in sorted(cache.items()):
+            f.write(json.dumps(dict(record, params=params_key), ensure_ascii=False) + "\n")
+    os.replace(temp, cache_path)
+
+def main():
+    parser = argparse.ArgumentParser(description="録音ファイルの一括ノイズ除去")
+    parser.add_argument("--input", default="dataset/audio_files", help="入力ディレクトリ")
+    parser.add_argument("--output", default="dataset/audio_files_denoised", help="出力ディレクトリ")
+    parser.add_argument("--file", help="指定したファイルのみ処理（入力ディレクトリからの相対パス）")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="並列数（既定: CPUコア数）")
+    parser.add_argument("--noise-seconds", type=float, default=0.5, help="ノイズプロファイルに使う先頭の秒数")
+    parser.add_argument("--chunk-seconds", type=float, default=30.0, help="1チャンクの長さ（秒）")
+    parser.add_argument("--overlap-seconds", type=float, default=0.5, help="チャンク間の重なり（秒）")
+    parser.add_argument("--prop-decrease", type=float, default=1.0, help="ノイズ除去の強さ（0〜1）")
+    args = parser.parse_args()
+
+    input_dir = Path(args.input)
+    output_dir = Path(args.output)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    params = {
+        'chunk_seconds': args.chunk_seconds,
+        'overlap_seconds': args.overlap_seconds,
+        'noise_seconds': args.noise_seconds,
+        'prop_decrease': args.prop_decrease
+    }
+
+    # パラメータが変わった場合は全ファイルを処理し直す
+    cache_path = output_dir / CACHE_NAME
+    params_key = json.dumps(params, sort_keys=True)
+    cache = load_cache(cache_path, params_key)
+
+    if args.file:
+        sources = [resolve(input_dir / args.file) or input_dir / args.file]
+    else:
+        # FLAC への置き換え途中で両方ある場合は WAV を使う
+        found = {}
+        for p in sorted(input_dir.rglob("*"), key=lambda p: p.suffix != ".wav"):
+            if p.suffix in AUDIO_SUFFIXES and not p.name.startswith('.'):
+                found.setdefault(logical_name(p.relative_to(input_dir).as_posix()), p)
+        sources = [found[rel] for rel in sorted(found)]
+    print(f"🔇 ノイズ除去: {len(sources)} ファイル / {args.workers} ワーカー")
+
+    start = time.perf_counter()
+    counts = {'done': 0, 'skipped': 0, 'failed': 0}
+    with ProcessPoolExecutor(max_workers=args.workers) as executor, \
+            open(cache_path, 'a', encoding='utf-8') as cache_log:
+        futures = {}
+        for src in sources:
+            rel = logical_name(src.relative_to(input_dir).as_posix())
+            try:
+                st = src.stat()
+            except OSError as e:
+                counts['failed'] += 1
+                print(f"❌ {rel}: {e}")
+                continue
+            record = cache.get(rel)
+            if unchanged(record, st) and (output_dir / rel).exists():
+                counts['skipped'] += 1   # ハッシュを計算せずにスキップ
+                continue
+            future = executor.submit(process, src, output_dir / rel, record and record['hash'], params)
+            futures[future] = rel, st
+
+        for i, future in enumerate(as_completed(futures), 1):
+            rel, st = futures[future]
+            try:
+                status, digest = future.result()
+            except Exception as e:
+                counts['failed'] += 1
+                print(f"❌ {rel}: {e}")
+                continue
+            counts[status] += 1
+            if status == 'done' or not unchanged(cache.get(rel), st):
+                # 1件ごとに追記するため、中断しても処理済み分は再実行時にスキップされる
+                # （内容が同じでサイズ・更新時刻だけ変わったファイルも記録し直し、次回はハッシュを省く）
+                cache[rel] = cache_record(rel, digest, st, params_key)
+                cache_log.write(json.dumps(cache[rel], ensure_ascii=False) + "\n")
+                cache_log.flush()
+            if i % 100 == 0:
+                print(f"   {i}/{len(futures)} 件完了")
 
-# ノイズリダクション（最初の0.5秒をノイズプロファイルとして使う例）
-reduced = nr.reduce_noise(y=data, sr=rate, y_noise=data[:int(rate*0.5)])
+    compact_cache(cache_path, cache, params_key)
+    elapsed = time.perf_counter() - start
+    print(f"✅ 完了: 処理 {counts['done']} / スキップ {counts['skipped']} / 失敗 {counts['failed']}"
+          f" ({elapsed:.1f} 秒)")
+    print(f"💾 出力先: {output_dir}")
 
-# ノイズ除去後のファイルを保存
-sf.write('dataset/audio_files/audio_1_denoised.wav', reduced, rate)
\ No newline at end of file
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,38 @@
+# quality_check.py
+# 録音済みテイクの品質チェック（クリッピング・無音・短すぎ・ノイズ・話速）
+#
+#   python script/quality_check.py
+#   python script/quality_check.py --min-snr-db 20 --max-silence 1.0
+import sys
+import time
+import argparse
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "src"))
+from metadata_store import MetadataStore
+from quality_check import run_qc, find_outliers, DEFAULT_THRESHOLDS
+
+def main():
+    parser = argparse.ArgumentParser(description="録音データセットの品質チェック")
+    parser.add_argument("--audio-dir", default="dataset/audio_files")
+    parser.add_argument("--metadata", default="dataset/metadata.txt")
+    parser.add_argument("--cache", default="dataset/qc_cache.npz")
+    parser.add_argument("--workers", type=int, default=None, help="並列数（既定: CPUコア数）")
+    for key, value in DEFAULT_THRESHOLDS.items():
+        parser.add_argument(f"--{key.replace('_', '-')}", type=float, default=value)
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    table = run_qc(args.audio_dir, MetadataStore(args.metadata), args.cache, args.workers)
+    outliers = find_outliers(table, {key: getattr(args, key) for key in DEFAULT_THRESHOLDS})
+    elapsed = time.perf_counter() - start
+
+    print(f"🔍 品質チェック: {len(table['name'])} テイク（新規解析 {table['analyzed']} 件, {elapsed:.2f} 秒）")
+    print("=" * 60)
+    for name, reasons in outliers:
+        print(f"⚠️ {name}: {', '.join(reasons)}")
+    print("=" * 60)
+    print(f"📊 要確認: {len(outliers)} 件")
+
+if __name__ == "__main__":
+    main()
\ No newline at end of file
@@ -0,0 +1,53 @@
+# segment_text.py
+# 小説などの長い文章を、録音用の原稿ファイル（1行1区間）に変換して data/input へ書き出す
+#
+#   python script/segment_text.py source/kokoro.txt                  # data/input/kokoro_001.txt, …
+#   python script/segment_text.py source/kokoro.txt --encoding cp932 # 青空文庫（Shift_JIS）
+#   python script/segment_text.py source/kokoro.txt --min-seconds 3 --max-seconds 6 --file-minutes 20
+#
+# 文は「。！？」で区切り（括弧内の文末では区切らない）、読み上げ時間はモーラ数から推定する。
+# 話速は dataset/metadata.txt の録音済みテイクの長さから校正する（20件未満なら既定値）。
+import sys
+import argparse
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "src"))
+from text_processor import (SpeechRate, calibrate_rate, segment_file,
+                            DEFAULT_MIN_SECONDS, DEFAULT_MAX_SECONDS)
+
+def main():
+    parser = argparse.ArgumentParser(description="長文テキストを録音用原稿に分割")
+    parser.add_argument("source", help="元のテキストファイル")
+    parser.add_argument("--output", default="data/input", help="出力ディレクトリ")
+    parser.add_argument("--stem", help="出力ファイル名の接頭辞（既定: 元ファイル名）")
+    parser.add_argument("--encoding", default="utf-8", help="元ファイルの文字コード（青空文庫は cp932）")
+    parser.add_argument("--min-seconds", type=float, default=DEFAULT_MIN_SECONDS, help="1行の推定時間の下限")
+    parser.add_argument("--max-seconds", type=float, default=DEFAULT_MAX_SECONDS, help="1行の推定時間の上限")
+    parser.add_argument("--file-minutes", type=float, default=30.0, help="1ファイルあたりの推定読み上げ時間（分）")
+    parser.add_argument("--rate", type=float, help="話速（モーラ/秒）を指定して校正を省略")
+    parser.add_argument("--metadata", default="dataset/metadata.txt")
+    parser.add_argument("--audio-dir", default="dataset/audio_files")
+    parser.add_argument("--force", action="store_true", help="同じ接頭辞の既存の原稿ファイルを置き換える")
+    args = parser.parse_args()
+
+    source = Path(args.source)
+    if source.resolve().parent == Path(args.output).resolve() and source.suffix == '.txt':
+        print(f"⚠️ {source} は {args.output} 内にあるため、分割後の原稿と重複して読み込まれます")
+
+    rate = SpeechRate(args.rate) if args.rate else calibrate_rate(args.metadata, args.audio_dir)
+    print(f"🗣️ 話速: {rate}")
+
+    try:
+        result = segment_file(source, args.output, args.stem, rate, args.min_seconds, args.max_seconds,
+                              args.file_minutes, args.encoding, args.force)
+    except FileExistsError as e:
+        print(f"❌ {e}（置き換える場合は --force）")
+        return
+
+    for path in result['files']:
+        print(f"📝 {path}")
+    print(f"✅ {result['segments']} 行 / {len(result['files'])} ファイル / "
+          f"推定 {result['seconds'] / 3600:.1f} 時間 ({result['elapsed']:.2f} 秒)")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+# service_client.py
+# 録音サービス（src/recording_service.py）の動作確認用クライアント
+#
+#   python script/service_client.py                           # 4端末 × 5テイクを実時間で送信
+#   python script/service_client.py --stations 32 --takes 10 --speed 0   # 最大速度で負荷試験
+#   python script/service_client.py --port 9000 --seconds 6
+#
+# 各端末は「次の未録音行を確保して start → PCM を分割送信 → commit」を繰り返す。
+# 音声は合成信号（無音と発話風のノイズの繰り返し）なので、マイクは不要。
+import sys
+import json
+import time
+import asyncio
+import argparse
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "src"))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+from ws_protocol import WebSocket, client_handshake, OP_BINARY
+from fake_sounddevice import synth_blocks
+
+async def http_json(host, port, method, path, body=None):
+    """HTTP リクエストを1回送り、JSON の応答を返す（返り値: (ステータス, 辞書)）"""
+    reader, writer = await asyncio.open_connection(host, port)
+    try:
+        data = json.dumps(body).encode('utf-8') if body is not None else b""
+        writer.write((f"{method} {path} HTTP/1.1\r\nHost: {host}\r\nContent-Type: application/json\r\n"
+                      f"Content-Length: {len(data)}\r\nConnection: close\r\n\r\n").encode('latin-1') + data)
+        await writer.drain()
+        response = await reader.read()
+    finally:
+        writer.close()
+    head, _, payload = response.partition(b"\r\n\r\n")
+    status = int(head.split(b" ", 2)[1])
+    return status, json.loads(payload)
+
+async def run_station(host, port, station, takes, seconds, sample_rate, chunk_ms, speed):
+    """1端末分の録音を再現。返り値: 保存されたファイル名のリスト"""
+    chunk_frames = sample_rate * chunk_ms // 1000
+    blocks = [b.tobytes() for b in synth_blocks(sample_rate, 1, 'int16', chunk_frames, seed=sum(station.encode()))]
+    chunks_per_take = max(1, int(seconds * 1000 / chunk_ms))
+
+    reader, writer = await asyncio.open_connection(host, port)
+    await client_handshake(reader, writer, f"{host}:{port}", f"/ingest?station={station}")
+    ws = WebSocket(reader, writer, client=True)
+    saved = []
+    try:
+        for _ in range(takes):
+            await ws.send_json({'op': 'start', 'next_unrecorded': True,
+                                'sample_rate': sample_rate, 'channels': 1})
+            opcode, reply = await ws.receive()
+            reply = json.loads(reply)
+            if reply['op'] != 'started':
+                break   # 未録音の行が残っていない
+
+            for i in range(chunks_per_take):
+                await ws.send(OP_BINARY, blocks[i % len(blocks)])
+                if speed:
+                    await asyncio.sleep(chunk_ms / 1000 / speed)
+
+            await ws.send_json({'op': 'commit'})
+            opcode, reply = await ws.receive()
+            reply = json.loads(reply)
+            if reply['op'] == 'committed':
+                saved.append(reply['audio_filename'])
+            else:
+                print(f"⚠️ {station}: {reply.get('error')}")
+    finally:
+        await ws.close()
+        writer.close()
+    return saved
+
+async def run_clients(host, port, stations, takes, seconds, sample_rate=44100, chunk_ms=20, speed=1.0):
+    """複数端末を同時に動かして結果を集計"""
+    start = time.perf_counter()
+    results = await asyncio.gather(*(run_station(host, port, f"station{i + 1}", takes, seconds,
+                                                 sample_rate, chunk_ms, speed)
+                                     for i in range(stations)), return_exceptions=True)
+    elapsed = time.perf_counter() - start
+    errors = [r for r in results if isinstance(r, BaseException)]
+    saved = [name for r in results if not isinstance(r, BaseException) for name in r]
+    return {'saved': saved, 'errors': errors, 'elapsed': elapsed,
+            'audio_seconds': len(saved) * max(1, int(seconds * 1000 / chunk_ms)) * chunk_ms / 1000}
+
+def main():
+    parser = argparse.ArgumentParser(description="録音サービスの動作確認（合成音声を送信）")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--stations", type=int, default=4, help="同時に録音する端末数")
+    parser.add_argument("--takes", type=int, default=5, help="1端末あたりのテイク数")
+    parser.add_argument("--seconds", type=float, default=4.0, help="1テイクの長さ（秒）")
+    parser.add_argument("--sample-rate", type=int, default=44100)
+    parser.add_argument("--chunk-ms", type=int, default=20, help="1回に送る音声の長さ（ミリ秒）")
+    parser.add_argument("--speed", type=float, default=1.0, help="実時間に対する送信速度（0 で待ち時間なし）")
+    args = parser.parse_args()
+
+    result = asyncio.run(run_clients(args.host, args.port, args.stations, args.takes, args.seconds,
+                                     args.sample_rate, args.chunk_ms, args.speed))
+    for error in result['errors']:
+        print(f"❌ {type(error).__name__}: {error}")
+    print(f"✅ {len(result['saved'])} テイク / 音声 {result['audio_seconds']:.0f} 秒 / "
+          f"{result['elapsed']:.2f} 秒 (実時間の {result['audio_seconds'] / result['elapsed']:.1f} 倍)")
+
+    status, stats = asyncio.run(http_json(args.host, args.port, 'GET', '/stats'))
+    print("📊 " + ", ".join(f"{k}={v}" for k, v in stats.items()))
+
+if __name__ == "__main__":
+    main()
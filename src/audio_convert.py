@@ -0,0 +1,164 @@
+import os
+import json
+from math import gcd
+from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import soundfile as sf
+from scipy.signal import resample_poly
+from metadata_store import natural_key
+from audio_io import pcm_hash, resolve, scan_audio
+
+CACHE_NAME = ".convert_cache.jsonl"
+SUBTYPES = {16: 'PCM_16', 24: 'PCM_24', 32: 'FLOAT'}
+NORMALIZE_MODES = (None, 'peak', 'loudness')
+FRAME_SECONDS = 0.01     # ラウドネス計算のフレーム長
+GATE_DB = -40.0          # これ未満のフレームはラウドネス計算から除外
+
+def make_spec(sample_rate=22050, channels=1, bit_depth=16, normalize=None, level_db=None):
+    """変換先の仕様（level_db の既定値: ピーク -1 dBFS / ラウドネス -23 dBFS）"""
+    if bit_depth not in SUBTYPES:
+        raise ValueError(f"未対応のビット深度です: {bit_depth}")
+    if normalize not in NORMALIZE_MODES:
+        raise ValueError(f"未対応の正規化方式です: {normalize}")
+    if normalize and level_db is None:
+        level_db = -1.0 if normalize == 'peak' else -23.0
+    return {'sample_rate': sample_rate, 'channels': channels, 'bit_depth': bit_depth,
+            'normalize': normalize, 'level_db': level_db if normalize else None}
+
+def spec_name(spec):
+    """仕様ごとの出力ディレクトリ名（例: 22050Hz_1ch_16bit_peak-1.0dB）"""
+    name = f"{spec['sample_rate']}Hz_{spec['channels']}ch_{spec['bit_depth']}bit"
+    if spec['normalize']:
+        name += f"_{spec['normalize']}{spec['level_db']:+.1f}dB"
+    return name
+
+def _loudness_db(x, rate):
+    """無音フレームを除いたRMS（dBFS）。簡易的なラウドネスの目安として使う"""
+    frame_len = max(1, int(rate * FRAME_SECONDS))
+    n_frames = len(x) // frame_len
+    if n_frames == 0:
+        return None
+    power = (x[:n_frames * frame_len] ** 2).reshape(n_frames, -1).mean(axis=1)
+    frame_db = 10 * np.log10(np.maximum(power, 1e-20))
+    voiced = power[frame_db >= GATE_DB]
+    if len(voiced) == 0:
+        return None
+    return 10 * np.log10(voiced.mean())
+
+def convert_samples(x, rate, spec):
+    """(フレーム数, チャンネル数) の float 配列を仕様に合わせて変換"""
+    # チャンネル変換（モノラル化は平均、チャンネル追加は複製）
+    if x.shape[1] != spec['channels']:
+        if spec['channels'] == 1:
+            x = x.mean(axis=1, keepdims=True)
+        else:
+            x = np.repeat(x[:, :1], spec['channels'], axis=1)
+
+    # ポリフェーズフィルタでリサンプリング
+    if rate != spec['sample_rate']:
+        g = gcd(rate, spec['sample_rate'])
+        x = resample_poly(x, spec['sample_rate'] // g, rate // g, axis=0)
+
+    if spec['normalize'] == 'peak':
+        peak = np.abs(x).max() if len(x) else 0.0
+        if peak > 0:
+            x = x * (10 ** (spec['level_db'] / 20) / peak)
+    elif spec['normalize'] == 'loudness':
+        level = _loudness_db(x.mean(axis=1), spec['sample_rate'])
+        if level is not None:
+            x = x * 10 ** ((spec['level_db'] - level) / 20)
+    return np.clip(x, -1.0, 1.0).astype(np.float32)
+
+def convert_file(src, dst, spec):
+    """1ファイルを変換（一時ファイルに書いてから置き換え。src は WAV・FLAC のどちらでもよい）"""
+    x, rate = sf.read(str(src), dtype='float64', always_2d=True)
+    y = convert_samples(x, rate, spec)
+    dst.parent.mkdir(parents=True, exist_ok=True)
+    temp = dst.with_name(f".{dst.name}.tmp")
+    sf.write(str(temp), y, spec['sample_rate'], subtype=SUBTYPES[spec['bit_depth']], format='WAV')
+    os.replace(temp, dst)
+
+def _process(task):
+    """ワーカープロセスで1ファイルを処理（返り値: (ファイル名, 状態, ハッシュ, エラー)）"""
+    rel, src, dst, cached_hash, spec = task
+    try:
+        # 音声の内容のハッシュなので、変換元が FLAC に圧縮されただけなら変換し直さない
+        digest = pcm_hash(src)
+        if digest == cached_hash and dst.exists():
+            return rel, 'skipped', digest, None
+        convert_file(src, dst, spec)
+        return rel, 'done', digest, None
+    except Exception as e:
+        return rel, 'failed', None, str(e)
+
+def load_cache(cache_path):
+    """変換済みファイルの一覧（ファイル名 → {hash, mtime, size}）"""
+    cache = {}
+    if cache_path.exists():
+        with open(cache_path, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    continue  # 中断時の書きかけの行
+                cache[record['file']] = record
+    return cache
+
+def compact_cache(cache_path, cache):
+    """変換済みファイルの一覧を1ファイル1行に詰め直す"""
+    temp = cache_path.with_suffix('.tmp')
+    with open(temp, 'w', encoding='utf-8') as f:
+        for rel in sorted(cache, key=natural_key):
+            f.write(json.dumps(cache[rel], ensure_ascii=False) + "\n")
+    os.replace(temp, cache_path)
+
+def convert_dataset(spec, input_dir="dataset/audio_files", output_root="dataset/converted",
+                    workers=None, progress=None):
+    """全テイクを仕様に合わせて並列変換（変更のないファイルはスキップ）
+
+    出力先は output_root/<仕様名>/ で、変換元の内容のハッシュを仕様ごとに記録する。
+    更新時刻とサイズが記録と同じファイルはハッシュの計算も省略する。
+    """
+    input_dir = Path(input_dir)
+    output_dir = Path(output_root) / spec_name(spec)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    cache_path = output_dir / CACHE_NAME
+    cache = load_cache(cache_path)
+
+    counts = {'done': 0, 'skipped': 0, 'failed': 0}
+    errors = []
+    tasks = []
+    # FLAC に圧縮済みのテイクも audio_N.wav の名前で扱い、出力は WAV にする
+    sources = scan_audio(input_dir)
+    for name in sorted(sources, key=natural_key):
+        src = Path(sources[name].path)
+        st = src.stat()
+        record = cache.get(name)
+        dst = output_dir / name
+        if (record and record['mtime'] == st.st_mtime_ns and record['size'] == st.st_size
+                and dst.exists()):
+            counts['skipped'] += 1
+            continue
+        tasks.append((name, src, dst, record['hash'] if record else None, spec))
+
+    if tasks:
+        with ProcessPoolExecutor(max_workers=workers) as executor, \
+                open(cache_path, 'a', encoding='utf-8') as cache_log:
+            results = executor.map(_process, tasks, chunksize=max(1, len(tasks) // 64))
+            for i, (rel, status, digest, error) in enumerate(results, 1):
+                counts[status] += 1
+                if status == 'failed':
+                    errors.append(f"{rel}: {error}")
+                else:
+                    # 1件ごとに追記するため、中断しても変換済み分は再実行時にスキップされる
+                    st = resolve(input_dir / rel).stat()
+                    cache[rel] = {'file': rel, 'hash': digest, 'mtime': st.st_mtime_ns, 'size': st.st_size}
+                    cache_log.write(json.dumps(cache[rel], ensure_ascii=False) + "\n")
+                    cache_log.flush()
+                if progress:
+                    progress(i, len(tasks))
+        compact_cache(cache_path, cache)
+
+    return {'output_dir': output_dir, 'counts': counts, 'errors': errors}
@@ -0,0 +1,220 @@
+import os
+import wave
+import struct
+import hashlib
+import threading
+from pathlib import Path
+from collections import namedtuple
+
+# 録音テイクの読み書きをまとめた層。データセット内のファイル名（metadata.txt・セッション）は
+# 常に audio_N.wav で、実際のファイルは FLAC に圧縮済みなら audio_N.flac になる。
+# 読み込み側はここを通すことで、どちらの形式でも同じように扱える。
+WAV_SUFFIX = '.wav'
+FLAC_SUFFIX = '.flac'
+AUDIO_SUFFIXES = (WAV_SUFFIX, FLAC_SUFFIX)
+VERIFY_BLOCK_FRAMES = 1 << 16
+HASH_CHUNK_BYTES = 1024 * 1024
+
+AudioInfo = namedtuple('AudioInfo', 'frames sample_rate channels bits')
+
+def logical_name(name):
+    """実際のファイル名に対応するデータセット上の名前（audio_N.flac → audio_N.wav）"""
+    if name.endswith(FLAC_SUFFIX):
+        return name[:-len(FLAC_SUFFIX)] + WAV_SUFFIX
+    return name
+
+def resolve(path):
+    """データセット上の名前に対応する実際のファイル（WAV を優先し、なければ FLAC）。どちらもなければ None"""
+    path = Path(path)
+    if path.exists():
+        return path
+    if path.suffix == WAV_SUFFIX:
+        flac_path = path.with_suffix(FLAC_SUFFIX)
+        if flac_path.exists():
+            return flac_path
+    return None
+
+def _existing(path):
+    """resolve と同じだが、どちらもなければ FileNotFoundError"""
+    resolved = resolve(path)
+    if resolved is None:
+        raise FileNotFoundError(path)
+    return resolved
+
+def scan_audio(directory):
+    """ディレクトリ内の音声ファイル（隠しファイル・一時ファイルは除外）
+
+    返り値: {データセット上の名前: os.DirEntry}。FLAC への置き換え途中で両方ある場合は WAV を返す。
+    """
+    found = {}
+    try:
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                if entry.name.startswith('.') or not entry.name.endswith(AUDIO_SUFFIXES):
+                    continue
+                name = logical_name(entry.name)
+                if (name not in found or entry.name.endswith(WAV_SUFFIX)) and entry.is_file():
+                    found[name] = entry
+    except FileNotFoundError:
+        pass
+    return found
+
+def _wav_layout(path):
+    """WAV（RIFF / RF64）のヘッダを解析。返り値: (チャンネル数, サンプルレート, ビット数, dataの位置, dataのサイズ)"""
+    with open(path, 'rb') as f:
+        riff, _, wave_id = struct.unpack('<4sI4s', f.read(12))
+        if riff not in (b'RIFF', b'RF64') or wave_id != b'WAVE':
+            raise ValueError(f"WAVファイルではありません: {path}")
+        channels = rate = bits = None
+        data_size_64 = None
+        while True:
+            header = f.read(8)
+            if len(header) < 8:
+                raise ValueError(f"dataチャンクが見つかりません: {path}")
+            chunk_id, chunk_size = struct.unpack('<4sI', header)
+            if chunk_id == b'fmt ':
+                fmt = f.read(chunk_size)
+                _, channels, rate, _, _, bits = struct.unpack('<HHIIHH', fmt[:16])
+            elif chunk_id == b'ds64':
+                data_size_64 = struct.unpack('<QQ', f.read(16))[1]
+                f.seek(chunk_size - 16, os.SEEK_CUR)
+            elif chunk_id == b'data':
+                offset = f.tell()
+                size = data_size_64 if chunk_size == 0xFFFFFFFF and data_size_64 else chunk_size
+                break
+            else:
+                f.seek(chunk_size + (chunk_size & 1), os.SEEK_CUR)
+    return channels, rate, bits, offset, min(size, os.path.getsize(path) - offset)
+
+def _flac_streaminfo(path):
+    """FLAC の STREAMINFO ブロックを解析（音声データは読まない）"""
+    with open(path, 'rb') as f:
+        head = f.read(8 + 34)
+    if len(head) < 42 or head[:4] != b'fLaC' or head[4] & 0x7F != 0:
+        return None
+    packed = int.from_bytes(head[18:26], 'big')
+    rate = packed >> 44
+    channels = ((packed >> 41) & 0x7) + 1
+    bits = ((packed >> 36) & 0x1F) + 1
+    frames = packed & 0xFFFFFFFFF
+    return AudioInfo(frames, rate, channels, bits)
+
+def info(path):
+    """フレーム数・サンプルレートなど（ヘッダのみ読む）"""
+    path = _existing(path)
+    if path.suffix == FLAC_SUFFIX:
+        streaminfo = _flac_streaminfo(path)
+        if streaminfo is not None:
+            return streaminfo
+        import soundfile as sf
+        sf_info = sf.info(str(path))
+        return AudioInfo(sf_info.frames, sf_info.samplerate, sf_info.channels, 16)
+    channels, rate, bits, _, size = _wav_layout(path)
+    return AudioInfo(size // (channels * bits // 8), rate, channels, bits)
+
+def open_wav_memmap(path):
+    """16bit PCM のWAVをメモリマップで開く（返り値: (サンプル配列, サンプルレート)）"""
+    import numpy as np
+    channels, rate, bits, offset, size = _wav_layout(path)
+    if bits != 16:
+        raise ValueError(f"16bit PCM以外には対応していません: {path}")
+    frames = size // (2 * channels)
+    if frames == 0:
+        return np.zeros((0, channels), dtype=np.int16), rate
+    samples = np.memmap(path, dtype='<i2', mode='r', offset=offset, shape=(frames, channels))
+    return samples, rate
+
+def read_pcm16(path):
+    """16bit PCM のサンプル配列 (フレーム数, チャンネル数) とサンプルレート
+
+    WAV はメモリマップ（コピーなし）、FLAC は復号して返す。
+    """
+    path = _existing(path)
+    if path.suffix == FLAC_SUFFIX:
+        import soundfile as sf
+        samples, rate = sf.read(str(path), dtype='int16', always_2d=True)
+        return samples, rate
+    return open_wav_memmap(path)
+
+def read(path, dtype='float64'):
+    """サンプル配列 (フレーム数, チャンネル数) とサンプルレート（形式を問わず soundfile で読む）"""
+    import soundfile as sf
+    return sf.read(str(_existing(path)), dtype=dtype, always_2d=True)
+
+def open_sound(path):
+    """ブロック単位で読むための soundfile.SoundFile（長いファイル用）"""
+    import soundfile as sf
+    return sf.SoundFile(str(_existing(path)))
+
+def pcm_hash(path):
+    """音声の内容ハッシュ（形式 + PCM データ）
+
+    ヘッダの書き方が違うだけの WAV や、同じ音声を可逆圧縮した FLAC は同じ値になる。
+    wave モジュールで読めない WAV（RF64 など）はファイル全体のハッシュを使う。
+    """
+    path = _existing(path)
+    digest = hashlib.blake2b(digest_size=16)
+    if path.suffix == FLAC_SUFFIX:
+        import soundfile as sf
+        with sf.SoundFile(str(path)) as f:
+            # 16bit の WAV を wave モジュールで読んだ場合と同じバイト列になる
+            digest.update(struct.pack('<HHI', f.channels, 2, f.samplerate))
+            frames_per_chunk = max(1, HASH_CHUNK_BYTES // (2 * f.channels))
+            for block in f.blocks(blocksize=frames_per_chunk, dtype='int16', always_2d=True):
+                digest.update(block.astype('<i2', copy=False).tobytes())
+        return digest.hexdigest()
+    try:
+        with wave.open(str(path), 'rb') as wf:
+            digest.update(struct.pack('<HHI', wf.getnchannels(), wf.getsampwidth(), wf.getframerate()))
+            frames_per_chunk = max(1, HASH_CHUNK_BYTES // (wf.getnchannels() * wf.getsampwidth()))
+            while True:
+                data = wf.readframes(frames_per_chunk)
+                if not data:
+                    break
+                digest.update(data)
+        return digest.hexdigest()
+    except (wave.Error, EOFError):
+        pass
+    digest = hashlib.blake2b(b'raw:', digest_size=16)
+    with open(path, 'rb') as f:
+        while True:
+            data = f.read(HASH_CHUNK_BYTES)
+            if not data:
+                break
+            digest.update(data)
+    return digest.hexdigest()
+
+def same_pcm(samples, rate, flac_path, block_frames=VERIFY_BLOCK_FRAMES):
+    """FLAC を復号した結果が samples と1サンプルも違わず一致するか"""
+    import numpy as np
+    import soundfile as sf
+    with sf.SoundFile(str(flac_path)) as f:
+        if f.samplerate != rate or f.channels != samples.shape[1] or f.frames != len(samples):
+            return False
+        position = 0
+        for block in f.blocks(blocksize=block_frames, dtype='int16', always_2d=True):
+            if not np.array_equal(block, samples[position:position + len(block)]):
+                return False
+            position += len(block)
+    return position == len(samples)
+
+def encode_flac(src, dst, block_frames=VERIFY_BLOCK_FRAMES):
+    """16bit PCM の WAV を FLAC へ可逆圧縮（復号して元と一致することを確認してから dst に置く）
+
+    返り値: (元のファイルサイズ, FLAC のファイルサイズ)。一致しなければ ValueError。
+    """
+    import numpy as np
+    import soundfile as sf
+    samples, rate = open_wav_memmap(src)
+    dst = Path(dst)
+    temp_path = dst.with_name(f".{dst.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+    try:
+        with sf.SoundFile(str(temp_path), 'w', rate, samples.shape[1], subtype='PCM_16', format='FLAC') as out:
+            for start in range(0, len(samples), block_frames):
+                out.write(np.asarray(samples[start:start + block_frames]))
+        if not same_pcm(samples, rate, temp_path, block_frames):
+            raise ValueError(f"FLAC の復号結果が元の音声と一致しません: {src}")
+        os.replace(temp_path, dst)
+    finally:
+        temp_path.unlink(missing_ok=True)
+    return os.path.getsize(src), os.path.getsize(dst)
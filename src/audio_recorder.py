@@ -1,17 +1,29 @@
 import sounddevice as sd
 import numpy as np
 import wave
+import os
 import threading
 import time
 from pathlib import Path
+from capture_buffer import CaptureBuffer
+from wav_stream_writer import WavStreamWriter, StreamedTake, PARTIAL_SUFFIX, commit_file, truncate_wav
+from level_meter import LevelMeter
+import metrics
 
 class AudioRecorder:
-    def __init__(self, sample_rate=44100, channels=1):
+    def __init__(self, sample_rate=44100, channels=1, dtype='float32', stream_to_disk=False,
+                 trim_silence=True, auto_stop_ms=None):
         self.sample_rate = sample_rate
         self.channels = channels
+        self.dtype = dtype
+        self.stream_to_disk = stream_to_disk
+        self.trim_silence = trim_silence
+        self.auto_stop_ms = auto_stop_ms
+        self.level_meter = None
         self.is_recording = False
         self.is_paused = False
-        self.recorded_data = []
+        self.capture_buffer = None
+        self.stream_writer = None
         self.current_recording = None
         self.recording_thread = None
         
@@ -22,16 +34,45 @@ class AudioRecorder:
             
         self.is_recording = True
         self.is_paused = False
-        self.recorded_data = []
+        # 前回の録音データは再生用に参照されている可能性があるため毎回新規確保
+        initial_seconds = 0 if self.stream_to_disk else 60
+        self.capture_buffer = CaptureBuffer(self.sample_rate, self.channels, self.dtype, initial_seconds)
+        self.level_meter = LevelMeter(self.sample_rate, auto_stop_ms=self.auto_stop_ms)
+        
+        if self.stream_to_disk:
+            # 一時ファイルへ逐次書き込み（メモリ使用量はテイク長に依存しない）
+            temp_path = Path("dataset/audio_files") / f".take_{os.getpid()}_{int(time.time() * 1000)}.wav{PARTIAL_SUFFIX}"
+            temp_path.parent.mkdir(parents=True, exist_ok=True)
+            self.stream_writer = WavStreamWriter(temp_path, self.sample_rate, self.channels)
         
         def record_callback(indata, frames, time, status):
-            if not self.is_paused and self.is_recording:
-                self.recorded_data.extend(indata.copy())
+            if status:
+                self.capture_buffer.record_status(status)
+            if not self.is_paused and self.is_recording and not self.level_meter.auto_stopped:
+                if self.stream_writer is not None:
+                    self.stream_writer.write(indata.copy())
+                else:
+                    self.capture_buffer.append(indata)
+                # 保存されるフレームと同じ位置でレベル・発話区間を計算
+                self.level_meter.process(indata)
+        
+        registry = metrics.registry
+        if registry is not None:
+            # 計測が有効な場合のみ処理時間を測るラッパーに差し替え（無効時は追加コストなし）
+            histogram = registry.histogram('callback_seconds')
+            clock = time.perf_counter
+            callback = record_callback
+            
+            def record_callback(indata, frames, time_info, status):
+                start = clock()
+                callback(indata, frames, time_info, status)
+                histogram.observe(clock() - start)
         
         self.stream = sd.InputStream(
             callback=record_callback,
             samplerate=self.sample_rate,
-            channels=self.channels
+            channels=self.channels,
+            dtype=self.dtype
         )
         self.stream.start()
         return True
@@ -60,41 +101,92 @@ class AudioRecorder:
             self.stream.stop()
             self.stream.close()
         
-        if self.recorded_data:
-            return np.array(self.recorded_data)
+        registry = metrics.registry
+        if registry is not None and self.capture_buffer is not None:
+            registry.inc('input_overflows', self.capture_buffer.overflow_count)
+            registry.inc('input_underflows', self.capture_buffer.underflow_count)
+            registry.inc('takes_recorded')
+        
+        if self.stream_writer is not None:
+            writer = self.stream_writer
+            self.stream_writer = None
+            writer.close()
+            if registry is not None:
+                registry.max_gauge('stream_queue_depth_max', writer.max_queue_depth)
+                registry.inc('stream_dropped_blocks', writer.dropped_blocks)
+            if writer.dropped_blocks:
+                print(f"⚠️ 書き込み遅延により {writer.dropped_blocks} ブロックを破棄しました")
+            if writer.data_size == 0:
+                os.remove(writer.path)
+                return None
+            duration = writer.duration
+            trim = self.level_meter.trim_points() if self.trim_silence else None
+            if trim is not None and not writer.dropped_blocks:
+                # 書き込み済みのファイルは末尾の無音のみ切り詰める（先頭の削除はデータの書き直しが必要なため）
+                truncate_wav(writer.path, trim[1])
+                duration = trim[1] / self.sample_rate
+            return StreamedTake(writer.path, self.sample_rate, self.channels, duration)
+        
+        if self.capture_buffer is not None:
+            if self.capture_buffer.overflow_count:
+                print(f"⚠️ 入力オーバーラン {self.capture_buffer.overflow_count} 回（音飛びの可能性）")
+            audio = self.capture_buffer.finalize()
+            trim = self.level_meter.trim_points() if self.trim_silence else None
+            if audio is not None and trim is not None:
+                # 録音中に求めた発話区間でスライスするだけ（コピーなし）
+                audio = audio[trim[0]:trim[1]]
+            return audio
         return None
     
-    def save_audio(self, audio_data, filename):
+    def save_audio(self, audio_data, filename, directory="dataset/audio_files"):
         """音声データを保存"""
-        output_path = Path("dataset/audio_files") / filename
+        output_path = Path(directory) / filename
         output_path.parent.mkdir(parents=True, exist_ok=True)
         
-        # 音声データを正規化
-        audio_data = audio_data / np.max(np.abs(audio_data))
-        audio_data = (audio_data * 32767).astype(np.int16)
+        if isinstance(audio_data, StreamedTake):
+            # 書き込み済みの一時ファイルをリネームするだけ（正規化は行わない）
+            with metrics.timed('save_stage_seconds', stage='rename'):
+                audio_data.path = commit_file(audio_data.path, output_path)
+            return str(output_path)
+        
+        # 音声データを正規化（int16録音にも対応）
+        with metrics.timed('save_stage_seconds', stage='normalize'):
+            audio_data = audio_data.astype(np.float32)
+            peak = np.max(np.abs(audio_data))
+            if peak > 0:
+                audio_data /= peak
+            audio_data = (audio_data * 32767).astype(np.int16)
         
-        with wave.open(str(output_path), 'wb') as wf:
-            wf.setnchannels(self.channels)
-            wf.setsampwidth(2)  # 16-bit
-            wf.setframerate(self.sample_rate)
-            wf.writeframes(audio_data.tobytes())
+        with metrics.timed('save_stage_seconds', stage='wav_write'):
+            with wave.open(str(output_path), 'wb') as wf:
+                wf.setnchannels(self.channels)
+                wf.setsampwidth(2)  # 16-bit
+                wf.setframerate(self.sample_rate)
+                wf.writeframes(audio_data.tobytes())
         
         return str(output_path)
     
     def play_audio(self, audio_data):
         """録音した音声を再生"""
+        if isinstance(audio_data, StreamedTake):
+            audio_data = audio_data.load()
         if audio_data is not None:
             sd.play(audio_data, self.sample_rate)
             sd.wait()
     
+    def discard_take(self, audio_data):
+        """保存しないテイクの一時ファイルを削除"""
+        if isinstance(audio_data, StreamedTake) and audio_data.path.name.endswith(PARTIAL_SUFFIX):
+            audio_data.path.unlink(missing_ok=True)
+    
     def reset_recording(self):
         """録音状態を完全にリセット"""
         if self.is_recording:
-            self.stop_recording()
+            self.discard_take(self.stop_recording())
         
         self.is_recording = False
         self.is_paused = False
-        self.recorded_data = []
+        self.capture_buffer = None
         
         if hasattr(self, 'stream'):
             try:
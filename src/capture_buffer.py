@@ -0,0 +1,146 @@
+import queue
+import threading
+
+import numpy as np
+
+CHUNK_SECONDS = 30           # 事前確保分を超えたときに追加する1チャンクの長さ
+LOW_WATER_FRACTION = 0.1     # 残り容量が想定の長さのこの割合を切ったら次のチャンクを確保しておく
+MIN_LOW_WATER_SECONDS = 0.5  # ただし確保が間に合うよう、最低この秒数分は残して依頼する
+
+class _ChunkAllocator:
+    """コールバックの外（専用スレッド）で追加チャンクを確保する
+
+    コールバックは queue への登録だけを行い、確保とページの割り当て（ゼロ埋め）は
+    このスレッドで済ませる。全バッファで1スレッドを共有する。
+    """
+
+    def __init__(self):
+        self._requests = queue.SimpleQueue()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, daemon=True, name="capture-allocator")
+                self._thread.start()
+
+    def request(self, buffer):
+        self._requests.put(buffer)
+
+    def _run(self):
+        while True:
+            buffer = self._requests.get()
+            chunk = np.empty((buffer._chunk_frames, buffer.channels), dtype=buffer.dtype)
+            chunk.fill(0)   # ページを先に割り当てておく（コールバックでのページフォールトを避ける）
+            buffer._add_chunk(chunk)
+
+_allocator = _ChunkAllocator()
+
+class CaptureBuffer:
+    """録音データを保持する事前確保型のNumPyチャンクバッファ
+
+    最初のチャンクは想定するテイクの長さ（initial_seconds）で録音開始前に確保する。
+    それを超える録音では固定長（CHUNK_SECONDS）のチャンクを継ぎ足し、既存のデータは
+    コピーしない。追加のチャンクは残り容量が想定の長さの LOW_WATER_FRACTION を切った
+    時点で別スレッドが確保するので、想定内の長さのテイクでは追加の確保は起きない。
+    コールバック内では確保もコピーも行わず、確保が間に合わなかったブロックは破棄して
+    オーバーランとして数える。initial_seconds=0 は追記しない用途（ディスクへ直接書く録音）用。
+    チャンクの連結は finalize で1回だけ行う。
+    """
+
+    def __init__(self, sample_rate=44100, channels=1, dtype='float32', initial_seconds=60,
+                 chunk_seconds=CHUNK_SECONDS):
+        self.sample_rate = sample_rate
+        self.channels = channels
+        self.dtype = np.dtype(dtype)
+        self.frames = 0
+        self.overflow_count = 0
+        self.underflow_count = 0
+        self.dropped_blocks = 0   # 確保が間に合わず破棄したブロック数（overflow_count にも含む）
+        self.status_events = []  # (フレーム位置, ステータス文字列)
+
+        # 録音開始前にまとめて確保しておき、コールバック内での確保を避ける
+        self._chunk_frames = max(1, int(sample_rate * chunk_seconds))
+        initial_frames = int(sample_rate * initial_seconds)
+        self._chunks = [np.empty((initial_frames, channels), dtype=self.dtype)] if initial_frames > 0 else []
+        self._starts = [0] if initial_frames > 0 else []   # 各チャンクの先頭フレーム位置
+        self._capacity = initial_frames
+        self._chunk_index = 0        # 書き込み中のチャンク
+        self._requested = False      # 追加チャンクを確保スレッドへ依頼済み
+        self._low_water = max(int(sample_rate * MIN_LOW_WATER_SECONDS), int(initial_frames * LOW_WATER_FRACTION))
+        self._joined = None
+        _allocator.start()
+
+    def _add_chunk(self, chunk):
+        # 確保スレッドからのみ呼ぶ。位置と配列を追加してから容量を増やす
+        # （コールバックは容量の範囲内のチャンクだけを参照する）
+        self._starts.append(self._capacity)
+        self._chunks.append(chunk)
+        self._capacity += len(chunk)
+        self._requested = False
+
+    def append(self, block):
+        """コールバックから受け取ったブロックを追記（容量が足りなければ破棄して False）"""
+        end = self.frames + len(block)
+        if end > self._capacity:
+            # 確保スレッドが間に合わなかった。コールバック内では確保しない
+            self.dropped_blocks += 1
+            self.overflow_count += 1
+            self._request_chunk()
+            return False
+        position = self.frames
+        offset = 0
+        while offset < len(block):
+            index = self._chunk_index
+            chunk = self._chunks[index]
+            start = position - self._starts[index]
+            count = min(len(chunk) - start, len(block) - offset)
+            chunk[start:start + count] = block[offset:offset + count]
+            offset += count
+            position += count
+            if start + count == len(chunk):
+                self._chunk_index += 1
+        self.frames = end
+        self._joined = None
+        if self._capacity - end < self._low_water:
+            self._request_chunk()
+        return True
+
+    def _request_chunk(self):
+        if not self._requested:
+            self._requested = True
+            _allocator.request(self)
+
+    def record_status(self, status):
+        """PortAudioのオーバーラン/アンダーラン通知を記録"""
+        if getattr(status, 'input_overflow', False):
+            self.overflow_count += 1
+        if getattr(status, 'input_underflow', False):
+            self.underflow_count += 1
+        self.status_events.append((self.frames, str(status)))
+
+    def finalize(self):
+        """録音済み部分を返す（1チャンクに収まればコピーせずビュー、超えた場合のみ連結）"""
+        if self.frames == 0:
+            return None
+        if self.frames <= len(self._chunks[0]):
+            return self._chunks[0][:self.frames]
+        if self._joined is None:
+            parts = []
+            for start, chunk in zip(self._starts, self._chunks):
+                if start >= self.frames:
+                    break
+                parts.append(chunk[:self.frames - start])
+            self._joined = np.concatenate(parts)
+        return self._joined
+
+    @property
+    def duration(self):
+        """録音済みの長さ（秒）"""
+        return self.frames / self.sample_rate
+
+    @property
+    def nbytes(self):
+        """確保済みメモリ量（バイト）"""
+        return sum(chunk.nbytes for chunk in self._chunks)
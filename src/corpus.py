@@ -0,0 +1,257 @@
+import os
+import struct
+import bisect
+import hashlib
+import threading
+import unicodedata
+from array import array
+from difflib import SequenceMatcher
+from pathlib import Path
+
+INDEX_MAGIC = b'LIDX'
+INDEX_VERSION = 2
+INDEX_HEADER = struct.Struct('<4sIQQQ')  # magic, version, ファイルサイズ, mtime_ns, 行数
+
+def line_hash(text):
+    """正規化したテキストのハッシュ（NFKC正規化・空白除去後）"""
+    normalized = ''.join(unicodedata.normalize('NFKC', text).split())
+    return int.from_bytes(hashlib.blake2b(normalized.encode('utf-8'), digest_size=8).digest(), 'little')
+
+def build_line_offsets(data):
+    """空行を除いた各行の開始・終了バイト位置とテキストのハッシュを求める"""
+    starts = array('Q')
+    ends = array('Q')
+    hashes = array('Q')
+    position = 0
+    size = len(data)
+    while position < size:
+        newline = data.find(b'\n', position)
+        end = size if newline == -1 else newline
+        text = data[position:end].decode('utf-8', 'replace').strip()
+        if text:
+            starts.append(position)
+            ends.append(end)
+            hashes.append(line_hash(text))
+        position = end + 1
+    return starts, ends, hashes
+
+def diff_lines(old_hashes, new_hashes):
+    """行ハッシュ列を比較し、旧行位置 → 新行位置の対応と変更行数を返す"""
+    matcher = SequenceMatcher(None, old_hashes, new_hashes, autojunk=False)
+    mapping = {}
+    stats = {'inserted': 0, 'removed': 0, 'changed': 0}
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag == 'equal':
+            for k in range(i2 - i1):
+                mapping[i1 + k] = j1 + k
+        elif tag == 'insert':
+            stats['inserted'] += j2 - j1
+        elif tag == 'delete':
+            stats['removed'] += i2 - i1
+        else:
+            common = min(i2 - i1, j2 - j1)
+            stats['changed'] += common
+            stats['inserted'] += (j2 - j1) - common
+            stats['removed'] += (i2 - i1) - common
+
+    # 移動した行は、同じ内容の未対応の新しい行へ対応付ける
+    matched_new = set(mapping.values())
+    unmatched_new = {}
+    for j, value in enumerate(new_hashes):
+        if j not in matched_new:
+            unmatched_new.setdefault(value, []).append(j)
+    for i, value in enumerate(old_hashes):
+        if i not in mapping and unmatched_new.get(value):
+            mapping[i] = unmatched_new[value].pop(0)
+    return mapping, stats
+
+class CorpusFile:
+    """1つの原稿ファイルの行位置索引
+
+    原稿は手で編集されるファイルなので、メモリマップはせず、開いたファイルから
+    行ごとに読み出す（録音中に短く書き換えられても、古い位置を読むだけで異常終了しない）。
+    """
+
+    def __init__(self, path, starts, ends, hashes, signature):
+        self.path = Path(path)
+        self.name = self.path.name
+        self.starts = starts
+        self.ends = ends
+        self.hashes = hashes  # 行ごとの正規化テキストのハッシュ（再読み込み時の差分用）
+        self.signature = signature  # (サイズ, mtime_ns)
+        self._file = None
+        self._lock = threading.Lock()   # seek と read の組を複数スレッドから呼べるように
+
+    def __len__(self):
+        return len(self.starts)
+
+    @classmethod
+    def load(cls, path, cache_dir):
+        """キャッシュ済みの索引を読み込み（サイズ・更新時刻が変わっていれば再作成）"""
+        path = Path(path)
+        st = path.stat()
+        signature = (st.st_size, st.st_mtime_ns)
+        cache_path = Path(cache_dir) / (path.name + ".idx")
+
+        cached = cls._read_cache(cache_path, signature)
+        if cached is not None:
+            return cls(path, *cached, signature)
+
+        corpus_file = cls(path, array('Q'), array('Q'), array('Q'), signature)
+        if st.st_size:
+            with open(path, 'rb') as f:
+                data = f.read()
+            corpus_file.starts, corpus_file.ends, corpus_file.hashes = build_line_offsets(data)
+        corpus_file._write_cache(cache_path)
+        return corpus_file
+
+    @staticmethod
+    def _read_cache(cache_path, signature):
+        """索引キャッシュを読み込み（一致しなければNone）"""
+        try:
+            with open(cache_path, 'rb') as f:
+                magic, version, size, mtime_ns, count = INDEX_HEADER.unpack(f.read(INDEX_HEADER.size))
+                if magic != INDEX_MAGIC or version != INDEX_VERSION or (size, mtime_ns) != signature:
+                    return None
+                columns = (array('Q'), array('Q'), array('Q'))
+                for column in columns:
+                    column.frombytes(f.read(count * column.itemsize))
+        except (OSError, struct.error, ValueError):
+            return None
+        if any(len(column) != count for column in columns):
+            return None
+        return columns
+
+    def _write_cache(self, cache_path):
+        """索引キャッシュを書き出し"""
+        cache_path.parent.mkdir(parents=True, exist_ok=True)
+        temp_path = cache_path.with_suffix('.tmp')
+        with open(temp_path, 'wb') as f:
+            f.write(INDEX_HEADER.pack(INDEX_MAGIC, INDEX_VERSION, self.signature[0],
+                                      self.signature[1], len(self.starts)))
+            f.write(self.starts.tobytes())
+            f.write(self.ends.tobytes())
+            f.write(self.hashes.tobytes())
+        os.replace(temp_path, cache_path)
+
+    def text(self, local_index):
+        """指定行のテキストを読み出し
+
+        索引の作成後にファイルが書き換えられていた場合は、古い位置の内容（または空文字列）を返す。
+        書き換えは reload で検出して索引を作り直す。
+        """
+        start = self.starts[local_index]
+        with self._lock:
+            if self._file is None:
+                self._file = open(self.path, 'rb', buffering=0)   # 初回のみ開く（書き換えを読めるよう先読みバッファなし）
+            self._file.seek(start)
+            data = self._file.read(self.ends[local_index] - start)
+        return data.decode('utf-8', 'replace').strip()
+
+    def close(self):
+        """開いているファイルを閉じる"""
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+class Corpus:
+    """data/input 以下の全原稿を、行位置索引のみで保持するコーパス
+
+    行のテキストは必要になった時点でファイルから読み出す。
+    """
+
+    def __init__(self, input_dir="data/input", cache_dir="data/corpus_index"):
+        self.input_dir = Path(input_dir)
+        self.cache_dir = Path(cache_dir)
+        self.files = []
+        self.file_starts = []  # 各ファイルの先頭行の通し番号
+        self.file_positions = {}  # ファイル名 → self.files 内の位置
+        self.total = 0
+
+    def __len__(self):
+        return self.total
+
+    def load(self):
+        """全原稿ファイルの索引を読み込み"""
+        self.close()
+        self.files = [CorpusFile.load(path, self.cache_dir)
+                      for path in sorted(self.input_dir.glob("*.txt"))]
+        self._update_offsets()
+
+    def reload(self):
+        """サイズ・更新日時が変わったファイルだけを再解析する
+
+        返り値: {'changed': {ファイル名: (旧行位置→新行位置の対応, 変更行数)}, 'removed': [ファイル名]}
+        追加されたファイルは旧行位置の対応が空の changed として扱う。
+        """
+        old_files = {f.name: f for f in self.files}
+        files = []
+        changed = {}
+        for path in sorted(self.input_dir.glob("*.txt")):
+            old = old_files.pop(path.name, None)
+            st = path.stat()
+            if old is not None and old.signature == (st.st_size, st.st_mtime_ns):
+                files.append(old)
+                continue
+
+            new = CorpusFile.load(path, self.cache_dir)
+            # 旧ファイルの内容は索引に保存したハッシュで比較する（ファイル本体は既に変わっている）
+            changed[path.name] = diff_lines(old.hashes if old is not None else array('Q'), new.hashes)
+            if old is not None:
+                old.close()
+            files.append(new)
+
+        for old in old_files.values():
+            old.close()
+        self.files = files
+        self._update_offsets()
+        return {'changed': changed, 'removed': sorted(old_files)}
+
+    def _update_offsets(self):
+        """ファイルごとの通し番号の開始位置を再計算"""
+        self.file_starts = []
+        self.file_positions = {}
+        total = 0
+        for position, corpus_file in enumerate(self.files):
+            self.file_starts.append(total)
+            self.file_positions[corpus_file.name] = position
+            total += len(corpus_file)
+        self.total = total
+
+    def locate(self, index):
+        """通し番号から (原稿ファイル, ファイル内の行位置) を求める"""
+        if not 0 <= index < self.total:
+            raise IndexError(index)
+        file_pos = bisect.bisect_right(self.file_starts, index) - 1
+        return self.files[file_pos], index - self.file_starts[file_pos]
+
+    def line_info(self, index):
+        """(ファイル名, 行番号) を返す（テキストは読み込まない）"""
+        corpus_file, local_index = self.locate(index)
+        return corpus_file.name, local_index + 1
+
+    def text(self, index):
+        """指定行のテキストを読み出し"""
+        corpus_file, local_index = self.locate(index)
+        return corpus_file.text(local_index)
+
+    def index_of(self, file_name, line_number):
+        """(ファイル名, 行番号) から通し番号を求める（見つからなければNone）"""
+        position = self.file_positions.get(file_name)
+        if position is None or not 1 <= line_number <= len(self.files[position]):
+            return None
+        return self.file_starts[position] + line_number - 1
+
+    def signature(self):
+        """全原稿ファイルの (ファイル名, サイズ, 更新時刻, 行数) の一覧（変更検出用）"""
+        return [[f.name, f.signature[0], f.signature[1], len(f)] for f in self.files]
+
+    def file_bounds(self):
+        """[(ファイル名, 開始番号, 終了番号), ...]"""
+        return [(f.name, start, start + len(f)) for f, start in zip(self.files, self.file_starts)]
+
+    def close(self):
+        """全ファイルを閉じる"""
+        for corpus_file in self.files:
+            corpus_file.close()
@@ -0,0 +1,474 @@
+import os
+import re
+import json
+import struct
+import fnmatch
+import hashlib
+import unicodedata
+from pathlib import Path
+
+import numpy as np
+from metadata_store import MetadataStore, natural_key
+from session_store import SessionStore
+from dataset_lock import AUDIO_NAME_RE
+from audio_io import FLAC_SUFFIX, info, scan_audio
+
+INDEX_VERSION = 1
+DEFAULT_SPEAKER = "default"
+SPLIT_NAMES = ('train', 'val', 'test')
+MIN_HASH_GROUPS = 50   # グループがこれより少なければ、ハッシュではなく比率に近づくよう順に割り当てる
+
+class _DropTable(dict):
+    """str.translate 用の表（空白・句読点・記号なら削除。文字ごとの判定は一度だけ行う）"""
+
+    def __missing__(self, code):
+        ch = chr(code)
+        value = None if ch.isspace() or unicodedata.category(ch)[0] in 'PSZ' else code
+        self[code] = value
+        return value
+
+_DROP = _DropTable()
+
+def normalize_text(text):
+    """テキストの重複判定用の正規化（NFKC・小文字化、空白・句読点・記号を除く）"""
+    return unicodedata.normalize('NFKC', text).lower().translate(_DROP)
+
+def text_key(text):
+    """正規化したテキストの64bitハッシュ（同じ読み上げ文なら同じ値）"""
+    digest = hashlib.blake2b(normalize_text(text).encode('utf-8'), digest_size=8).digest()
+    return struct.unpack('<q', digest)[0]
+
+def _stat(path):
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return [st.st_size, st.st_mtime_ns]
+
+def load_speaker_map(path):
+    """話者の対応表（1行に「パターン<TAB>話者名」。パターンは原稿ファイル名か音声ファイル名に一致させる）
+
+    返り値: (一致判定の関数, 話者名) の一覧。上の行ほど優先する。
+    """
+    rules = []
+    if path is not None and Path(path).exists():
+        with open(path, 'r', encoding='utf-8') as f:
+            for line in f:
+                line = line.rstrip('\n')
+                if '\t' in line and not line.startswith('#'):
+                    pattern, speaker = line.split('\t', 1)
+                    rules.append((re.compile(fnmatch.translate(pattern.strip())).match, speaker.strip()))
+    return rules
+
+def _speaker_of(rules, source, name):
+    for match, speaker in rules:
+        if match(source) or match(name):
+            return speaker
+    return DEFAULT_SPEAKER
+
+def _read_session(session_file):
+    """セッションから 音声ファイル名 → (原稿ファイル名, 行番号, テイク数)
+
+    原稿は読み込まず、session.json と session.journal に記録された行の情報だけを使う。
+    """
+    store = SessionStore(session_file)
+    if not store.exists():
+        return {}
+    with store.file_lock:   # スナップショットの書き直しとジャーナルの削除の途中を読まないようにする
+        snapshot, entries = store.load()
+    if 'texts' in snapshot:
+        # 旧形式（全行を保存したsession.json）
+        recorded = [(t['file'], t['line_number'], t.get('audio_file'))
+                    for t in snapshot['texts'] if t.get('recorded')]
+    else:
+        recorded = snapshot.get('recorded', [])
+    lines = {(file_name, line_number): audio_file for file_name, line_number, audio_file in recorded if audio_file}
+    takes = {(file_name, line_number): len(versions)
+             for file_name, line_number, versions, _ in snapshot.get('takes', [])}
+    for entry in entries:
+        op = entry.get('op')
+        if op == 'recorded':
+            key = (entry['file'], entry['line_number'])
+            if entry['recorded']:
+                lines[key] = entry['audio_file']
+            else:
+                lines.pop(key, None)
+        elif op == 'takes':
+            takes[(entry['file'], entry['line_number'])] = len(entry['versions'])
+    return {audio_file: (key[0], key[1], takes.get(key, 1)) for key, audio_file in lines.items()}
+
+class DatasetIndex:
+    """録音済みテイクの列形式の索引（絞り込み・並べ替え・抽出）
+
+    metadata.txt のテイクごとに、セッションに記録された原稿ファイル名・行番号・
+    テイク数と、音声ファイルのヘッダから読んだフレーム数・サンプルレートなどを
+    1つの表にまとめる。表は列ごとの numpy 配列で、dataset/index_cache.npz に
+    キャッシュする。metadata.txt・セッション・音声ディレクトリ・話者の対応表が
+    前回と同じならキャッシュをそのまま使い、変わっていれば作り直す（更新時刻と
+    サイズが同じ音声ファイルはヘッダも読み直さない）。
+
+    filter・sort・sample は行番号の配列だけを持つ新しい DatasetIndex を返し、
+    列の配列は共有する。テキストは UTF-8 のバイト列を連結して持ち、必要な行だけ
+    復号する。
+    """
+
+    def __init__(self, columns, rows=None):
+        self.columns = columns
+        self.rows = np.arange(len(columns['name'])) if rows is None else rows
+
+    # --- 作成・読み込み ---
+
+    @classmethod
+    def load(cls, dataset_dir="dataset", session_file="data/session.json", cache_path=None,
+             speaker_map=None, rebuild=False):
+        """キャッシュを使って索引を読み込み（変更があれば作り直して保存）"""
+        dataset_dir = Path(dataset_dir)
+        cache_path = Path(cache_path) if cache_path else dataset_dir / "index_cache.npz"
+        speaker_map = Path(speaker_map) if speaker_map else dataset_dir / "speakers.tsv"
+        metadata_path = dataset_dir / "metadata.txt"
+        audio_dir = dataset_dir / "audio_files"
+        session_file = Path(session_file)
+        signature = json.dumps([INDEX_VERSION, _stat(metadata_path), _stat(metadata_path.with_suffix('.tombstones')),
+                                _stat(session_file), _stat(session_file.with_suffix('.journal')),
+                                _stat(audio_dir), _stat(speaker_map)])
+
+        cache = None
+        if cache_path.exists():
+            try:
+                with np.load(cache_path, allow_pickle=False) as data:
+                    cache = {key: data[key] for key in data.files}
+            except (OSError, ValueError):
+                cache = None
+        if cache is not None and not rebuild and str(cache.pop('signature')) == signature:
+            return cls(cache)
+        if cache is not None:
+            cache.pop('signature', None)
+
+        columns = cls._build(metadata_path, audio_dir, session_file, speaker_map, cache)
+        cache_path.parent.mkdir(parents=True, exist_ok=True)
+        temp_path = str(cache_path) + ".tmp.npz"
+        np.savez(temp_path, signature=np.array(signature), **columns)
+        os.replace(temp_path, cache_path)
+        return cls(columns)
+
+    @staticmethod
+    def _build(metadata_path, audio_dir, session_file, speaker_map, cache):
+        """metadata.txt・セッション・音声ファイルのヘッダから表を作成"""
+        entries = MetadataStore(metadata_path).entries
+        names = sorted(entries, key=natural_key)
+        session = _read_session(session_file)
+        rules = load_speaker_map(speaker_map)
+        scanned = scan_audio(audio_dir)
+
+        # 前回の表で (ファイル名, 更新時刻, サイズ) が一致するテイクはヘッダを読み直さない
+        previous = {}
+        if cache is not None and 'name' in cache:
+            previous = dict(zip(cache['name'].tolist(), zip(
+                cache['mtime'].tolist(), cache['size'].tolist(), cache['flac'].tolist(),
+                cache['frames'].tolist(), cache['sample_rate'].tolist(), cache['channels'].tolist())))
+
+        number, source, line, takes, speaker, in_session, keys = [], [], [], [], [], [], []
+        exists, flac, size, mtime, frames, sample_rate, channels = [], [], [], [], [], [], []
+        encoded = []
+        key_of = {}   # 同じテキストは一度だけ正規化する
+        for name in names:
+            text = entries[name][1]
+            encoded.append(text.encode('utf-8'))
+            key = key_of.get(text)
+            if key is None:
+                key = key_of[text] = text_key(text)
+            keys.append(key)
+            m = AUDIO_NAME_RE.match(name)
+            number.append(int(m.group(1)) if m else -1)
+
+            row_source, row_line, row_takes = session.get(name, ('', 0, 0))
+            source.append(row_source)
+            line.append(row_line)
+            takes.append(row_takes)
+            in_session.append(name in session)
+            speaker.append(_speaker_of(rules, row_source, name))
+
+            entry = scanned.get(name)
+            if entry is None:
+                exists.append(False)
+                flac.append(False)
+                size.append(0)
+                mtime.append(0)
+                frames.append(0)
+                sample_rate.append(0)
+                channels.append(0)
+                continue
+            st = entry.stat()
+            is_flac = entry.name.endswith(FLAC_SUFFIX)
+            exists.append(True)
+            flac.append(is_flac)
+            size.append(st.st_size)
+            mtime.append(st.st_mtime_ns)
+            cached = previous.get(name)
+            if cached is not None and cached[:3] == (st.st_mtime_ns, st.st_size, is_flac):
+                facts = cached[3:]
+            else:
+                try:
+                    audio_info = info(entry.path)
+                    facts = (audio_info.frames, audio_info.sample_rate, audio_info.channels)
+                except (OSError, ValueError, struct.error):
+                    facts = (0, 0, 0)   # 壊れたファイルは長さ 0 として扱う
+            frames.append(facts[0])
+            sample_rate.append(facts[1])
+            channels.append(facts[2])
+
+        columns = {
+            'name': np.array(names, dtype=str),
+            'number': np.array(number, dtype=np.int64),
+            'source': np.array(source, dtype=str),
+            'line': np.array(line, dtype=np.int32),
+            'takes': np.array(takes, dtype=np.int16),
+            'speaker': np.array(speaker, dtype=str),
+            'frames': np.array(frames, dtype=np.int64),
+            'sample_rate': np.array(sample_rate, dtype=np.int32),
+            'channels': np.array(channels, dtype=np.int8),
+            'size': np.array(size, dtype=np.int64),
+            'mtime': np.array(mtime, dtype=np.int64),
+            'text_key': np.array(keys, dtype=np.int64),
+            'in_session': np.array(in_session, dtype=bool),
+            'exists': np.array(exists, dtype=bool),
+            'flac': np.array(flac, dtype=bool),
+        }
+        rate = columns['sample_rate']
+        columns['duration'] = np.where(rate > 0, columns['frames'] / np.maximum(rate, 1), 0.0)
+        lengths = np.fromiter((len(b) for b in encoded), dtype=np.int64, count=len(names))
+        columns['text_offsets'] = np.concatenate([[0], np.cumsum(lengths)]).astype(np.int64)
+        columns['text_bytes'] = np.frombuffer(b''.join(encoded), dtype=np.uint8)
+        return columns
+
+    # --- 参照 ---
+
+    def __len__(self):
+        return len(self.rows)
+
+    def __getitem__(self, column):
+        """列の値（この索引に含まれるテイク分）"""
+        return self.columns[column][self.rows]
+
+    def _view(self, rows):
+        return DatasetIndex(self.columns, rows)
+
+    def names(self):
+        return [str(name) for name in self['name']]
+
+    def text(self, position):
+        """position 番目のテイクのテキスト"""
+        row = self.rows[position]
+        offsets = self.columns['text_offsets']
+        return self.columns['text_bytes'][offsets[row]:offsets[row + 1]].tobytes().decode('utf-8')
+
+    def texts(self):
+        return [self.text(i) for i in range(len(self))]
+
+    def records(self):
+        """テイクごとの辞書の一覧（テキストを含む）"""
+        keys = ('name', 'source', 'line', 'speaker', 'duration', 'sample_rate', 'takes', 'flac')
+        values = {key: self[key].tolist() for key in keys}
+        return [dict({key: values[key][i] for key in keys}, text=self.text(i)) for i in range(len(self))]
+
+    def total_duration(self):
+        return float(self['duration'].sum())
+
+    def summary(self):
+        """件数・合計時間・原稿ファイル別と話者別の件数"""
+        def counts(column):
+            values, number = np.unique(self[column], return_counts=True)
+            return {str(v): int(c) for v, c in zip(values, number)}
+        return {
+            'takes': len(self),
+            'hours': self.total_duration() / 3600,
+            'missing_audio': int((~self['exists']).sum()),
+            'flac': int(self['flac'].sum()),
+            'sources': counts('source'),
+            'speakers': counts('speaker'),
+        }
+
+    # --- 絞り込み・並べ替え・抽出 ---
+
+    def filter(self, mask=None, **conditions):
+        """条件に合うテイクだけの索引
+
+        conditions は 列名=値（リスト・集合ならそのいずれか）、min_列名=値・max_列名=値（範囲）、
+        text_contains=文字列。mask にはこの索引と同じ長さの真偽値配列も渡せる。
+        例: index.filter(source='cocoro.txt', min_duration=2, max_duration=10, in_session=True)
+        """
+        keep = np.ones(len(self), dtype=bool) if mask is None else np.asarray(mask, dtype=bool).copy()
+        for key, value in conditions.items():
+            if key == 'text_contains':
+                keep &= np.fromiter((value in self.text(i) if keep[i] else False for i in range(len(self))),
+                                    dtype=bool, count=len(self))
+                continue
+            bound, _, column = key.partition('_')
+            if bound in ('min', 'max') and column in self.columns:
+                values = self[column]
+                keep &= (values >= value) if bound == 'min' else (values <= value)
+            elif key in self.columns:
+                values = self[key]
+                if isinstance(value, (list, tuple, set, frozenset)):
+                    keep &= np.isin(values, list(value))
+                else:
+                    keep &= values == value
+            else:
+                raise ValueError(f"不明な条件です: {key}")
+        return self._view(self.rows[keep])
+
+    def sort(self, *columns, descending=False):
+        """列の値で並べ替え（複数指定時は前の列を優先、同じ値は元の順序のまま）"""
+        if not columns:
+            columns = ('name',)
+        keys = []
+        for column in reversed(columns):
+            if column not in self.columns:
+                raise ValueError(f"不明な列です: {column}")
+            values = self[column]
+            if column == 'name':
+                values = self['number']   # audio_2.wav が audio_10.wav より前
+            keys.append(values)
+        order = np.lexsort(keys)
+        if descending:
+            order = order[::-1]
+        return self._view(self.rows[order])
+
+    def sample(self, n=None, fraction=None, seed=0):
+        """ランダムに抽出（同じ seed なら同じ結果。元の並び順を保つ）"""
+        if n is None:
+            n = int(round(len(self) * (fraction if fraction is not None else 1.0)))
+        n = min(n, len(self))
+        rng = np.random.default_rng(seed)
+        picked = np.sort(rng.choice(len(self), size=n, replace=False))
+        return self._view(self.rows[picked])
+
+    def head(self, n):
+        return self._view(self.rows[:n])
+
+def _group_hash(seed, key):
+    digest = hashlib.blake2b(f"{seed}:{key}".encode('utf-8'), digest_size=8).digest()
+    return int.from_bytes(digest, 'big') / 2 ** 64
+
+def _groups(index, disjoint):
+    """話者・テキストを共有するテイクを同じグループにまとめる（返り値: 行ごとのグループ番号, グループのキー）"""
+    n = len(index)
+    if not disjoint:
+        return np.arange(n), [str(name) for name in index['name']]
+    speaker_values, speaker_ids = np.unique(index['speaker'], return_inverse=True)
+    text_values, text_ids = np.unique(index['text_key'], return_inverse=True)
+    if disjoint == {'speaker'}:
+        return speaker_ids, [str(v) for v in speaker_values]
+    if disjoint == {'text'}:
+        return text_ids, [str(v) for v in text_values]
+
+    # 話者とテキストの両方: 話者ノードとテキストノードを union-find で結ぶ
+    parent = list(range(len(speaker_values) + len(text_values)))
+    def find(x):
+        while parent[x] != x:
+            parent[x] = parent[parent[x]]
+            x = parent[x]
+        return x
+    offset = len(speaker_values)
+    for s, t in set(zip(speaker_ids.tolist(), text_ids.tolist())):
+        a, b = find(s), find(offset + t)
+        if a != b:
+            parent[max(a, b)] = min(a, b)
+    roots = np.array([find(s) for s in speaker_ids.tolist()])
+    root_values, group_ids = np.unique(roots, return_inverse=True)
+    # 各グループのキーは含まれる話者名の最小値（データが増えても変わりにくい）
+    keys = [str(speaker_values[root]) if root < offset else str(text_values[root - offset])
+            for root in root_values.tolist()]
+    return group_ids, keys
+
+def split_dataset(index, fractions=(0.8, 0.1, 0.1), names=SPLIT_NAMES, disjoint=('text',), seed=0):
+    """学習・検証・評価用に分割（同じ話者・同じテキストが複数の分割にまたがらない）
+
+    disjoint に 'speaker'・'text' を指定すると、それらを共有するテイクをまとめた
+    グループ単位で割り当てる。同じ入力と seed なら何度実行しても同じ結果になる。
+    グループが MIN_HASH_GROUPS 以上ある場合、割り当ては seed とグループのキー（テキストの
+    ハッシュ・話者名）のハッシュだけで決まるので、disjoint が空か 'speaker'・'text' の
+    どちらか一方ならテイクを追加しても既存のテイクの分割は変わらない。両方を指定した場合は
+    追加したテイクが既存のグループをつなぐとグループのキーが変わり、MIN_HASH_GROUPS 未満の
+    場合は合計時間が比率に近づくようにハッシュ順に割り当てるため、どちらも既存のテイクの
+    分割が変わることがある。
+    返り値: ({分割名: DatasetIndex}, 報告)
+    """
+    disjoint = set(disjoint or ())
+    unknown = disjoint - {'speaker', 'text'}
+    if unknown:
+        raise ValueError(f"不明な分割条件です: {', '.join(sorted(unknown))}")
+    if len(fractions) != len(names):
+        raise ValueError("分割名と比率の数が一致しません")
+    fractions = np.asarray(fractions, dtype=np.float64)
+    if (fractions < 0).any() or fractions.sum() <= 0:
+        raise ValueError("比率は0以上で、合計が正の値である必要があります")
+    fractions = fractions / fractions.sum()
+
+    group_ids, keys = _groups(index, disjoint)
+    weights = np.bincount(group_ids, weights=np.maximum(index['duration'], 1e-3), minlength=len(keys))
+    hashes = np.array([_group_hash(seed, key) for key in keys])
+    assignment = np.zeros(len(keys), dtype=np.int64)
+    if len(keys) >= MIN_HASH_GROUPS:
+        assignment = np.searchsorted(np.cumsum(fractions)[:-1], hashes, side='right')
+    else:
+        filled = np.zeros(len(names))
+        target = fractions * weights.sum()
+        for g in np.argsort(hashes, kind='stable'):
+            split = int(np.argmax(target - filled))   # 不足が最も大きい分割へ
+            assignment[g] = split
+            filled[split] += weights[g]
+
+    row_split = assignment[group_ids]
+    splits = {name: index._view(index.rows[row_split == i]).sort('name') for i, name in enumerate(names)}
+    report = {
+        'seed': seed,
+        'disjoint': sorted(disjoint),
+        'groups': len(keys),
+        'largest_group_share': float(weights.max() / weights.sum()) if len(keys) else 0.0,
+        'splits': {name: {'takes': len(part), 'hours': part.total_duration() / 3600,
+                          'target': float(fractions[i]),
+                          'speakers': int(len(np.unique(part['speaker']))),
+                          'texts': int(len(np.unique(part['text_key'])))}
+                   for i, (name, part) in enumerate(splits.items())},
+        'overlap': _overlap(splits),
+    }
+    return splits, report
+
+def _overlap(splits):
+    """複数の分割にまたがる話者・テキストの数（disjoint に指定した条件は 0 になる）"""
+    seen = {'speaker': {}, 'text_key': {}}
+    for name, part in splits.items():
+        for column in seen:
+            for value in np.unique(part[column]).tolist():
+                seen[column].setdefault(value, set()).add(name)
+    return {('text' if column == 'text_key' else column): sum(len(v) > 1 for v in values.values())
+            for column, values in seen.items()}
+
+def write_manifests(splits, report, output_dir, fmt='txt', audio_subdir="audio_files"):
+    """分割ごとのマニフェストと splits.json を書き出し
+
+    fmt='txt' は metadata.txt と同じ「音声ファイル名|テキスト」形式、fmt='jsonl' は
+    実際のファイルパス（FLAC なら audio_N.flac）・長さ・話者・原稿の行を含む1行1テイクの JSON。
+    """
+    output_dir = Path(output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    written = []
+    for name, part in splits.items():
+        path = output_dir / f"{name}.{fmt}"
+        temp_path = path.with_suffix(path.suffix + '.tmp')
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            if fmt == 'txt':
+                for i, audio_file in enumerate(part.names()):
+                    f.write(f"{audio_file}|{part.text(i)}\n")
+            else:
+                for record in part.records():
+                    physical = record['name'][:-len('.wav')] + FLAC_SUFFIX if record['flac'] else record['name']
+                    record['path'] = f"{audio_subdir}/{physical}"
+                    del record['flac']
+                    f.write(json.dumps(record, ensure_ascii=False) + "\n")
+        os.replace(temp_path, path)
+        written.append(path)
+    with open(output_dir / "splits.json", 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    return written
@@ -0,0 +1,259 @@
+import os
+import re
+import json
+import time
+import socket
+import threading
+from pathlib import Path
+from audio_io import logical_name, resolve
+
+try:
+    import fcntl
+except ImportError:   # Windows
+    fcntl = None
+    import msvcrt
+
+AUDIO_NAME_RE = re.compile(r'audio_(\d+)\.wav$')
+LEASE_SECONDS = 600   # 録音予約の有効期限（予約中は期限の1/3ごとに自動で延長）
+
+def try_lock(fd):
+    """開いているファイルを排他ロック（他のプロセスがロック中なら False）
+
+    ロックはファイルを閉じると解放される。Windows では確認せず常に True を返す。
+    """
+    if fcntl is None:
+        return True
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        return False
+    return True
+
+def default_station():
+    """端末名の既定値（ホスト名）"""
+    return socket.gethostname() or "station"
+
+class FileLock:
+    """ロックファイルによるプロセス間の排他ロック
+
+    POSIX では flock、Windows では msvcrt.locking を使う。同じプロセス内では
+    スレッド間の排他も兼ね、同じスレッドからは再入できる。ロックファイルは
+    開いたまま再利用し、削除しない。
+    """
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self._thread_lock = threading.RLock()
+        self._depth = 0
+        self._fd = None
+
+    def acquire(self):
+        self._thread_lock.acquire()
+        if self._depth == 0:
+            try:
+                if self._fd is None:
+                    self.path.parent.mkdir(parents=True, exist_ok=True)
+                    self._fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+                if fcntl is not None:
+                    fcntl.flock(self._fd, fcntl.LOCK_EX)
+                else:
+                    while True:
+                        try:
+                            os.lseek(self._fd, 0, os.SEEK_SET)
+                            msvcrt.locking(self._fd, msvcrt.LK_LOCK, 1)
+                            break
+                        except OSError:
+                            continue   # LK_LOCK は約10秒で諦めるので取れるまで繰り返す
+            except BaseException:
+                self._thread_lock.release()
+                raise
+        self._depth += 1
+
+    def release(self):
+        self._depth -= 1
+        if self._depth == 0:
+            if fcntl is not None:
+                fcntl.flock(self._fd, fcntl.LOCK_UN)
+            else:
+                os.lseek(self._fd, 0, os.SEEK_SET)
+                msvcrt.locking(self._fd, msvcrt.LK_UNLCK, 1)
+        self._thread_lock.release()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+class TakeIdAllocator:
+    """audio_N の番号を複数のプロセス（録音端末）間で重複なく払い出す
+
+    最後に払い出した番号を dataset/.take_id に保存し、ロックファイルで排他する。
+    番号は単調増加で、欠番が出ても再利用しない。.take_id がない場合（初回や
+    旧バージョンで作ったデータセット）は、既存の音声ファイルと metadata.txt の
+    最大番号から始める。
+    """
+
+    def __init__(self, counter_path="dataset/.take_id", audio_dir="dataset/audio_files",
+                 metadata_path="dataset/metadata.txt"):
+        self.counter_path = Path(counter_path)
+        self.audio_dir = Path(audio_dir)
+        self.metadata_path = Path(metadata_path)
+        self.lock = FileLock(self.counter_path.with_name(self.counter_path.name + ".lock"))
+
+    def _seed(self):
+        """既存のファイルから使用済みの最大番号を求める"""
+        numbers = [0]
+        if self.audio_dir.exists():
+            for entry in os.scandir(self.audio_dir):
+                m = AUDIO_NAME_RE.match(logical_name(entry.name))
+                if m:
+                    numbers.append(int(m.group(1)))
+        if self.metadata_path.exists():
+            with open(self.metadata_path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    m = AUDIO_NAME_RE.match(line.split('|', 1)[0])
+                    if m:
+                        numbers.append(int(m.group(1)))
+        return max(numbers)
+
+    def allocate(self, count=1):
+        """連続した count 個の番号を確保し、先頭の番号を返す"""
+        with self.lock:
+            try:
+                last = int(self.counter_path.read_text(encoding='ascii'))
+            except (FileNotFoundError, ValueError):
+                last = self._seed()
+            first = last + 1
+            # 旧バージョンや手作業で置かれたファイルとも重複しないようにする
+            while any(resolve(self.audio_dir / f"audio_{n}.wav") for n in range(first, first + count)):
+                first += 1
+
+            temp_path = self.counter_path.with_suffix('.tmp')
+            with open(temp_path, 'w', encoding='ascii') as f:
+                f.write(str(first + count - 1))
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(temp_path, self.counter_path)
+        return first
+
+class LineLeases:
+    """行ごとの録音予約（期限付き）
+
+    data/line_leases.json に「原稿ファイル名:行番号 → 予約した端末と期限」を保存する。
+    予約は録音開始時に取り、テイクが metadata.txt・セッションに反映されたら解放する。
+    予約中の行は延長用のスレッドが期限の1/3ごとに延長するので、長いテイクや保存の確認待ちでも
+    予約は切れない。異常終了した端末の予約は延長されなくなり、期限切れで自動的に無効になる。
+    """
+
+    def __init__(self, station=None, path="data/line_leases.json", ttl=LEASE_SECONDS):
+        self.station = station or default_station()
+        # 同じ端末名のプロセスが複数あっても区別できるようにする
+        self.owner = f"{self.station}/{os.getpid()}/{os.urandom(3).hex()}"
+        self.path = Path(path)
+        self.ttl = ttl
+        self.lock = FileLock(self.path.with_suffix('.lock'))
+        self._cache = (None, {})
+        self._held = set()   # このプロセスが予約中のキー（延長の対象）
+        self._renewer = None
+        self._stop = threading.Event()
+
+    def file_token(self):
+        """端末名をファイル名に使える形にしたもの"""
+        return re.sub(r'[^\w.-]', '_', self.station)
+
+    @staticmethod
+    def key(file_name, line_number):
+        return f"{file_name}:{line_number}"
+
+    def _read(self):
+        """有効期限内の予約（ファイルはアトミックに置き換えるのでロックなしで読める）"""
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            return {}
+        stamp = (st.st_ino, st.st_size, st.st_mtime_ns)
+        if self._cache[0] != stamp:
+            try:
+                with open(self.path, 'r', encoding='utf-8') as f:
+                    leases = json.load(f)
+            except (OSError, ValueError):
+                leases = {}
+            self._cache = (stamp, leases)
+        now = time.time()
+        return {key: lease for key, lease in self._cache[1].items() if lease['expires'] > now}
+
+    def _write(self, leases):
+        temp_path = self.path.with_suffix('.tmp')
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump(leases, f, ensure_ascii=False)
+        os.replace(temp_path, self.path)
+
+    def acquire(self, key):
+        """予約を取得または延長（他の端末が予約中なら False）"""
+        with self.lock:
+            leases = self._read()
+            lease = leases.get(key)
+            if lease is not None and lease['owner'] != self.owner:
+                return False
+            leases[key] = {'owner': self.owner, 'station': self.station, 'expires': time.time() + self.ttl}
+            self._write(leases)
+            self._held.add(key)
+            if self._renewer is None:
+                self._renewer = threading.Thread(target=self._renew_loop, daemon=True, name="lease-renewer")
+                self._renewer.start()
+        return True
+
+    def renew(self):
+        """予約中のキーの期限をまとめて延長（他の端末に取られていたキーは延長の対象から外す）"""
+        with self.lock:
+            if not self._held:
+                return
+            leases = self._read()
+            expires = time.time() + self.ttl
+            for key in list(self._held):
+                lease = leases.get(key)
+                if lease is not None and lease['owner'] != self.owner:
+                    self._held.discard(key)
+                    continue
+                leases[key] = {'owner': self.owner, 'station': self.station, 'expires': expires}
+            self._write(leases)
+
+    def _renew_loop(self):
+        while not self._stop.wait(self.ttl / 3):
+            try:
+                self.renew()
+            except OSError:
+                pass   # 次の周期で再試行（期限まではまだ余裕がある）
+
+    def release(self, key):
+        """自分の予約を解放"""
+        with self.lock:
+            self._held.discard(key)
+            leases = self._read()
+            if key in leases and leases[key]['owner'] == self.owner:
+                del leases[key]
+                self._write(leases)
+
+    def release_all(self):
+        """このプロセスの予約をすべて解放（終了時。延長も止める）"""
+        self._stop.set()
+        with self.lock:
+            self._held.clear()
+            leases = self._read()
+            remaining = {key: lease for key, lease in leases.items() if lease['owner'] != self.owner}
+            if len(remaining) != len(leases):
+                self._write(remaining)
+
+    def holder(self, key):
+        """他の端末が予約中ならその端末名"""
+        lease = self._read().get(key)
+        if lease is None or lease['owner'] == self.owner:
+            return None
+        return lease['station']
+
+    def others(self):
+        """他の端末が予約中の行（キー → 端末名）"""
+        return {key: lease['station'] for key, lease in self._read().items() if lease['owner'] != self.owner}
@@ -0,0 +1,110 @@
+import os
+import json
+from pathlib import Path
+from audio_io import scan_audio
+
+class DatasetFileIndex:
+    """dataset/ 以下の録音ファイルを1回の走査で索引化
+
+    audio_files / meta_files を os.scandir で1回ずつ走査し、metadata.txt と
+    meta_N.txt から「音声ファイル名 → テキスト」の対応を作る。ディレクトリと
+    metadata.txt、テキストを読んだ meta_N.txt の更新時刻・サイズが前回と同じなら、
+    キャッシュをそのまま返す（meta_N.txt をその場で書き換えてもディレクトリの更新時刻は
+    変わらないため、ファイルごとに確認する）。
+    """
+
+    def __init__(self, dataset_dir="dataset", cache_file="data/sync_cache.json"):
+        self.dataset_dir = Path(dataset_dir)
+        self.audio_dir = self.dataset_dir / "audio_files"
+        self.meta_dir = self.dataset_dir / "meta_files"
+        self.metadata_path = self.dataset_dir / "metadata.txt"
+        self.cache_file = Path(cache_file)
+        self._cache = None
+
+    @staticmethod
+    def _stat(path):
+        """変更検出用の更新時刻・サイズ・inode（置き換えも検出する）"""
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            return None
+        return [st.st_mtime_ns, st.st_size, st.st_ino]
+
+    def _signature(self):
+        """変更検出用のディレクトリ・metadata.txtの更新時刻"""
+        return [self._stat(path) for path in (self.audio_dir, self.meta_dir, self.metadata_path)]
+
+    def _meta_unchanged(self, cache):
+        """キャッシュ作成時に読んだ meta_N.txt が書き換えられていないか"""
+        return all(self._stat(self.meta_dir / meta_file) == stat
+                   for meta_file, stat in cache.get('meta_stats', {}).items())
+
+    def _load_cache(self):
+        """ディスク上のキャッシュを読み込み"""
+        if self._cache is None and self.cache_file.exists():
+            try:
+                with open(self.cache_file, 'r', encoding='utf-8') as f:
+                    self._cache = json.load(f)
+            except (OSError, json.JSONDecodeError):
+                self._cache = None
+        return self._cache
+
+    @staticmethod
+    def _scan_names(directory, suffix):
+        """ディレクトリを1回走査してファイル名を集める（隠しファイル・一時ファイルは除外）"""
+        try:
+            with os.scandir(directory) as entries:
+                return {entry.name for entry in entries
+                        if entry.name.endswith(suffix) and not entry.name.startswith('.')
+                        and entry.is_file()}
+        except FileNotFoundError:
+            return set()
+
+    def _read_metadata(self):
+        """metadata.txt を読み込み（重複時は後の行を優先）"""
+        texts = {}
+        if self.metadata_path.exists():
+            with open(self.metadata_path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    if '|' in line:
+                        filename, text = line.rstrip('\n').split('|', 1)
+                        texts[filename] = text
+        return texts
+
+    def scan(self):
+        """索引を返す: {'audio_files': [...], 'texts': {音声ファイル名: テキスト}}"""
+        signature = self._signature()
+        cache = self._load_cache()
+        if cache is not None and cache.get('signature') == signature and self._meta_unchanged(cache):
+            return cache
+
+        # FLAC に圧縮済みのテイクも audio_N.wav の名前で扱う
+        audio_files = set(scan_audio(self.audio_dir))
+        meta_files = self._scan_names(self.meta_dir, ".txt")
+        metadata_texts = self._read_metadata()
+
+        texts = {}
+        meta_stats = {}
+        for audio_file in audio_files:
+            if audio_file in metadata_texts:
+                texts[audio_file] = metadata_texts[audio_file]
+                continue
+            # metadata.txt にない場合は対応する meta_N.txt を参照
+            meta_file = "meta_" + audio_file[len("audio_"):-len(".wav")] + ".txt"
+            if audio_file.startswith("audio_") and meta_file in meta_files:
+                meta_stats[meta_file] = self._stat(self.meta_dir / meta_file)
+                with open(self.meta_dir / meta_file, 'r', encoding='utf-8') as f:
+                    texts[audio_file] = f.read().strip()
+
+        self._cache = {
+            'signature': signature,
+            'audio_files': sorted(audio_files),
+            'texts': texts,
+            'meta_stats': meta_stats
+        }
+        self.cache_file.parent.mkdir(parents=True, exist_ok=True)
+        temp_file = self.cache_file.with_suffix('.tmp')
+        with open(temp_file, 'w', encoding='utf-8') as f:
+            json.dump(self._cache, f, ensure_ascii=False)
+        os.replace(temp_file, self.cache_file)
+        return self._cache
@@ -0,0 +1,102 @@
+import math
+import time
+
+import numpy as np
+
+class LevelMeter:
+    """録音コールバック内でブロックごとのレベルと発話区間を逐次計算
+
+    ブロックの RMS が threshold_db 以上なら発話とみなし、最初と最後の発話位置を
+    記録しておく。停止時にはこの位置に前後の余白を付けた範囲を切り出すだけで
+    よいため、保存時に無音検出のための再走査は不要になる。
+    """
+
+    def __init__(self, sample_rate=44100, threshold_db=-40.0, pre_roll_ms=150,
+                 post_roll_ms=250, auto_stop_ms=None):
+        self.sample_rate = sample_rate
+        self.threshold = 10 ** (threshold_db / 20)
+        self.pre_roll = int(sample_rate * pre_roll_ms / 1000)
+        self.post_roll = int(sample_rate * post_roll_ms / 1000)
+        self.auto_stop_frames = int(sample_rate * auto_stop_ms / 1000) if auto_stop_ms else None
+
+        self.frames = 0
+        self.peak = 0.0          # 直近ブロックのピーク
+        self.rms = 0.0           # 直近ブロックのRMS
+        self.max_peak = 0.0      # テイク全体のピーク
+        self.voice_start = None  # 最初の発話ブロックの先頭フレーム
+        self.voice_end = None    # 最後の発話ブロックの末尾フレーム
+        self.auto_stopped = False
+
+        # コールバック処理時間の計測
+        self.blocks = 0
+        self.total_ns = 0
+        self.max_ns = 0
+        self.max_block_frames = 0
+
+    def process(self, block):
+        """1ブロック分のレベルを計算（block: (フレーム数, チャンネル数)）"""
+        start = time.perf_counter_ns()
+        frames = len(block)
+        if frames:
+            flat = block.reshape(-1)
+            # 一時配列を作らずにピークと二乗和を求める
+            peak = max(float(flat.max()), -float(flat.min()))
+            rms = math.sqrt(float(np.einsum('i,i->', flat, flat, dtype=np.float64)) / len(flat))
+            if block.dtype == np.int16:
+                peak /= 32768.0
+                rms /= 32768.0
+            self.peak = peak
+            self.rms = rms
+            if peak > self.max_peak:
+                self.max_peak = peak
+
+            if rms >= self.threshold:
+                if self.voice_start is None:
+                    self.voice_start = self.frames
+                self.voice_end = self.frames + frames
+            self.frames += frames
+
+            if (self.auto_stop_frames is not None and self.voice_end is not None
+                    and self.frames - self.voice_end >= self.auto_stop_frames):
+                self.auto_stopped = True
+
+        elapsed = time.perf_counter_ns() - start
+        self.blocks += 1
+        self.total_ns += elapsed
+        if elapsed > self.max_ns:
+            self.max_ns = elapsed
+        if frames > self.max_block_frames:
+            self.max_block_frames = frames
+
+    def trim_points(self):
+        """前後の無音を除いた範囲 (開始フレーム, 終了フレーム)。発話がなければ None"""
+        if self.voice_start is None:
+            return None
+        return (max(0, self.voice_start - self.pre_roll),
+                min(self.frames, self.voice_end + self.post_roll))
+
+    @property
+    def is_voiced(self):
+        return self.rms >= self.threshold
+
+    def meter_line(self, width=30):
+        """UI用のレベルメーター文字列"""
+        db = 20 * math.log10(max(self.peak, 1e-10))
+        filled = int(round(max(0.0, min(1.0, (db + 60) / 60)) * width))
+        bar = "█" * filled + "░" * (width - filled)
+        state = "🗣️ 発話" if self.is_voiced else "🤫 無音"
+        warning = " ⚠️ クリップ" if self.peak >= 0.999 else ""
+        return f"[{bar}] {db:6.1f} dBFS {state}{warning}"
+
+    def overhead(self):
+        """コールバック処理時間の集計（平均・最大, ミリ秒）とブロック周期に対する割合"""
+        if not self.blocks:
+            return None
+        period_ms = self.max_block_frames / self.sample_rate * 1000
+        mean_ms = self.total_ns / self.blocks / 1e6
+        return {
+            'mean_ms': mean_ms,
+            'max_ms': self.max_ns / 1e6,
+            'block_period_ms': period_ms,
+            'load_percent': mean_ms / period_ms * 100 if period_ms else 0.0
+        }
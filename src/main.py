@@ -1,22 +1,106 @@
 # main.py
 
 import os
+import sys
 import time
+_PROCESS_START = time.perf_counter()
+import struct
+import threading
+import argparse
+import metrics
+from metrics import MetricsWriter
 from text_manager import TextManager
-from audio_recorder import AudioRecorder
+from wav_stream_writer import recover_partial_files, recovered_path, commit_file, StreamedTake, PARTIAL_SUFFIX
+from save_pipeline import SavePipeline
+from metadata_store import MetadataStore
+from dataset_lock import LineLeases
+from take_store import TakeStore, FlacEncoder
+from audio_io import resolve, info
 from pathlib import Path
 
+GC_EVERY_TAKES = 200   # この件数のテイクを保存するごとにテイク保管庫の GC を行う
+
 class AudioDatasetCreator:
-    def __init__(self):
-        self.text_manager = TextManager()
-        self.audio_recorder = AudioRecorder()
+    def __init__(self, stream_to_disk=False, trim_silence=True, auto_stop_ms=None,
+                 enable_metrics=False, prometheus=False, station=None, flac=False, countdown=3):
+        self.metrics_writer = None
+        self.countdown_seconds = countdown
+        if enable_metrics:
+            self.metrics_writer = MetricsWriter(metrics.enable(), prometheus=prometheus)
+            metrics.registry.observe('startup_phase_seconds', time.perf_counter() - _PROCESS_START,
+                                     phase='imports')
+        init_start = time.perf_counter()
+        self.text_manager = TextManager(station=station)
+        # 複数の録音端末で同じ行を録音しないよう、録音中の行を予約する
+        self.leases = LineLeases(station)
+        self.held_lease = None
+        # 音声バックエンド（sounddevice・numpy）は最初の録音・再生まで読み込まない
+        self.recorder_options = {'stream_to_disk': stream_to_disk, 'trim_silence': trim_silence,
+                                 'auto_stop_ms': auto_stop_ms}
+        self._audio_recorder = None
+        self.sync_thread = None
+        self.metadata_store = MetadataStore()
+        # 撮り直しても以前のテイクを残し、いつでも戻せるようにする
+        self.take_store = TakeStore()
+        self.takes_since_gc = 0
+        # --flac: 保存は WAV のまま行い、裏で FLAC に圧縮する
+        self.flac_encoder = FlacEncoder(self.take_store) if flac else None
+        # 保存ジャーナルは端末ごとに分ける（起動時の再実行で他の端末の保存処理を拾わないため）
+        journal_path = f"data/save_queue_{self.leases.file_token()}.jsonl" if station else "data/save_queue.jsonl"
+        self.save_pipeline = SavePipeline(self.write_take, self.commit_take, journal_path)
         self.current_audio = None
+        self.last_saved = None
         self.setup_directories()
+        if metrics.registry is not None:
+            metrics.registry.observe('startup_phase_seconds', time.perf_counter() - init_start, phase='init')
     
     def setup_directories(self):
         """必要なディレクトリを作成"""
         Path("dataset/audio_files").mkdir(parents=True, exist_ok=True)
         Path("dataset/meta_files").mkdir(parents=True, exist_ok=True)
+        
+        # 前回中断された録音の一時ファイルを復旧
+        for recovered in recover_partial_files("dataset/audio_files"):
+            print(f"🩹 中断された録音を復旧しました: {recovered.name}")
+    
+    @property
+    def audio_recorder(self):
+        """録音・再生機能（初回アクセス時に初期化）"""
+        if self._audio_recorder is None:
+            from audio_recorder import AudioRecorder
+            self._audio_recorder = AudioRecorder(**self.recorder_options)
+        return self._audio_recorder
+    
+    @property
+    def is_recording(self):
+        """録音中か（音声バックエンドを初期化せずに判定）"""
+        return self._audio_recorder is not None and self._audio_recorder.is_recording
+    
+    def start_background_sync(self):
+        """録音ファイルとの同期をバックグラウンドで実行（その間も操作可能）"""
+        def run_sync():
+            with metrics.timed('startup_phase_seconds', phase='sync'):
+                self.text_manager.sync_with_actual_files()
+            self.collect_garbage()
+            self.compress_saved_takes()
+        self.sync_thread = threading.Thread(target=run_sync, daemon=True)
+        self.sync_thread.start()
+    
+    def wait_for_sync(self):
+        """バックグラウンド同期の完了を待つ"""
+        if self.sync_thread is not None:
+            self.sync_thread.join()
+            self.sync_thread = None
+    
+    def collect_garbage(self):
+        """参照されなくなったテイクをバックグラウンドで削除"""
+        self.takes_since_gc = 0
+        self.take_store.gc_in_background(self.text_manager.referenced_takes)
+    
+    def compress_saved_takes(self):
+        """まだ WAV のテイクをバックグラウンドで FLAC に圧縮（--flac 指定時）"""
+        if self.flac_encoder is not None:
+            self.flac_encoder.sweep(self.text_manager.published_takes())
     
     def display_interface(self):
         """ユーザーインターフェースを表示"""
@@ -36,8 +120,20 @@ class AudioDatasetCreator:
             print(f"\n📊 進捗: {progress['recorded']}/{progress['total']} 録音済み ({progress['progress_percent']:.1f}%)")
             
             status = "✅ 録音済み" if current_text['recorded'] else "⭕ 未録音"
+            versions, _ = self.text_manager.get_takes(self.text_manager.current_line)
+            if len(versions) > 1:
+                status += f"（テイク {len(versions)} 件: v で切り替え）"
             print(f"📍 状態: {status}")
         
+        if self.sync_thread is not None and self.sync_thread.is_alive():
+            print("🔄 録音ファイルと同期中...")
+        if self.save_pipeline.pending:
+            print(f"💾 保存処理中: {self.save_pipeline.pending} 件")
+        elif self.last_saved:
+            print(f"💾 最終保存: {self.last_saved}")
+        for job in self.save_pipeline.failed:
+            print(f"❌ 保存失敗: {job.audio_filename} ({job.error})")
+        
         print("\n" + "=" * 60)
         print("🎛️  操作コマンド:")
         print("   r  : 録音開始/再開")
@@ -47,213 +143,549 @@ class AudioDatasetCreator:
         print("   n  : 次の台本へ")
         print("   b  : 前の台本へ")
         print("   j  : 指定行にジャンプ")
+        print("   u  : 次の未録音行へ")
+        print("   v  : テイク履歴（以前のテイクに戻す）")
         print("   rf : テキストファイル再読み込み")
         print("   q  : 終了")
         print("   sync : ファイルとセッション同期")
+        print("   qc : 録音品質チェック")
+        print("   cv : 学習用の形式へ一括変換（リサンプリング）")
+        print("   metrics : 計測値の表示")
         print("=" * 60)
     
     def countdown(self, seconds=3):
-        """カウントダウン表示"""
-        for i in range(seconds, 0, -1):
-            print(f"\r🔴 録音開始まで {i} 秒...", end="", flush=True)
-            time.sleep(1)
+        """カウントダウン表示（小数の秒数は最初の1段で端数を待つ）"""
+        remaining = seconds
+        while remaining > 0:
+            whole = int(remaining) if remaining == int(remaining) else int(remaining) + 1
+            print(f"\r🔴 録音開始まで {whole} 秒...", end="", flush=True)
+            step = remaining - (whole - 1)
+            time.sleep(step)
+            remaining -= step
         print("\r🔴 録音中... (pで一時停止、sで停止)    ")
     
-    def run(self):
-        """メインループ"""
+    def start(self):
+        """セッション復元または新規作成と、前回未完了の保存処理の再開"""
         # セッション復元または新規作成
-        if not self.text_manager.load_session():
+        with metrics.timed('startup_phase_seconds', phase='load_session'):
+            restored = self.text_manager.load_session()
+        if not restored:
             print("📚 テキストファイルを読み込んでいます...")
-            self.text_manager.load_all_texts()
+            with metrics.timed('startup_phase_seconds', phase='load_texts'):
+                self.text_manager.load_all_texts()
             print(f"✅ {self.text_manager.total_lines} 行のテキストを読み込みました")
         else:
             print("📚 セッションを復元しました")
-            # 既存セッションの場合、ファイルと同期
-            print("🔄 録音ファイルとの同期を確認中...")
-            self.text_manager.sync_with_actual_files()
+            # 既存セッションの場合、ファイルとの同期はバックグラウンドで行い、すぐに操作できるようにする
+            self.start_background_sync()
+        
+        with metrics.timed('startup_phase_seconds', phase='recover_saves'):
+            self.recover_pending_saves()
+        
+        if metrics.registry is not None:
+            metrics.registry.set_gauge('startup_seconds', time.perf_counter() - _PROCESS_START)
+    
+    def go_to_line(self, index):
+        """指定行へ移動（範囲外なら何もしない）"""
+        if not 0 <= index < self.text_manager.total_lines:
+            return False
+        self.text_manager.move_to(index)
+        self.current_audio = None
+        if self.held_lease is not None and not self.is_recording:
+            self.leases.release(self.held_lease)
+            self.held_lease = None
+        return True
+    
+    def line_key(self, text_data):
+        """行の予約に使うキー"""
+        return self.leases.key(text_data['file'], text_data['line_number'])
+    
+    def claim_current_line(self):
+        """現在行を録音用に予約（返り値: 他の端末が録音中ならその端末名）"""
+        key = self.line_key(self.text_manager.get_current_text())
+        if not self.leases.acquire(key):
+            return self.leases.holder(key) or "他の端末"
+        if self.held_lease not in (None, key):
+            self.leases.release(self.held_lease)
+        self.held_lease = key
+        return None
     
-        time.sleep(2)
+    def next_unrecorded_line(self):
+        """次の未録音行（他の端末の録音を取り込み、他の端末が録音中の行は飛ばす）"""
+        manager = self.text_manager
+        manager.refresh()
+        taken = self.leases.others()
+        start = manager.current_line + 1
+        index = manager.next_unrecorded_line(start)
+        first = index
+        while index is not None and taken:
+            file_name, line_number = manager.corpus.line_info(index)
+            if self.leases.key(file_name, line_number) not in taken:
+                break
+            index = manager.next_unrecorded_line(index + 1)
+            if index == first:
+                return None
+        return index
+    
+    def save_take(self):
+        """録音を停止して保存キューへ追加
         
-        while True:
-            self.display_interface()
-            command = input("\nコマンドを入力してください: ").strip().lower()
-            
-            if command == 'r':
-                # 録音状態をリセットしてから開始
-                self.audio_recorder.reset_recording()
-                
-                if not self.audio_recorder.is_recording:
-                    self.countdown()
-                    if self.audio_recorder.start_recording():
-                        print("🎙️ 録音開始！")
-                    else:
-                        print("❌ 録音開始に失敗しました")
-                        input("Enterを押して続行...")
-                else:
-                    if self.audio_recorder.resume_recording():
-                        print("▶️ 録音再開")
-            
-            elif command == 'p':
-                if self.audio_recorder.is_recording:
-                    self.audio_recorder.pause_recording()
-                    print("⏸️ 録音一時停止")
-            
-            elif command == 's':
-                if self.audio_recorder.is_recording:
-                    current_text = self.text_manager.get_current_text()
-                    
-                    # 新しいファイル名形式
-                    file_number = self.text_manager.get_next_filename()
-                    audio_filename = f"audio_{file_number}.wav"
-                    meta_filename = f"meta_{file_number}.txt"
-                    
-                    # 既存ファイルのチェック
-                    existing_audio = Path("dataset/audio_files") / audio_filename
-                    if existing_audio.exists():
-                        overwrite = input(f"⚠️  {audio_filename} は既に存在します。上書きしますか？ (y/n): ").strip().lower()
-                        if overwrite != 'y':
-                            print("❌ 録音保存をキャンセルしました")
-                            input("Enterを押して続行...")
-                            continue
-                    
-                    self.current_audio = self.audio_recorder.stop_recording()
-                    if self.current_audio is not None:
-                        # 音声ファイル保存
-                        self.audio_recorder.save_audio(self.current_audio, audio_filename)
-                        
-                        # メタファイル保存
-                        self.save_meta_file(current_text, meta_filename, file_number)
-                        
-                        # metadata.txt更新
-                        self.update_metadata_file(audio_filename, current_text['text'])
-                        
-                        # セッション更新
-                        self.text_manager.mark_as_recorded(audio_filename, file_number)
-                        
-                        print(f"💾 録音保存完了: {audio_filename}")
-                        print(f"📝 テキスト保存: {meta_filename}")
-                        input("Enterを押して続行...")
+        撮り直しでも確認はしない（以前のテイクはテイク保管庫に残り、v で戻せる）。
+        返り値: 保存する音声ファイル名 / 他の端末が録音中の行なら False / 録音がなければ None
+        """
+        if not self.is_recording:
+            return None
+        if self.claim_current_line() is not None:
+            return False  # 録音中に移動した行を他の端末が録音している
+        current_text = self.text_manager.get_current_text()
+        pending = self.save_pipeline.pending_job(self.text_manager.current_line)
+        if pending is not None:
+            # 保存待ちのテイクの撮り直しも同じ audio_N に保存する
+            file_number, audio_filename, meta_filename = pending.file_number, pending.audio_filename, pending.meta_filename
+        else:
+            file_number, audio_filename, meta_filename = self.text_manager.take_filenames(
+                self.text_manager.current_line)
+        
+        self.current_audio = self.audio_recorder.stop_recording()
+        if self.current_audio is None:
+            return None
+        # 保存処理はバックグラウンドで実行し、すぐに次の操作へ戻る
+        self.save_pipeline.submit(self.current_audio, file_number, audio_filename,
+                                  meta_filename, current_text, self.text_manager.current_line)
+        self.held_lease = None  # 予約は保存の完了時に解放する
+        if metrics.registry is not None:
+            metrics.registry.max_gauge('save_queue_depth_max', self.save_pipeline.pending)
+        return audio_filename
+    
+    def shutdown(self):
+        """録音を破棄し、保存待ちの処理を書き込んで終了"""
+        if self.is_recording:
+            self.audio_recorder.reset_recording()
+        self.wait_for_sync()
+        if self.save_pipeline.pending:
+            print(f"💾 保存待ちの {self.save_pipeline.pending} 件を書き込み中...")
+        failed = self.save_pipeline.close()
+        if failed:
+            print(f"⚠️ {len(failed)} 件の保存に失敗しました（次回起動時に再試行します）")
+        self.leases.release_all()
+        if self.flac_encoder is not None:
+            # 未着手の圧縮は次回起動時に再開する
+            self.flac_encoder.close(wait=False)
+        self.take_store.wait_for_gc()
+        self.text_manager.close_session()
+        self.metadata_store.close()
+        if self.metrics_writer is not None:
+            self.metrics_writer.close()
+        print("👋 お疲れさまでした！")
+    
+    def run(self):
+        """メインループ（1行入力方式）"""
+        self.start()
+        try:
+            while True:
+                self.display_interface()
+                command = input("\nコマンドを入力してください: ").strip().lower()
+                if not self.handle_command(command):
+                    break
+        except KeyboardInterrupt:
+            print()
+            self.shutdown()   # 保存待ちの書き込みと予約の解放は Ctrl+C でも行う
+    
+    def handle_command(self, command):
+        """コマンドを1つ実行（終了コマンドなら False）"""
+        if command == 'r':
+            # 録音状態をリセットしてから開始
+            self.audio_recorder.reset_recording()
+            holder = self.claim_current_line()
             
-            elif command == 'l':
-                if self.current_audio is not None:
-                    print("🔊 録音音声を再生中...")
-                    self.audio_recorder.play_audio(self.current_audio)
+            if holder is not None:
+                print(f"⚠️ この行は {holder} が録音中です")
+                input("Enterを押して続行...")
+            elif not self.audio_recorder.is_recording:
+                self.countdown(self.countdown_seconds)
+                if self.audio_recorder.start_recording():
+                    print("🎙️ 録音開始！")
+                    self.monitor_recording()
                 else:
-                    print("❌ 再生する音声がありません")
+                    print("❌ 録音開始に失敗しました")
                     input("Enterを押して続行...")
-            
-            elif command == 'n':
-                if self.text_manager.current_line < self.text_manager.total_lines - 1:
-                    self.text_manager.current_line += 1
-                    self.text_manager.save_session()
-                    self.current_audio = None
-            
-            elif command == 'b':
-                if self.text_manager.current_line > 0:
-                    self.text_manager.current_line -= 1
-                    self.text_manager.save_session()
-                    self.current_audio = None
-            
-            elif command == 'j':
-                try:
-                    line_num = int(input("ジャンプする行番号を入力: ")) - 1
-                    if 0 <= line_num < self.text_manager.total_lines:
-                        self.text_manager.current_line = line_num
-                        self.text_manager.save_session()
-                        self.current_audio = None
-                    else:
-                        print("❌ 無効な行番号です")
-                        input("Enterを押して続行...")
-                except ValueError:
-                    print("❌ 数値を入力してください")
+            else:
+                if self.audio_recorder.resume_recording():
+                    print("▶️ 録音再開")
+                    self.monitor_recording()
+        
+        elif command == 'p':
+            if self.is_recording:
+                self.audio_recorder.pause_recording()
+                print("⏸️ 録音一時停止")
+        
+        elif command == 's':
+            audio_filename = self.save_take()
+            if audio_filename is False:
+                print("❌ この行は他の端末が録音中のため保存できません")
+                input("Enterを押して続行...")
+            elif audio_filename:
+                print(f"💾 保存キューに追加: {audio_filename}")
+        
+        elif command == 'l':
+            if self.current_audio is not None:
+                print("🔊 録音音声を再生中...")
+                self.audio_recorder.play_audio(self.current_audio)
+            else:
+                print("❌ 再生する音声がありません")
+                input("Enterを押して続行...")
+        
+        elif command == 'n':
+            self.go_to_line(self.text_manager.current_line + 1)
+        
+        elif command == 'b':
+            self.go_to_line(self.text_manager.current_line - 1)
+        
+        elif command == 'u':
+            next_line = self.next_unrecorded_line()
+            if next_line is not None:
+                self.go_to_line(next_line)
+            else:
+                print("🎉 全ての行が録音済みです")
+                input("Enterを押して続行...")
+        
+        elif command == 'v':
+            self.choose_take()
+            input("Enterを押して続行...")
+        
+        elif command == 'j':
+            try:
+                line_num = int(input("ジャンプする行番号を入力: ")) - 1
+                if not self.go_to_line(line_num):
+                    print("❌ 無効な行番号です")
                     input("Enterを押して続行...")
-            
-            elif command == 'refresh' or command == 'rf':
-                print("📚 テキストファイルを再読み込み中...")
-                current_line = self.text_manager.current_line  # 現在位置を保存
-                self.text_manager.load_all_texts()
-                # 現在位置が範囲外になった場合は最後の行に移動
-                if current_line >= self.text_manager.total_lines:
-                    self.text_manager.current_line = max(0, self.text_manager.total_lines - 1)
-                else:
-                    self.text_manager.current_line = current_line
-                self.text_manager.save_session()
-                self.current_audio = None
-                print(f"✅ テキスト再読み込み完了 ({self.text_manager.total_lines} 行)")
+            except ValueError:
+                print("❌ 数値を入力してください")
                 input("Enterを押して続行...")
+        
+        elif command == 'refresh' or command == 'rf':
+            print("📚 テキストファイルを再読み込み中...")
+            self.wait_for_sync()
+            self.save_pipeline.flush()  # 保存待ちの行番号がずれないよう先に反映
+            report = self.text_manager.reload_texts()
+            self.current_audio = None
+            print(f"✅ テキスト再読み込み完了 ({self.text_manager.total_lines} 行)")
+            if not report['files'] and not report['removed_files']:
+                print("   変更されたファイルはありません")
+            for file_name, stats in report['files'].items():
+                print(f"   📝 {file_name}: 追加 {stats['inserted']} 行 / 削除 {stats['removed']} 行 / 変更 {stats['changed']} 行")
+            for file_name in report['removed_files']:
+                print(f"   🗑️ {file_name}: ファイルが削除されました")
+            if report['dropped_recordings']:
+                print(f"⚠️ 対応する行が見つからなくなった録音: {len(report['dropped_recordings'])} 件")
+                print(f"   {report['dropped_recordings'][:10]}")
+            input("Enterを押して続行...")
+        
+        elif command == 'q':
+            self.shutdown()
+            return False
+        
+        elif command == 'status' or command == 'st':
+            print("📊 詳細ステータス:")
+            index = self.text_manager.recorded_index
+            summary = self.text_manager.get_unrecorded_summary()
             
-            elif command == 'q':
-                if self.audio_recorder.is_recording:
-                    self.audio_recorder.stop_recording()
-                print("👋 お疲れさまでした！")
-                break
+            print(f"   現在の行: {self.text_manager.current_line + 1}")
+            print(f"   総行数: {self.text_manager.total_lines}")
+            print(f"   録音済み: {index.recorded_count} 行")
+            print(f"   未録音: {index.unrecorded_count} 行")
             
-            elif command == 'status' or command == 'st':
-                print("📊 詳細ステータス:")
-                recorded_lines = [i+1 for i, text in enumerate(self.text_manager.all_texts) if text['recorded']]
-                unrecorded_lines = [i+1 for i, text in enumerate(self.text_manager.all_texts) if not text['recorded']]
-                
-                print(f"   現在の行: {self.text_manager.current_line + 1}")
-                print(f"   総行数: {self.text_manager.total_lines}")
-                print(f"   録音済み: {len(recorded_lines)} 行")
-                print(f"   未録音: {len(unrecorded_lines)} 行")
-                
-                if len(unrecorded_lines) <= 20:  # 未録音が20行以下なら表示
-                    print(f"   未録音の行番号: {unrecorded_lines}")
-                else:
-                    print(f"   未録音の行番号（最初の10行）: {unrecorded_lines[:10]}")
-                
-                input("Enterを押して続行...")
+            unrecorded_lines = [i + 1 for i in index.unrecorded_lines(20)]
+            if index.unrecorded_count <= 20:  # 未録音が20行以下なら表示
+                print(f"   未録音の行番号: {unrecorded_lines}")
+            else:
+                print(f"   未録音の行番号（最初の10行）: {unrecorded_lines[:10]}")
             
-            elif command == 'cleanup':
-                print("🧹 重複データのクリーンアップ中...")
-                self.cleanup_duplicates()
-                print("✅ クリーンアップ完了")
-                input("Enterを押して続行...")
+            print("   原稿ファイル別の未録音数:")
+            for file_name, count in summary['per_file'].items():
+                print(f"     {file_name}: {count} 行")
             
-            elif command == 'sync':
-                print("🔄 セッションデータとファイルを同期中...")
-                self.text_manager.sync_with_actual_files()
-                print("✅ 同期完了")
-                input("Enterを押して続行...")
+            input("Enterを押して続行...")
+        
+        elif command == 'cleanup':
+            print("🧹 重複データのクリーンアップ中...")
+            self.wait_for_sync()
+            self.save_pipeline.flush()
+            self.cleanup_duplicates()
+            print("✅ クリーンアップ完了")
+            input("Enterを押して続行...")
+        
+        elif command == 'qc':
+            print("🔍 録音品質をチェック中...")
+            from quality_check import run_qc, find_outliers
+            self.save_pipeline.flush()
+            table = run_qc(metadata_store=self.metadata_store)
+            outliers = find_outliers(table)
+            print(f"📊 {len(table['name'])} テイク中 {len(outliers)} 件が要確認（新規解析 {table['analyzed']} 件）")
+            for name, reasons in outliers[:20]:
+                print(f"   ⚠️ {name}: {', '.join(reasons)}")
+            if len(outliers) > 20:
+                print(f"   ... 他 {len(outliers) - 20} 件（python script/quality_check.py で全件表示）")
+            input("Enterを押して続行...")
+        
+        elif command == 'cv':
+            rates = input("変換後のサンプルレート（カンマ区切り、既定: 22050,16000）: ").strip() or "22050,16000"
+            from audio_convert import make_spec
+            self.save_pipeline.flush()
+            try:
+                specs = [(rate.strip(), make_spec(int(rate))) for rate in rates.split(',')]
+            except ValueError:
+                print("❌ 無効なサンプルレートです")
+                specs = []
+            try:
+                for rate, spec in specs:
+                    print(f"🔄 {rate} Hz へ変換中...")
+                    result = self.convert_audio(spec)
+                    counts = result['counts']
+                    print(f"✅ {result['output_dir']}: 変換 {counts['done']} / スキップ {counts['skipped']}"
+                          f" / 失敗 {counts['failed']}")
+            except (ValueError, OSError, RuntimeError) as e:
+                # 出力先に書けない・音声ファイルが読めないなど（soundfile は RuntimeError を出す）
+                print(f"❌ 変換に失敗しました: {e}")
+            input("Enterを押して続行...")
+        
+        elif command == 'metrics':
+            self.show_metrics()
+            input("Enterを押して続行...")
+        
+        elif command == 'sync':
+            print("🔄 セッションデータとファイルを同期中...")
+            self.wait_for_sync()
+            self.save_pipeline.flush()
+            recorded = self.text_manager.sync_with_actual_files()
+            print(f"✅ 同期完了: {recorded} 件の録音ファイルを確認")
+            input("Enterを押して続行...")
+        return True
+    
+    def monitor_recording(self):
+        """録音中のレベルメーターを表示（Enterでメニューへ戻る。録音は継続）
+
+        端末では KeyReader でキー入力を待つので、戻った後に入力を横取りするスレッドは残らない。
+        自動停止したときや録音が止まったときもメニューへ戻る。端末以外（パイプ入力）では
+        メーターを1回表示して1行読むだけにする。
+        """
+        meter = self.audio_recorder.level_meter
+        if not sys.stdin.isatty():
+            print(f"🎚️ {meter.meter_line()}  (Enterでメニューへ)")
+            input()
+            return
+        from terminal_ui import KeyReader
+        with KeyReader() as keys:
+            while self.audio_recorder.is_recording:
+                print(f"\r🎚️ {meter.meter_line()}  (Enterでメニューへ)", end="", flush=True)
+                if meter.auto_stopped:
+                    print("\n⏹️ 無音が続いたため録音を自動停止しました（sで保存）")
+                    return
+                if keys.read_key(0.1) in ('\n', '\r'):
+                    break
+        print()
+    
+    def choose_take(self):
+        """現在行のテイク履歴を表示し、選んだテイクに戻す"""
+        index = self.text_manager.current_line
+        self.save_pipeline.flush()   # 保存待ちのテイクを履歴に反映
+        versions, active = self.text_manager.get_takes(index)
+        if not versions:
+            print("❌ この行にはテイク履歴がありません")
+            return
+        print("🗂️ テイク履歴（古い順）:")
+        for number, take_hash in enumerate(versions, 1):
+            size = self.take_store.size(take_hash)
+            mark = "▶" if take_hash == active else " "
+            detail = f"{size / 1024:.0f} KB" if size is not None else "削除済み"
+            print(f"  {mark} {number}: {take_hash[:12]}  {detail}")
+        choice = input("有効にするテイクの番号（Enterで取り消し）: ").strip()
+        if not choice:
+            return
+        try:
+            take_hash = versions[int(choice) - 1]
+        except (ValueError, IndexError):
+            print("❌ 無効な番号です")
+            return
+        result = self.rollback_take(index, take_hash)
+        if result is None:
+            print(f"✅ テイク {choice} に戻しました")
+        else:
+            print(f"❌ {result}")
+    
+    def rollback_take(self, index, take_hash):
+        """行の有効なテイクを履歴の別のテイクに切り替える（ファイルはリンクし直すだけ）
+        
+        返り値: 切り替えられなかった場合はその理由、成功すれば None
+        """
+        if self.is_recording and index == self.text_manager.current_line:
+            return "録音中の行は切り替えられません"
+        if not self.take_store.contains(take_hash):
+            return "テイクが保管庫にありません"
+        text_data = self.text_manager.get_text(index)
+        key = self.line_key(text_data)
+        if not self.leases.acquire(key):
+            return f"この行は {self.leases.holder(key) or '他の端末'} が録音中です"
+        try:
+            file_number, audio_filename, meta_filename = self.text_manager.take_filenames(index)
+            self.take_store.promote(take_hash, audio_filename)
+            if self.flac_encoder is not None:
+                self.flac_encoder.submit(take_hash, audio_filename)
+            if text_data['audio_file'] != audio_filename:
+                # 録音ファイルが削除されていた行は、音声・メタファイルを作り直して録音済みに戻す
+                self.save_meta_file(text_data, meta_filename, file_number)
+                self.update_metadata_file(audio_filename, text_data['text'])
+                self.text_manager.mark_as_recorded(audio_filename, index)
+            self.text_manager.activate_take(index, take_hash)
+        finally:
+            if key != self.held_lease:
+                self.leases.release(key)
+        if index == self.text_manager.current_line:
+            self.current_audio = None
+        return None
+    
+    def show_metrics(self):
+        """計測値の一覧を表示"""
+        if metrics.registry is None:
+            print("📈 計測は無効です（python src/main.py --metrics で有効化）")
+            return
+        snapshot = metrics.registry.snapshot()
+        print(f"📈 計測値（起動から {snapshot['uptime']:.0f} 秒）")
+        for name, value in snapshot['counters'].items():
+            print(f"   {name}: {value}")
+        for name, value in snapshot['gauges'].items():
+            print(f"   {name}: {value:.3f}" if isinstance(value, float) else f"   {name}: {value}")
+        for name, h in snapshot['histograms'].items():
+            if h['count']:
+                print(f"   {name}: {h['count']} 回 / 平均 {h['mean'] * 1000:.2f} ms"
+                      f" / p99 ≦ {h['p99'] * 1000:.2f} ms / 最大 {h['max'] * 1000:.2f} ms")
+        print(f"💾 {self.metrics_writer.path} に {self.metrics_writer.interval:.0f} 秒ごとに記録中")
+    
+    def write_take(self, job):
+        """テイクを保管庫に入れて audio_N.wav として公開し、メタファイルを書き込み（保存パイプラインのワーカーで実行）
+        
+        同じ行（audio_N）のジョブは前のジョブの完了後に実行されるので、公開の順序は投入順になる。
+        --flac 指定時は、公開した WAV を裏で FLAC に圧縮する（保存の待ち時間は増えない）。
+        """
+        if job.take_hash is not None:
+            # 復旧時: 保管庫に入れ済みのテイクを公開し直す
+            self.take_store.promote(job.take_hash, job.audio_filename)
+        else:
+            staged = None
+            if job.audio is not None:
+                staged_path = self.take_store.staging_path(f"{os.getpid()}_{job.job_id}_{job.audio_filename}")
+                if isinstance(job.audio, StreamedTake):
+                    # 書き込み済みの一時ファイルを移すだけ（復旧時に録音クラス・sounddevice を読み込まない）
+                    with metrics.timed('save_stage_seconds', stage='rename'):
+                        job.audio.path = commit_file(job.audio.path, staged_path)
+                    staged = str(staged_path)
+                else:
+                    staged = self.audio_recorder.save_audio(job.audio, staged_path.name, directory=staged_path.parent)
+            versions, _ = self.text_manager.get_takes(job.index)
+            with metrics.timed('save_stage_seconds', stage='take_store'):
+                job.take_hash, job.previous_take = self.take_store.publish(job.audio_filename, staged,
+                                                                           adopt=not versions)
+        if self.flac_encoder is not None:
+            self.flac_encoder.submit(job.take_hash, job.audio_filename)
+            if job.previous_take is not None:
+                self.flac_encoder.submit(job.previous_take)
+        self.save_meta_file(job.text_data, job.meta_filename, job.file_number)
+    
+    def commit_take(self, job):
+        """metadata.txtとセッションに反映（投入順に実行）"""
+        self.update_metadata_file(job.audio_filename, job.text_data['text'])
+        with metrics.timed('save_stage_seconds', stage='session_write'):
+            self.text_manager.mark_as_recorded(job.audio_filename, job.index)
+            self.text_manager.add_take(job.index, job.take_hash, job.previous_take)
+        self.leases.release(self.line_key(job.text_data))
+        self.last_saved = job.audio_filename
+        self.takes_since_gc += 1
+        if self.takes_since_gc >= GC_EVERY_TAKES:
+            self.collect_garbage()
+        if metrics.registry is not None:
+            metrics.registry.observe('save_latency_seconds', time.perf_counter() - job.submitted_at)
+    
+    def recover_pending_saves(self):
+        """前回未完了だった保存処理を再実行"""
+        for record in self.save_pipeline.recover():
+            source = record['source']
+            take_hash = record.get('take_hash')
+            if source and not Path(source).exists() and source.endswith(PARTIAL_SUFFIX):
+                # 起動時の recover_partial_files が一時ファイルを復旧済みならそちらを使う
+                source = str(recovered_path(source))
+            if take_hash and not self.take_store.contains(take_hash):
+                take_hash = None
+            if take_hash:
+                audio = None  # テイクは保管庫に入れ済み
+            elif source and Path(source).exists():
+                # 形式は一時ファイルのヘッダから読む（録音クラスを作ると sounddevice を読み込んでしまう）
+                try:
+                    header = info(source)
+                except (OSError, ValueError, struct.error):
+                    header = None
+                if header is None:
+                    print(f"⚠️ 一時ファイルが壊れているため保存できません: {record['audio_filename']}")
+                    continue
+                audio = StreamedTake(source, header.sample_rate, header.channels, 0)
+            elif resolve(Path("dataset/audio_files") / record['audio_filename']):
+                audio = None  # 音声ファイルは書き込み済み
+            else:
+                print(f"⚠️ 音声データが失われたため保存できません: {record['audio_filename']}")
+                continue
+            
+            print(f"💾 未完了の保存処理を再開: {record['audio_filename']}")
+            self.save_pipeline.submit(audio, record['file_number'], record['audio_filename'],
+                                      record['meta_filename'], record['text_data'],
+                                      record['index'], job_id=record['id'],
+                                      take_hash=take_hash,
+                                      previous_take=record.get('previous_take'))
+    
+    def convert_audio(self, spec):
+        """録音済みテイクを指定の形式へ一括変換"""
+        def progress(done, total):
+            if done == total or done % 50 == 0:
+                print(f"\r   {done}/{total} 件", end="\n" if done == total else "", flush=True)
+        from audio_convert import convert_dataset
+        return convert_dataset(spec, progress=progress)
     
     def save_meta_file(self, text_data, meta_filename, file_number):
         """メタファイルを保存（新形式）"""
         meta_path = Path("dataset/meta_files") / meta_filename
         
-        with open(meta_path, 'w', encoding='utf-8') as f:
-            f.write(text_data['text'])
+        with metrics.timed('save_stage_seconds', stage='meta_write'):
+            with open(meta_path, 'w', encoding='utf-8') as f:
+                f.write(text_data['text'])
 
     def update_metadata_file(self, audio_filename, text_content):
-        """metadata.txtの更新（新形式対応）"""
-        metadata_path = Path("dataset/metadata.txt")
-        
-        # 新しいエントリを追加
-        with open(metadata_path, 'a', encoding='utf-8') as f:
-            f.write(f"{audio_filename}|{text_content}\n")
+        """metadata.txtの更新（再録音時は同じファイル名のエントリを置き換え）"""
+        with metrics.timed('save_stage_seconds', stage='metadata_append'):
+            self.metadata_store.upsert(audio_filename, text_content)
 
     def cleanup_duplicates(self):
-        """重複したメタデータをクリーンアップ"""
-        metadata_path = Path("dataset/metadata.txt")
-        if not metadata_path.exists():
-            return
-        
-        # 重複を除去した辞書
-        unique_entries = {}
-        
-        with open(metadata_path, 'r', encoding='utf-8') as f:
-            for line in f:
-                if '|' in line:
-                    filename, text = line.strip().split('|', 1)
-                    unique_entries[filename] = text
-        
-        # クリーンアップされたデータを書き戻し
-        with open(metadata_path, 'w', encoding='utf-8') as f:
-            for filename, text in unique_entries.items():
-                f.write(f"{filename}|{text}\n")
-        
-        print(f"📊 {len(unique_entries)} 件のユニークなエントリを保持")
+        """重複したメタデータをクリーンアップ（番号順に並べ替えて書き出し）"""
+        count = self.metadata_store.compact()
+        print(f"📊 {count} 件のユニークなエントリを保持")
 
 if __name__ == "__main__":
-    app = AudioDatasetCreator()
-    app.run()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="AI音声学習用データセット作成ツール")
+    parser.add_argument("--stream", action="store_true", help="録音をディスクへ直接書き込む（長時間録音向け）")
+    parser.add_argument("--no-trim", action="store_true", help="保存時に前後の無音を切り取らない")
+    parser.add_argument("--auto-stop", type=int, metavar="MS", help="発話後に指定ミリ秒の無音が続いたら自動停止")
+    parser.add_argument("--metrics", action="store_true", help="処理時間などを計測して data/metrics/ へ記録")
+    parser.add_argument("--prometheus", action="store_true", help="計測値を Prometheus 形式でも書き出す")
+    parser.add_argument("--classic", action="store_true", help="コマンドを1行ずつ入力する従来の画面を使う")
+    parser.add_argument("--countdown", type=float, default=3, help="録音開始までのカウントダウン（秒, 0で即開始）")
+    parser.add_argument("--station", help="端末名（複数の端末で同じデータセットへ録音する場合に指定）")
+    parser.add_argument("--flac", action="store_true", help="保存したテイクを裏で FLAC に可逆圧縮する")
+    args = parser.parse_args()
+    
+    app = AudioDatasetCreator(stream_to_disk=args.stream, trim_silence=not args.no_trim,
+                              auto_stop_ms=args.auto_stop, enable_metrics=args.metrics or args.prometheus,
+                              prometheus=args.prometheus, station=args.station, flac=args.flac,
+                              countdown=args.countdown)
+    if args.classic or not (sys.stdin.isatty() and sys.stdout.isatty()):
+        app.run()
+    else:
+        from terminal_ui import TerminalFrontend
+        app.start()
+        TerminalFrontend(app, countdown=args.countdown).run()
\ No newline at end of file
@@ -0,0 +1,180 @@
+import os
+import re
+import threading
+from pathlib import Path
+from dataset_lock import FileLock
+
+def natural_key(filename):
+    """audio_2.wav が audio_10.wav より前に来る並び順のキー"""
+    return [int(part) if part.isdigit() else part for part in re.split(r'(\d+)', filename)]
+
+class MetadataStore:
+    """metadata.txt の索引付き管理
+
+    upsert は metadata.txt への追記のみで行い（同じファイル名は後の行が有効）、
+    delete は metadata.tombstones へ記録する。メモリ上に「ファイル名 → 有効な行の
+    オフセット」の索引を持ち、無効な行が一定数を超えたらバックグラウンドで
+    番号順に並べ替えた metadata.txt を書き出して置き換える（コンパクション）。
+    書き込みはロックファイルで排他し、その前に他のプロセスが追記した分を索引へ取り込む。
+    """
+
+    def __init__(self, metadata_path="dataset/metadata.txt", compact_threshold=200, compact_ratio=0.1):
+        self.metadata_path = Path(metadata_path)
+        self.tombstone_path = self.metadata_path.with_suffix('.tombstones')
+        self.compact_threshold = compact_threshold
+        self.compact_ratio = compact_ratio
+        self.entries = {}     # ファイル名 → (オフセット, テキスト)
+        self.dead_lines = 0   # 上書き・削除で無効になった行数
+        self._size = 0
+        self._lock = threading.RLock()
+        # 複数の録音端末（プロセス）が同じ metadata.txt に書き込む場合の排他
+        self.file_lock = FileLock(self.metadata_path.with_suffix('.lock'))
+        self._compact_thread = None
+        self.load()
+
+    def load(self):
+        """metadata.txt と削除ログから索引を作成"""
+        with self._lock:
+            self.entries = {}
+            self.dead_lines = 0
+            self._size = 0
+            self._identity = None
+            self._tombstone_size = 0
+            if self.metadata_path.exists():
+                with open(self.metadata_path, 'rb') as f:
+                    self._identity = os.fstat(f.fileno()).st_ino
+                    self._size = self._index_lines(f, 0)
+            self._read_tombstones()
+
+    def _index_lines(self, f, offset):
+        """offset から末尾までの行を索引に追加（返り値: 読み終えた位置）"""
+        for raw in f:
+            line = raw.decode('utf-8').rstrip('\r\n')
+            if '|' in line:
+                filename, text = line.split('|', 1)
+                if filename in self.entries:
+                    self.dead_lines += 1
+                self.entries[filename] = (offset, text)
+            offset += len(raw)
+        return offset
+
+    def _read_tombstones(self):
+        """削除ログの未読部分を反映"""
+        if not self.tombstone_path.exists():
+            return
+        with open(self.tombstone_path, 'rb') as f:
+            f.seek(self._tombstone_size)
+            for raw in f:
+                self._tombstone_size += len(raw)
+                line = raw.decode('utf-8')
+                if '\t' not in line:
+                    continue
+                filename, deleted_at = line.rstrip('\n').split('\t', 1)
+                entry = self.entries.get(filename)
+                # 削除より前に書かれた行だけを無効にする（削除後の再登録は有効）
+                if entry is not None and entry[0] < int(deleted_at):
+                    del self.entries[filename]
+                    self.dead_lines += 1
+
+    def _catch_up(self):
+        """他のプロセスによる追記・削除・コンパクションを索引へ反映（プロセス間ロック中に呼ぶ）"""
+        try:
+            st = os.stat(self.metadata_path)
+        except FileNotFoundError:
+            st = None
+        if (st.st_ino if st else None) != self._identity or (st is not None and st.st_size < self._size):
+            self.load()   # 置き換えられた（コンパクションされた）ので読み直す
+            return
+        if st is not None and st.st_size > self._size:
+            with open(self.metadata_path, 'rb') as f:
+                f.seek(self._size)
+                self._size = self._index_lines(f, self._size)
+        self._read_tombstones()
+
+    def refresh(self):
+        """他の録音端末が書き込んだ内容を読み込む"""
+        with self.file_lock, self._lock:
+            self._catch_up()
+
+    def get(self, filename):
+        """ファイル名に対応するテキスト"""
+        entry = self.entries.get(filename)
+        return entry[1] if entry is not None else None
+
+    def __len__(self):
+        return len(self.entries)
+
+    def upsert(self, filename, text):
+        """エントリを追加または更新（metadata.txt への1行追記のみ）"""
+        with self.file_lock, self._lock:
+            self._catch_up()
+            existing = self.entries.get(filename)
+            if existing is not None and existing[1] == text:
+                return
+            line = f"{filename}|{text}\n".encode('utf-8')
+            self.metadata_path.parent.mkdir(parents=True, exist_ok=True)
+            with open(self.metadata_path, 'ab') as f:
+                f.write(line)
+            self.entries[filename] = (self._size, text)
+            self._size += len(line)
+            if existing is not None:
+                self.dead_lines += 1
+        self._maybe_compact()
+
+    def delete(self, filename):
+        """エントリを削除（削除ログへの1行追記のみ）"""
+        with self.file_lock, self._lock:
+            self._catch_up()
+            if filename not in self.entries:
+                return
+            with open(self.tombstone_path, 'a', encoding='utf-8') as f:
+                f.write(f"{filename}\t{self._size}\n")
+            del self.entries[filename]
+            self.dead_lines += 1
+        self._maybe_compact()
+
+    def _needs_compaction(self):
+        return self.dead_lines >= max(self.compact_threshold, len(self.entries) * self.compact_ratio)
+
+    def _maybe_compact(self):
+        """無効な行が閾値を超えたらバックグラウンドでコンパクション"""
+        if not self._needs_compaction():
+            return
+        if self._compact_thread is not None and self._compact_thread.is_alive():
+            return
+        self._compact_thread = threading.Thread(target=self.compact, daemon=True)
+        self._compact_thread.start()
+
+    def compact(self):
+        """有効なエントリだけを番号順に書き出し、metadata.txt をアトミックに置き換え"""
+        with self.file_lock, self._lock:
+            self._catch_up()
+            temp_path = self.metadata_path.with_suffix('.tmp')
+            entries = {}
+            offset = 0
+            with open(temp_path, 'wb') as f:
+                for filename in sorted(self.entries, key=natural_key):
+                    text = self.entries[filename][1]
+                    line = f"{filename}|{text}\n".encode('utf-8')
+                    f.write(line)
+                    entries[filename] = (offset, text)
+                    offset += len(line)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(temp_path, self.metadata_path)
+            if self.tombstone_path.exists():
+                self.tombstone_path.unlink()
+
+            self.entries = entries
+            self._size = offset
+            self._identity = os.stat(self.metadata_path).st_ino
+            self._tombstone_size = 0
+            self.dead_lines = 0
+            return len(entries)
+
+    def close(self):
+        """実行中のコンパクションを待ち、無効な行があれば整理して終了"""
+        if self._compact_thread is not None:
+            self._compact_thread.join()
+        if self.dead_lines:
+            self.compact()
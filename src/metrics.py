@@ -0,0 +1,218 @@
+import os
+import json
+import time
+import bisect
+import threading
+import contextlib
+from pathlib import Path
+
+# 処理時間（秒）用のヒストグラム境界
+TIME_BUCKETS = (0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025,
+                0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+PREFIX = "audio_dataset_"
+
+# 計測が無効な間は None。計測箇所は `if metrics.registry is not None` で判定するだけなので、
+# 無効時のコストは属性参照1回のみ
+registry = None
+
+class Histogram:
+    """固定境界のヒストグラム（値の記録は二分探索1回と加算のみ）"""
+
+    def __init__(self, buckets=TIME_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)   # 末尾は +Inf
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        if value > self.max:
+            self.max = value
+
+    def quantile(self, q):
+        """境界から分位点を概算（該当する区間の上端）"""
+        if not self.count:
+            return None
+        target = q * self.count
+        cumulative = 0
+        for i, count in enumerate(self.counts):
+            cumulative += count
+            if cumulative >= target:
+                return self.buckets[i] if i < len(self.buckets) else self.max
+        return self.max
+
+    def to_dict(self):
+        return {
+            'count': self.count,
+            'sum': self.sum,
+            'mean': self.sum / self.count if self.count else None,
+            'p50': self.quantile(0.5),
+            'p99': self.quantile(0.99),
+            'max': self.max,
+            'buckets': dict(zip([str(b) for b in self.buckets] + ['+Inf'], self.counts))
+        }
+
+def _key(name, labels):
+    return (name, tuple(sorted(labels.items())))
+
+def _label_text(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{k}="{v}"' for k, v in pairs) + "}"
+
+class Metrics:
+    """カウンタ・ゲージ・ヒストグラムの集計
+
+    値の更新はロックを取らない（録音コールバックを待たせないため）。
+    複数スレッドから同時に更新された場合のわずかな取りこぼしは許容する。
+    """
+
+    def __init__(self):
+        self.started_at = time.time()
+        self.counters = {}
+        self.gauges = {}
+        self.histograms = {}
+        self._lock = threading.Lock()
+
+    def inc(self, name, value=1, **labels):
+        key = _key(name, labels)
+        self.counters[key] = self.counters.get(key, 0) + value
+
+    def set_gauge(self, name, value, **labels):
+        self.gauges[_key(name, labels)] = value
+
+    def max_gauge(self, name, value, **labels):
+        """ゲージを最大値で更新（キューの最大深さなど）"""
+        key = _key(name, labels)
+        if value > self.gauges.get(key, float('-inf')):
+            self.gauges[key] = value
+
+    def histogram(self, name, **labels):
+        """ヒストグラムを取得（なければ作成）。ホットパスでは事前に取得しておく"""
+        key = _key(name, labels)
+        histogram = self.histograms.get(key)
+        if histogram is None:
+            with self._lock:
+                histogram = self.histograms.setdefault(key, Histogram())
+        return histogram
+
+    def observe(self, name, value, **labels):
+        self.histogram(name, **labels).observe(value)
+
+    @contextlib.contextmanager
+    def timer(self, name, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def snapshot(self):
+        """JSON用の現在値"""
+        def name_of(key):
+            name, labels = key
+            return name + _label_text(labels)
+        return {
+            'timestamp': time.time(),
+            'uptime': time.time() - self.started_at,
+            'counters': {name_of(k): v for k, v in sorted(self.counters.items())},
+            'gauges': {name_of(k): v for k, v in sorted(self.gauges.items())},
+            'histograms': {name_of(k): h.to_dict() for k, h in sorted(self.histograms.items())}
+        }
+
+    def to_prometheus(self):
+        """Prometheus テキスト形式"""
+        lines = []
+        typed = set()
+
+        def declare(name, kind):
+            if name not in typed:
+                typed.add(name)
+                lines.append(f"# TYPE {name} {kind}")
+
+        for (name, labels), value in sorted(self.counters.items()):
+            full = f"{PREFIX}{name}_total"
+            declare(full, 'counter')
+            lines.append(f"{full}{_label_text(labels)} {value}")
+        for (name, labels), value in sorted(self.gauges.items()):
+            full = PREFIX + name
+            declare(full, 'gauge')
+            lines.append(f"{full}{_label_text(labels)} {value}")
+        for (name, labels), histogram in sorted(self.histograms.items()):
+            full = PREFIX + name
+            declare(full, 'histogram')
+            cumulative = 0
+            for bound, count in zip(list(histogram.buckets) + ['+Inf'], histogram.counts):
+                cumulative += count
+                lines.append(f"{full}_bucket{_label_text(labels, [('le', bound)])} {cumulative}")
+            lines.append(f"{full}_sum{_label_text(labels)} {histogram.sum}")
+            lines.append(f"{full}_count{_label_text(labels)} {histogram.count}")
+        return "\n".join(lines) + "\n"
+
+class MetricsWriter:
+    """一定間隔で計測値をローカルファイルへ書き出す
+
+    metrics.jsonl へ1行ずつ追記し、max_bytes を超えたら metrics.jsonl.1 … へ
+    ローテーションする。prometheus=True なら metrics.prom も書き換える。
+    """
+
+    def __init__(self, metrics, directory="data/metrics", interval=10.0,
+                 max_bytes=1024 * 1024, backups=3, prometheus=False):
+        self.metrics = metrics
+        self.directory = Path(directory)
+        self.interval = interval
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self.prometheus = prometheus
+        self.path = self.directory / "metrics.jsonl"
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._loop, daemon=True)
+        self._thread.start()
+
+    def _loop(self):
+        while not self._stop.wait(self.interval):
+            self.write()
+
+    def _rotate(self):
+        for i in range(self.backups - 1, 0, -1):
+            older = self.path.with_name(f"{self.path.name}.{i}")
+            if older.exists():
+                os.replace(older, self.path.with_name(f"{self.path.name}.{i + 1}"))
+        os.replace(self.path, self.path.with_name(f"{self.path.name}.1"))
+
+    def write(self):
+        """現在値を書き出し"""
+        self.directory.mkdir(parents=True, exist_ok=True)
+        if self.path.exists() and self.path.stat().st_size >= self.max_bytes:
+            self._rotate()
+        with open(self.path, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(self.metrics.snapshot(), ensure_ascii=False) + "\n")
+        if self.prometheus:
+            prom_path = self.directory / "metrics.prom"
+            temp_path = prom_path.with_suffix('.tmp')
+            with open(temp_path, 'w', encoding='utf-8') as f:
+                f.write(self.metrics.to_prometheus())
+            os.replace(temp_path, prom_path)
+
+    def close(self):
+        """停止して最終値を書き出し"""
+        self._stop.set()
+        self._thread.join()
+        self.write()
+
+def enable():
+    """計測を有効化（以降に作成・開始された計測箇所から記録される）"""
+    global registry
+    if registry is None:
+        registry = Metrics()
+    return registry
+
+def timed(name, **labels):
+    """計測が有効なら処理時間をヒストグラムに記録するコンテキスト"""
+    if registry is None:
+        return contextlib.nullcontext()
+    return registry.timer(name, **labels)
@@ -0,0 +1,128 @@
+import bisect
+
+BLOCK_SIZE = 64
+
+class RecordedIndex:
+    """録音済みフラグのビットマップと集計値を保持する索引
+
+    flags は1行1バイトの bytearray。未録音行数を BLOCK_SIZE 行ごとのブロック単位で
+    Fenwick 木に持ち、ブロック内は bytearray の find/count（C実装）で処理する。
+    録音状態の更新・区間の未録音数・「次の未録音行」の検索はいずれも O(log n)。
+    """
+
+    def __init__(self, flags=None, file_bounds=()):
+        self.flags = flags if flags is not None else bytearray()
+        self.total = len(self.flags)
+        self.recorded_count = self.flags.count(1)
+
+        # 原稿ファイル別の未録音数（file_bounds: [(ファイル名, 開始番号, 終了番号), ...]）
+        self.file_bounds = list(file_bounds)
+        self._file_starts = [start for _, start, _ in self.file_bounds]
+        self.unrecorded_per_file = {name: self.flags.count(0, start, end)
+                                    for name, start, end in self.file_bounds}
+
+        # ブロック単位のFenwick木を構築
+        self.block_count = (self.total + BLOCK_SIZE - 1) // BLOCK_SIZE
+        tree = [0] * (self.block_count + 1)
+        for block in range(self.block_count):
+            start = block * BLOCK_SIZE
+            tree[block + 1] += self.flags.count(0, start, min(start + BLOCK_SIZE, self.total))
+            parent = (block + 1) + ((block + 1) & -(block + 1))
+            if parent <= self.block_count:
+                tree[parent] += tree[block + 1]
+        self.unrecorded_tree = tree
+
+        # lower_bound 用の最上位ビット
+        self._top_bit = 1
+        while self._top_bit * 2 <= self.block_count:
+            self._top_bit *= 2
+
+    @property
+    def unrecorded_count(self):
+        return self.total - self.recorded_count
+
+    def is_recorded(self, index):
+        return bool(self.flags[index])
+
+    def set(self, index, recorded):
+        """1行の録音状態を更新"""
+        flag = 1 if recorded else 0
+        if self.flags[index] == flag:
+            return
+        self.flags[index] = flag
+        delta = -1 if recorded else 1
+        self.recorded_count -= delta
+
+        file_pos = bisect.bisect_right(self._file_starts, index) - 1
+        if file_pos >= 0:
+            self.unrecorded_per_file[self.file_bounds[file_pos][0]] += delta
+
+        i = index // BLOCK_SIZE + 1
+        while i <= self.block_count:
+            self.unrecorded_tree[i] += delta
+            i += i & -i
+
+    def _block_prefix(self, blocks):
+        """先頭 blocks ブロック分の未録音数"""
+        count = 0
+        i = blocks
+        while i > 0:
+            count += self.unrecorded_tree[i]
+            i -= i & -i
+        return count
+
+    def _prefix(self, end):
+        """先頭から end 行目（含まない）までの未録音数"""
+        block_start = end // BLOCK_SIZE * BLOCK_SIZE
+        return self._block_prefix(end // BLOCK_SIZE) + self.flags.count(0, block_start, end)
+
+    def count_unrecorded(self, start=0, end=None):
+        """[start, end) の未録音数"""
+        if end is None:
+            end = self.total
+        start = min(max(start, 0), self.total)
+        end = min(max(end, start), self.total)
+        return self._prefix(end) - self._prefix(start)
+
+    def _find_nth(self, n):
+        """n番目（1始まり）の未録音行のインデックス"""
+        block = 0
+        step = self._top_bit
+        while step:
+            nxt = block + step
+            if nxt <= self.block_count and self.unrecorded_tree[nxt] < n:
+                block = nxt
+                n -= self.unrecorded_tree[nxt]
+            step //= 2
+
+        position = block * BLOCK_SIZE
+        while True:
+            position = self.flags.find(0, position)
+            n -= 1
+            if n == 0:
+                return position
+            position += 1
+
+    def next_unrecorded(self, start=0, wrap=True):
+        """start 行目以降で最初の未録音行（なければ先頭から探す）"""
+        if self.unrecorded_count == 0:
+            return None
+        position = self.flags.find(0, min(max(start, 0), self.total))
+        if position != -1 and position // BLOCK_SIZE == max(start, 0) // BLOCK_SIZE:
+            return position  # 同じブロック内で見つかった
+        before = self._prefix(min(max(start, 0), self.total))
+        if before < self.unrecorded_count:
+            return self._find_nth(before + 1)
+        return self._find_nth(1) if wrap else None
+
+    def unrecorded_lines(self, limit):
+        """先頭から最大 limit 件の未録音行インデックス"""
+        lines = []
+        position = 0
+        while len(lines) < limit:
+            position = self.flags.find(0, position)
+            if position == -1:
+                break
+            lines.append(position)
+            position += 1
+        return lines
@@ -0,0 +1,153 @@
+import os
+import struct
+import unicodedata
+from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from metadata_store import natural_key
+from audio_io import read_pcm16, scan_audio
+
+FEATURES = ('duration', 'peak_db', 'rms_db', 'clip_ratio', 'lead_silence', 'trail_silence', 'snr_db')
+FRAME_SECONDS = 0.01      # 無音判定・SNR推定のフレーム長
+SILENCE_DB = -40.0        # これ未満のフレームを無音とみなす
+CLIP_LEVEL = 32767 * 0.999
+
+# 外れ値の判定基準
+DEFAULT_THRESHOLDS = {
+    'min_duration': 1.0,       # 秒未満は短すぎる
+    'max_clip_ratio': 0.001,   # クリップしたサンプルの割合
+    'min_rms_db': -45.0,       # ほぼ無音
+    'max_silence': 1.5,        # 先頭・末尾の無音（秒）
+    'min_snr_db': 15.0,        # ノイズが多い
+    'min_cps': 3.0,            # 1秒あたりの文字数（遅すぎる・テキストと不一致）
+    'max_cps': 15.0            # 1秒あたりの文字数（速すぎる・途中で切れている）
+}
+
+def _to_db(value):
+    return 20 * np.log10(np.maximum(value, 1e-10))
+
+def analyze_file(path):
+    """1テイク分の特徴量を計算（WAV・FLAC どちらでも）"""
+    samples, rate = read_pcm16(path)
+    frames = len(samples)
+    if frames == 0:
+        return (0.0, -200.0, -200.0, 0.0, 0.0, 0.0, 0.0)
+
+    mono = np.abs(samples).max(axis=1) if samples.shape[1] > 1 else np.abs(samples[:, 0])
+    peak = float(mono.max())
+    clip_ratio = float(np.count_nonzero(mono >= CLIP_LEVEL)) / frames
+
+    # 10ms フレームごとの RMS（dBFS）
+    frame_len = max(1, int(rate * FRAME_SECONDS))
+    n_frames = frames // frame_len
+    x = samples[:n_frames * frame_len].astype(np.float32) / 32768.0
+    power = (x * x).reshape(n_frames, frame_len * samples.shape[1]).mean(axis=1) if n_frames else np.zeros(1)
+    rms_db = float(_to_db(np.sqrt(power.mean())))
+    frame_db = _to_db(np.sqrt(power))
+
+    voiced = np.flatnonzero(frame_db >= SILENCE_DB)
+    if len(voiced):
+        lead = voiced[0] * FRAME_SECONDS
+        trail = (n_frames - 1 - voiced[-1]) * FRAME_SECONDS
+    else:
+        lead = trail = frames / rate
+
+    # 上位フレームを音声、下位フレームを背景ノイズとみなしてSNRを推定（発話の前後・間に無音がある前提）
+    snr = float(np.percentile(frame_db, 95) - np.percentile(frame_db, 10)) if n_frames else 0.0
+
+    return (frames / rate, float(_to_db(peak / 32768.0)), rms_db, clip_ratio, float(lead), float(trail), snr)
+
+def _analyze_safe(path):
+    """ワーカー用（壊れたファイルは NaN で返す）"""
+    try:
+        return analyze_file(path)
+    except (OSError, ValueError, struct.error):
+        return (np.nan,) * len(FEATURES)
+
+def count_chars(text):
+    """読み上げ文字数（空白・句読点・記号を除く）"""
+    return sum(1 for ch in text if not ch.isspace() and unicodedata.category(ch)[0] not in 'PSZ')
+
+def _scan_audio(audio_dir):
+    """音声ファイル名・更新時刻・サイズを1回の走査で取得（FLAC に圧縮済みのテイクも audio_N.wav の名前で返す）"""
+    names, mtimes, sizes = [], [], []
+    for name, entry in scan_audio(audio_dir).items():
+        st = entry.stat()
+        names.append(name)
+        mtimes.append(st.st_mtime_ns)
+        sizes.append(st.st_size)
+    return np.array(names, dtype=str), np.array(mtimes, dtype=np.int64), np.array(sizes, dtype=np.int64)
+
+def load_cache(cache_path):
+    """列形式の特徴量キャッシュを読み込み"""
+    if not Path(cache_path).exists():
+        return None
+    with np.load(cache_path, allow_pickle=False) as data:
+        return {key: data[key] for key in data.files}
+
+def run_qc(audio_dir="dataset/audio_files", metadata_store=None,
+           cache_path="dataset/qc_cache.npz", workers=None):
+    """全テイクの特徴量を計算（キャッシュ済みで変更のないファイルは再計算しない）"""
+    names, mtimes, sizes = _scan_audio(audio_dir)
+    cache = load_cache(cache_path)
+
+    table = {'name': names, 'mtime': mtimes, 'size': sizes}
+    features = np.full((len(names), len(FEATURES)), np.nan, dtype=np.float64)
+
+    # キャッシュと (ファイル名, 更新時刻, サイズ) が一致する行を再利用
+    stale = np.ones(len(names), dtype=bool)
+    if cache is not None and len(cache['name']):
+        order = np.argsort(cache['name'])
+        pos = np.searchsorted(cache['name'], names, sorter=order)
+        pos = order[np.minimum(pos, len(order) - 1)]
+        hit = ((cache['name'][pos] == names) & (cache['mtime'][pos] == mtimes)
+               & (cache['size'][pos] == sizes))
+        for column, feature in enumerate(FEATURES):
+            features[hit, column] = cache[feature][pos[hit]]
+        stale = ~hit
+
+    todo = np.flatnonzero(stale)
+    if len(todo):
+        paths = [str(Path(audio_dir) / names[i]) for i in todo]
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(_analyze_safe, paths, chunksize=max(1, len(paths) // 64)))
+        features[todo] = np.array(results, dtype=np.float64)
+
+    for column, feature in enumerate(FEATURES):
+        table[feature] = features[:, column]
+
+    Path(cache_path).parent.mkdir(parents=True, exist_ok=True)
+    temp_path = str(cache_path) + ".tmp.npz"
+    np.savez(temp_path, **table)
+    os.replace(temp_path, cache_path)
+
+    # テキストの文字数から話速（1秒あたりの文字数）を計算
+    chars = np.zeros(len(names), dtype=np.float64)
+    if metadata_store is not None:
+        chars = np.array([count_chars(metadata_store.get(name) or '') for name in names], dtype=np.float64)
+    voiced = np.maximum(table['duration'] - table['lead_silence'] - table['trail_silence'], 0.1)
+    table['chars'] = chars
+    table['cps'] = np.where(chars > 0, chars / voiced, np.nan)
+    table['analyzed'] = len(todo)
+    return table
+
+def find_outliers(table, thresholds=None):
+    """判定基準を外れたテイクを [(ファイル名, [理由, ...]), ...] で返す"""
+    t = dict(DEFAULT_THRESHOLDS, **(thresholds or {}))
+    checks = [
+        (np.isnan(table['duration']), "読み込み失敗"),
+        (table['duration'] < t['min_duration'], "短すぎる"),
+        (table['clip_ratio'] > t['max_clip_ratio'], "クリッピング"),
+        (table['rms_db'] < t['min_rms_db'], "ほぼ無音"),
+        (np.maximum(table['lead_silence'], table['trail_silence']) > t['max_silence'], "前後の無音が長い"),
+        (table['snr_db'] < t['min_snr_db'], "ノイズが多い"),
+        (table['cps'] < t['min_cps'], "話速が遅い/テキスト不一致"),
+        (table['cps'] > t['max_cps'], "話速が速い/途中で切れている"),
+    ]
+    reasons = {}
+    for mask, reason in checks:
+        for i in np.flatnonzero(mask):
+            reasons.setdefault(int(i), []).append(reason)
+    order = sorted(reasons, key=lambda i: natural_key(str(table['name'][i])))
+    return [(str(table['name'][i]), reasons[i]) for i in order]
@@ -0,0 +1,487 @@
+# recording_service.py
+# 複数の録音端末（薄いクライアント）から使うローカル録音サービス
+#
+#   python src/recording_service.py                     # 127.0.0.1:8765 で待ち受け
+#   python src/recording_service.py --port 9000 --max-clients 32
+#
+# HTTP（JSON）:
+#   GET  /lines/current?station=A      端末 A の現在行
+#   GET  /lines/next?station=A         端末 A の現在行より後の未録音行（他の端末が録音中の行は除く）
+#   GET  /lines/<行番号>               指定行（1始まり）
+#   POST /navigate                     {"station": "A", "index": 行番号 | "delta": ±n | "next_unrecorded": true}
+#   GET  /progress, GET /stats
+# WebSocket（/ingest?station=A）:
+#   テキスト {"op": "start", "index": 行番号, "sample_rate": 44100, "channels": 1}
+#            （"index" の代わりに "next_unrecorded": true で次の空いている未録音行を確保）
+#   バイナリ 16bit PCM（リトルエンディアン）の断片。受け取るたびにディスクへ追記する
+#   テキスト {"op": "commit"} で保存パイプラインへ投入、{"op": "abort"} で破棄
+import os
+import sys
+import json
+import time
+import signal
+import asyncio
+import threading
+import argparse
+from pathlib import Path
+from urllib.parse import urlsplit, parse_qs
+
+from text_manager import TextManager
+from metadata_store import MetadataStore
+from save_pipeline import SavePipeline
+from wav_stream_writer import WavFileWriter, StreamedTake, PARTIAL_SUFFIX
+from dataset_lock import LineLeases, default_station, try_lock
+from take_store import TakeStore, FlacEncoder
+from audio_io import resolve
+from ws_protocol import (WebSocket, ProtocolError, read_http_head, handshake_response,
+                         OP_BINARY, OP_CLOSE)
+
+MAX_FRAME_BYTES = 256 * 1024   # 1フレームの上限（1接続あたりのメモリ使用量の上限になる）
+MAX_BODY_BYTES = 64 * 1024
+GC_EVERY_TAKES = 200   # この件数のテイクを保存するごとにテイク保管庫の GC を行う
+STATUS_TEXT = {200: "OK", 400: "Bad Request", 404: "Not Found", 409: "Conflict",
+               413: "Payload Too Large", 503: "Service Unavailable"}
+
+class HttpError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+class IngestTake:
+    """WebSocket で受信中の1テイク"""
+
+    def __init__(self, station, index, text_data, writer):
+        self.station = station
+        self.index = index
+        self.text_data = text_data
+        self.writer = writer
+
+class RecordingService:
+    """TextManager と保存パイプラインを複数の録音端末から使えるようにする asyncio サービス
+
+    受信した PCM はテイクごとの一時WAVへそのまま追記し、メモリには溜めない。
+    commit されたテイクは main.py と同じ保存パイプライン（ジャーナル付き）で
+    テイク保管庫・audio_N.wav・meta_N.txt・metadata.txt・セッションへ反映する。
+    録音済みの行の撮り直しは同じ audio_N を使い、以前のテイクは保管庫に残る。
+    行の状態は端末ごとのカーソルと「録音中・保存待ちの行」で管理し、同じ行を
+    2台の端末が同時に録音しないようにする。main.py など別のプロセスの録音端末とは、
+    行の予約（LineLeases）と audio_N の番号の払い出し（TakeIdAllocator）で調整する。
+    """
+
+    def __init__(self, audio_dir="dataset/audio_files", meta_dir="dataset/meta_files",
+                 max_clients=64, journal_path="data/service_save_queue.jsonl", flac=False):
+        self.audio_dir = Path(audio_dir)
+        self.ingest_dir = self.audio_dir / ".ingest"   # 受信中の一時WAV（main.py の復旧処理の対象外）
+        self.meta_dir = Path(meta_dir)
+        self.max_clients = max_clients
+        self.text_manager = TextManager()
+        self.metadata_store = MetadataStore()
+        self.save_pipeline = SavePipeline(self.write_take, self.commit_take, journal_path)
+        self.take_store = TakeStore(audio_dir=self.audio_dir)
+        self.takes_since_gc = 0
+        self.flac_encoder = FlacEncoder(self.take_store) if flac else None
+        self.leases = LineLeases(f"{default_station()}/service")
+        self.instance_lock_path = Path(journal_path).with_suffix('.lock')
+        self._instance_lock = None
+        self.cursors = {}    # 端末 → 行番号
+        self.busy = {}       # 行番号 → IngestTake（受信中）または SaveJob（保存待ち）
+        self.clients = 0
+        self.stats = {'takes': 0, 'aborted': 0, 'bytes': 0, 'rejected': 0}
+        self._take_serial = 0
+        # 行の選択と録音中への登録はスレッドで行うので、端末同士で同じ行を選ばないよう排他する
+        self._claim_lock = threading.Lock()
+
+    # --- 起動・終了 ---
+
+    def start(self):
+        """セッションの復元、ファイルとの同期、前回未完了の保存処理の再開"""
+        # 受信中の一時ファイルとジャーナルを共有するため、同じデータセットでは1つだけ起動できる
+        self.instance_lock_path.parent.mkdir(parents=True, exist_ok=True)
+        self._instance_lock = open(self.instance_lock_path, 'a')
+        if not try_lock(self._instance_lock.fileno()):
+            self._instance_lock.close()
+            raise RuntimeError("同じデータセットで録音サービスが既に起動しています")
+        self.ingest_dir.mkdir(parents=True, exist_ok=True)
+        self.meta_dir.mkdir(parents=True, exist_ok=True)
+        if not self.text_manager.load_session():
+            self.text_manager.load_all_texts()
+        self.text_manager.sync_with_actual_files()
+        self.take_store.gc_in_background(self.text_manager.referenced_takes)
+
+        records = self.save_pipeline.recover()
+        sources = {Path(r['source']).name for r in records if r['source']}
+        for entry in os.scandir(self.ingest_dir):
+            if entry.name not in sources:
+                os.unlink(entry.path)   # commit されないまま中断されたテイク
+
+        for record in records:
+            source = record['source']
+            take_hash = record.get('take_hash')
+            if take_hash and not self.take_store.contains(take_hash):
+                take_hash = None
+            if take_hash:
+                audio = None   # テイクは保管庫に入れ済み
+            elif source and Path(source).exists():
+                audio = StreamedTake(source, 0, 0, 0)
+            elif not resolve(self.audio_dir / record['audio_filename']):
+                print(f"⚠️ 音声データが失われたため保存できません: {record['audio_filename']}")
+                continue
+            else:
+                audio = None   # 音声ファイルは書き込み済み
+            print(f"💾 未完了の保存処理を再開: {record['audio_filename']}")
+            job = self.save_pipeline.submit(audio, record['file_number'], record['audio_filename'],
+                                            record['meta_filename'], record['text_data'],
+                                            record['index'], job_id=record['id'], take_hash=take_hash,
+                                            previous_take=record.get('previous_take'))
+            self.busy[record['index']] = job
+        if self.flac_encoder is not None:
+            self.flac_encoder.sweep(self.text_manager.published_takes())
+
+    def close(self):
+        """保存待ちの処理を書き込んで終了"""
+        failed = self.save_pipeline.close()
+        self.leases.release_all()
+        if self.flac_encoder is not None:
+            self.flac_encoder.close(wait=False)
+        self.take_store.wait_for_gc()
+        self.text_manager.close_session()
+        self.metadata_store.close()
+        if self._instance_lock is not None:
+            self._instance_lock.close()
+        return failed
+
+    # --- 保存パイプラインの各段 ---
+
+    def write_take(self, job):
+        """一時WAVをテイク保管庫へ移して audio_N.wav として公開し、メタファイルを書き込み（ワーカーで実行）"""
+        if job.take_hash is not None:
+            self.take_store.promote(job.take_hash, job.audio_filename)
+        else:
+            versions, _ = self.text_manager.get_takes(job.index)
+            staged = job.audio.path if job.audio is not None else None
+            job.take_hash, job.previous_take = self.take_store.publish(job.audio_filename, staged,
+                                                                       adopt=not versions)
+        if self.flac_encoder is not None:
+            self.flac_encoder.submit(job.take_hash, job.audio_filename)
+            if job.previous_take is not None:
+                self.flac_encoder.submit(job.previous_take)
+        with open(self.meta_dir / job.meta_filename, 'w', encoding='utf-8') as f:
+            f.write(job.text_data['text'])
+
+    def commit_take(self, job):
+        """metadata.txt とセッションに反映（投入順に実行）"""
+        self.metadata_store.upsert(job.audio_filename, job.text_data['text'])
+        self.text_manager.mark_as_recorded(job.audio_filename, job.index)
+        self.text_manager.add_take(job.index, job.take_hash, job.previous_take)
+        self.leases.release(self.line_key(job.text_data))
+        self.takes_since_gc += 1
+        if self.takes_since_gc >= GC_EVERY_TAKES:
+            self.takes_since_gc = 0
+            self.take_store.gc_in_background(self.text_manager.referenced_takes)
+
+    # --- 行の管理 ---
+
+    def line_key(self, text_data):
+        return self.leases.key(text_data['file'], text_data['line_number'])
+
+    def is_busy(self, index, station=None):
+        """他の端末（別のプロセスの録音端末を含む）が録音中・保存待ちの行か"""
+        entry = self.busy.get(index)
+        if entry is not None:
+            done = getattr(entry, 'done', None)
+            if done is not None and done.is_set():
+                del self.busy[index]
+            else:
+                return getattr(entry, 'station', None) != station or station is None
+        file_name, line_number = self.text_manager.corpus.line_info(index)
+        return self.leases.holder(self.leases.key(file_name, line_number)) is not None
+
+    def cursor(self, station):
+        return self.cursors.get(station, self.text_manager.current_line)
+
+    def line(self, index):
+        """行の情報（JSON用）"""
+        text = self.text_manager.get_text(index)
+        if text is None:
+            raise HttpError(404, f"行 {index + 1} はありません")
+        return {'index': index + 1, 'file': text['file'], 'line_number': text['line_number'],
+                'text': text['text'], 'recorded': text['recorded'],
+                'busy': self.is_busy(index), 'total': self.text_manager.total_lines}
+
+    def next_free_line(self, start):
+        """start 以降で未録音かつ録音中でない最初の行（末尾まで行けば先頭から）"""
+        self.text_manager.refresh()   # 他のプロセスの録音端末が録音した行を取り込む
+        index = self.text_manager.recorded_index.next_unrecorded(start)
+        seen = set()
+        while index is not None and self.is_busy(index) and index not in seen:
+            seen.add(index)
+            index = self.text_manager.recorded_index.next_unrecorded(index + 1)
+        return None if index is None or index in seen else index
+
+    # --- HTTP ---
+
+    def route(self, method, path, query, body):
+        """HTTP リクエストの処理（返り値は JSON にする辞書）"""
+        station = query.get('station', [None])[0]
+        parts = [p for p in path.split('/') if p]
+        if method == 'GET' and parts == ['lines', 'current']:
+            return self.line(self.cursor(station))
+        if method == 'GET' and parts == ['lines', 'next']:
+            index = self.next_free_line(self.cursor(station) + 1)
+            if index is None:
+                raise HttpError(404, "未録音の行はありません")
+            return self.line(index)
+        if method == 'GET' and len(parts) == 2 and parts[0] == 'lines' and parts[1].isdigit():
+            return self.line(int(parts[1]) - 1)
+        if method == 'POST' and parts == ['navigate']:
+            station = body.get('station', station)
+            if 'index' in body:
+                index = int(body['index']) - 1
+            elif 'delta' in body:
+                index = self.cursor(station) + int(body['delta'])
+            elif body.get('next_unrecorded'):
+                index = self.next_free_line(self.cursor(station) + 1)
+                if index is None:
+                    raise HttpError(404, "未録音の行はありません")
+            else:
+                raise HttpError(400, "index / delta / next_unrecorded のいずれかを指定してください")
+            line = self.line(index)
+            self.cursors[station] = index
+            return line
+        if method == 'GET' and parts == ['progress']:
+            return self.text_manager.get_progress()
+        if method == 'GET' and parts == ['stats']:
+            return self.snapshot()
+        raise HttpError(404, f"{method} {path} はありません")
+
+    def snapshot(self):
+        """稼働状況"""
+        stats = dict(self.stats, clients=self.clients, pending_saves=self.save_pipeline.pending,
+                     failed_saves=len(self.save_pipeline.failed),
+                     ingesting=sum(isinstance(v, IngestTake) for v in list(self.busy.values())))
+        if self.flac_encoder is not None:
+            stats.update({f"flac_{key}": value for key, value in self.flac_encoder.counts.items()})
+        try:
+            import resource
+            scale = 1 if sys.platform == 'darwin' else 1024   # Linux の ru_maxrss は KB 単位
+            stats['max_rss_bytes'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale
+        except ImportError:
+            pass
+        return stats
+
+    async def respond(self, writer, status, payload):
+        data = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+        writer.write((f"HTTP/1.1 {status} {STATUS_TEXT.get(status, '')}\r\n"
+                      f"Content-Type: application/json; charset=utf-8\r\nContent-Length: {len(data)}\r\n"
+                      f"Connection: close\r\n\r\n").encode('latin-1') + data)
+        await writer.drain()
+
+    async def handle_connection(self, reader, writer):
+        try:
+            request_line, headers = await read_http_head(reader)
+            method, target, _ = request_line.split(' ', 2)
+            url = urlsplit(target)
+            query = parse_qs(url.query)
+
+            if url.path == '/ingest':
+                response = handshake_response(headers)
+                if response is None:
+                    await self.respond(writer, 400, {'error': "WebSocket で接続してください"})
+                elif self.clients >= self.max_clients:
+                    self.stats['rejected'] += 1
+                    await self.respond(writer, 503, {'error': "同時接続数の上限に達しています"})
+                else:
+                    writer.write(response)
+                    await writer.drain()
+                    station = query.get('station', [f"ws{id(writer):x}"])[0]
+                    await self.ingest(WebSocket(reader, writer, max_size=MAX_FRAME_BYTES), station)
+                return
+
+            length = int(headers.get('content-length', 0))
+            if length > MAX_BODY_BYTES:
+                await self.respond(writer, 413, {'error': "リクエストが大きすぎます"})
+                return
+            body = json.loads(await reader.readexactly(length)) if length else {}
+            if not isinstance(body, dict):
+                await self.respond(writer, 400, {'error': "本文は JSON オブジェクトにしてください"})
+                return
+            try:
+                # 行の検索はセッションの取り込み（ファイルロック・読み込み）を伴うのでスレッドで実行
+                await self.respond(writer, 200, await asyncio.to_thread(self.route, method, url.path, query, body))
+            except HttpError as e:
+                await self.respond(writer, e.status, {'error': str(e)})
+            except (ValueError, TypeError, KeyError) as e:
+                await self.respond(writer, 400, {'error': str(e)})
+        except (ProtocolError, ValueError, asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    # --- WebSocket での音声受信 ---
+
+    async def ingest(self, ws, station):
+        """1端末分の受信ループ（1接続で複数テイクを順に送れる）"""
+        self.clients += 1
+        take = None
+        try:
+            while True:
+                try:
+                    opcode, data = await ws.receive()
+                except ProtocolError as e:
+                    await ws.close(e.code, str(e))
+                    break
+                if opcode == OP_CLOSE:
+                    break
+                if opcode == OP_BINARY:
+                    if take is None:
+                        await ws.send_json({'op': 'error', 'error': "start の前に音声が送られました"})
+                        continue
+                    if len(data) % (2 * take.writer.channels):
+                        await ws.send_json({'op': 'error', 'error': "フレームの途中で区切られています"})
+                        continue
+                    take.writer.append(data)
+                    self.stats['bytes'] += len(data)
+                    continue
+
+                try:
+                    message = json.loads(data)
+                    if not isinstance(message, dict):
+                        raise ValueError("メッセージは JSON オブジェクトにしてください")
+                    op = message.get('op')
+                    if op == 'start':
+                        if take is not None:
+                            raise ValueError("前のテイクを commit / abort してください")
+                        take = await asyncio.to_thread(self.start_take, station, message)
+                        await ws.send_json({'op': 'started', **self.line(take.index)})
+                    elif op == 'commit':
+                        if take is None:
+                            raise ValueError("受信中のテイクがありません")
+                        current, take = take, None
+                        await ws.send_json(await self.commit(current))
+                    elif op == 'abort':
+                        if take is not None:
+                            self.discard(take)
+                            take = None
+                        await ws.send_json({'op': 'aborted'})
+                    else:
+                        raise ValueError(f"不明な操作です: {op}")
+                except (ValueError, HttpError) as e:
+                    await ws.send_json({'op': 'error', 'error': str(e)})
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            if take is not None:
+                self.discard(take)
+            self.clients -= 1
+
+    def start_take(self, station, message):
+        """テイクの受信を開始（一時WAVを作成し、行を録音中にする。スレッドから呼ぶ）"""
+        with self._claim_lock:
+            return self._start_take(station, message)
+
+    def _start_take(self, station, message):
+        if message.get('next_unrecorded'):
+            # 行の選択と録音開始を一度に行うので、同時に開始した端末同士で行が重ならない
+            index = self.next_free_line(self.cursor(station))
+            if index is None:
+                raise ValueError("未録音の行はありません")
+        elif 'index' in message:
+            index = int(message['index']) - 1
+        else:
+            index = self.cursor(station)
+        text_data = self.text_manager.get_text(index)
+        if text_data is None:
+            raise ValueError(f"行 {index + 1} はありません")
+        if self.is_busy(index, station):
+            raise ValueError(f"行 {index + 1} は他の端末が録音中です")
+        if not self.leases.acquire(self.line_key(text_data)):
+            raise ValueError(f"行 {index + 1} は {self.leases.holder(self.line_key(text_data))} が録音中です")
+        self._take_serial += 1
+        path = self.ingest_dir / f"{time.time_ns():x}_{self._take_serial}.wav{PARTIAL_SUFFIX}"
+        writer = WavFileWriter(path, int(message.get('sample_rate', 44100)), int(message.get('channels', 1)))
+        take = IngestTake(station, index, text_data, writer)
+        self.busy[index] = take
+        self.cursors[station] = index
+        return take
+
+    def discard(self, take):
+        take.writer.discard()
+        if self.busy.get(take.index) is take:
+            del self.busy[take.index]
+            self.leases.release(self.line_key(take.text_data))
+        self.stats['aborted'] += 1
+
+    async def commit(self, take):
+        """受信したテイクを保存パイプラインへ投入（ファイル確定・ジャーナルの fsync はスレッドで実行）"""
+        writer = take.writer
+        if writer.data_size == 0:
+            self.discard(take)
+            return {'op': 'error', 'error': "音声が送られていません"}
+        await asyncio.to_thread(writer.close)
+        # 録音済みの行の撮り直しは同じ audio_N（以前のテイクは保管庫に残る）
+        number, audio_filename, meta_filename = await asyncio.to_thread(self.text_manager.take_filenames,
+                                                                         take.index)
+        audio = StreamedTake(writer.path, writer.sample_rate, writer.channels, writer.duration)
+        job = await asyncio.to_thread(self.save_pipeline.submit, audio, number, audio_filename,
+                                      meta_filename, take.text_data, take.index)
+        self.busy[take.index] = job
+        self.stats['takes'] += 1
+        return {'op': 'committed', 'index': take.index + 1, 'audio_filename': job.audio_filename,
+                'duration': writer.duration}
+
+    async def serve(self, host="127.0.0.1", port=8765, ready=None):
+        """待ち受けを開始（ready は待ち受け開始時にセットする asyncio.Event）"""
+        server = await asyncio.start_server(self.handle_connection, host, port)
+        self.port = server.sockets[0].getsockname()[1]
+        if ready is not None:
+            ready.set()
+        async with server:
+            await server.serve_forever()
+
+async def serve_until_stopped(service, host, port):
+    """SIGINT / SIGTERM を受けるまで待ち受け"""
+    loop = asyncio.get_running_loop()
+    stop = asyncio.Event()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop.set)
+        except (NotImplementedError, RuntimeError):
+            pass   # Windows では KeyboardInterrupt で終了する
+    server = asyncio.create_task(service.serve(host, port))
+    stopped = asyncio.create_task(stop.wait())
+    done, _ = await asyncio.wait({server, stopped}, return_when=asyncio.FIRST_COMPLETED)
+    server.cancel()
+    stopped.cancel()
+    if server in done:
+        server.result()   # 待ち受けに失敗した場合（ポート使用中など）は例外を送出
+
+def main():
+    parser = argparse.ArgumentParser(description="録音端末向けのローカル録音サービス")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--max-clients", type=int, default=64, help="同時に音声を受信する端末数の上限")
+    parser.add_argument("--flac", action="store_true", help="保存したテイクを裏で FLAC に可逆圧縮する")
+    args = parser.parse_args()
+
+    service = RecordingService(max_clients=args.max_clients, flac=args.flac)
+    try:
+        service.start()
+    except RuntimeError as e:
+        print(f"❌ {e}")
+        return
+    print(f"🎙️ 録音サービス: http://{args.host}:{args.port}  ws://{args.host}:{args.port}/ingest"
+          f"  ({service.text_manager.total_lines} 行)")
+    try:
+        asyncio.run(serve_until_stopped(service, args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+    except OSError as e:
+        print(f"❌ 待ち受けを開始できません: {e}")
+    finally:
+        failed = service.close()
+        if failed:
+            print(f"⚠️ {len(failed)} 件の保存に失敗しました（次回起動時に再試行します）")
+        print("👋 録音サービスを終了しました")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,196 @@
+import os
+import json
+import time
+import queue
+import threading
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+
+class SaveJob:
+    """保存待ちの録音テイク1件分"""
+
+    def __init__(self, job_id, audio, file_number, audio_filename, meta_filename, text_data, index,
+                 take_hash=None, previous_take=None):
+        self.job_id = job_id
+        self.audio = audio
+        self.file_number = file_number
+        self.audio_filename = audio_filename
+        self.meta_filename = meta_filename
+        self.text_data = text_data
+        self.index = index
+        # テイク保管庫に入れたテイクのハッシュと、撮り直し前に取り込んだテイクのハッシュ
+        # （書き込み段で設定し、ジャーナルにも記録する）
+        self.take_hash = take_hash
+        self.previous_take = previous_take
+        self.error = None
+        self.submitted_at = time.perf_counter()
+        self.written = threading.Event()  # 音声・メタファイル書き込み完了
+        self.done = threading.Event()     # metadata.txt・セッション反映まで完了
+
+    def to_record(self):
+        """ジャーナル用の辞書に変換（音声データ本体は含めない）"""
+        source = getattr(self.audio, 'path', None)
+        return {
+            'id': self.job_id,
+            'file_number': self.file_number,
+            'audio_filename': self.audio_filename,
+            'meta_filename': self.meta_filename,
+            'text_data': self.text_data,
+            'index': self.index,
+            'take_hash': self.take_hash,
+            'previous_take': self.previous_take,
+            'source': str(source) if source is not None else None
+        }
+
+class SavePipeline:
+    """録音テイクの保存処理をバックグラウンドで実行するパイプライン
+
+    write_stage（音声・メタファイル書き込み）はスレッドプールで並列に、
+    commit_stage（metadata.txt追記・セッション更新）は投入順に1件ずつ実行する。
+    同じファイル番号のジョブは前のジョブの完了を待ってから書き込む。
+    """
+
+    def __init__(self, write_stage, commit_stage, journal_path="data/save_queue.jsonl", max_workers=None):
+        self.write_stage = write_stage
+        self.commit_stage = commit_stage
+        self.journal_path = Path(journal_path)
+        self.failed = []
+        self.pending = 0
+
+        self._next_id = 1
+        self._last_by_number = {}
+        self._lock = threading.Lock()
+        self._journal_lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers or min(4, os.cpu_count() or 1),
+                                            thread_name_prefix="save")
+        self._commit_queue = queue.Queue()
+        self._commit_thread = threading.Thread(target=self._commit_loop, daemon=True)
+        self._commit_thread.start()
+
+    def submit(self, audio, file_number, audio_filename, meta_filename, text_data, index, job_id=None,
+               take_hash=None, previous_take=None):
+        """テイクを保存キューに追加してすぐに戻る（job_id・take_hash などは復旧時の再投入用）"""
+        with self._lock:
+            if job_id is None:
+                job_id = self._next_id
+                self._next_id += 1
+            job = SaveJob(job_id, audio, file_number, audio_filename,
+                          meta_filename, text_data, index, take_hash, previous_take)
+            previous = self._last_by_number.get(file_number)
+            self._last_by_number[file_number] = job
+            self.pending += 1
+
+        self._journal(dict(job.to_record(), op='submit'), sync=True)
+        self._executor.submit(self._run_write, job, previous)
+        self._commit_queue.put(job)
+        return job
+
+    def pending_job(self, index):
+        """指定行の保存待ちのジョブ（なければ None）"""
+        with self._lock:
+            for job in self._last_by_number.values():
+                if job.index == index:
+                    return job
+        return None
+
+    def _run_write(self, job, previous):
+        """音声・メタファイルの書き込み（スレッドプール上で実行）"""
+        if previous is not None:
+            previous.done.wait()
+        try:
+            self.write_stage(job)
+            if job.take_hash is not None:
+                # 再実行時は保管庫に入れたテイクを公開し直すだけで済むよう記録
+                self._journal({'op': 'written', 'id': job.job_id, 'take_hash': job.take_hash,
+                               'previous_take': job.previous_take})
+        except Exception as e:
+            job.error = e
+        finally:
+            job.written.set()
+
+    def _commit_loop(self):
+        """投入順にmetadata.txtとセッションへ反映"""
+        while True:
+            job = self._commit_queue.get()
+            if job is None:
+                self._commit_queue.task_done()
+                break
+
+            job.written.wait()
+            if job.error is None:
+                try:
+                    self.commit_stage(job)
+                except Exception as e:
+                    job.error = e
+
+            if job.error is None:
+                self._journal({'op': 'done', 'id': job.job_id})
+            else:
+                # ジャーナルには未完了として残り、次回起動時に再実行される
+                self.failed.append(job)
+            job.audio = None
+
+            with self._lock:
+                self.pending -= 1
+                if self._last_by_number.get(job.file_number) is job:
+                    del self._last_by_number[job.file_number]
+            job.done.set()
+            self._commit_queue.task_done()
+
+    def _journal(self, record, sync=False):
+        """ジャーナルファイルに1行追記"""
+        with self._journal_lock:
+            self.journal_path.parent.mkdir(parents=True, exist_ok=True)
+            with open(self.journal_path, 'a', encoding='utf-8') as f:
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+                if sync:
+                    f.flush()
+                    os.fsync(f.fileno())
+
+    def flush(self):
+        """キュー内の全ジョブの完了を待つ"""
+        self._commit_queue.join()
+        with self._journal_lock:
+            if not self.failed and self.journal_path.exists():
+                # 全て完了していればジャーナルは不要
+                self.journal_path.unlink()
+        return list(self.failed)
+
+    def close(self):
+        """全ジョブを完了させてワーカーを停止"""
+        failed = self.flush()
+        self._commit_queue.put(None)
+        self._commit_thread.join()
+        self._executor.shutdown(wait=True)
+        return failed
+
+    def recover(self):
+        """前回終了時に未完了だったジョブをジャーナルから取り出す"""
+        if not self.journal_path.exists():
+            return []
+
+        unfinished = {}
+        with open(self.journal_path, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    continue  # 書き込み途中で中断された行
+                if record.get('op') == 'submit':
+                    unfinished[record['id']] = record
+                elif record.get('op') == 'written' and record['id'] in unfinished:
+                    unfinished[record['id']].update(take_hash=record['take_hash'],
+                                                    previous_take=record.get('previous_take'))
+                elif record.get('op') == 'done':
+                    unfinished.pop(record['id'], None)
+
+        # 未完了分だけを残してジャーナルを詰め直す（再投入時は同じIDを使う）
+        temp_path = self.journal_path.with_suffix('.tmp')
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            for record in unfinished.values():
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+        os.replace(temp_path, self.journal_path)
+
+        if unfinished:
+            self._next_id = max(unfinished) + 1
+        return list(unfinished.values())
@@ -0,0 +1,228 @@
+import os
+import json
+import struct
+import threading
+from pathlib import Path
+from dataset_lock import FileLock
+
+BINARY_MAGIC = b'SSNB'
+BINARY_VERSION = 1
+BINARY_HEADER = struct.Struct('<4sIIQQ')  # magic, version, ヘッダ長, フラグ長, ファイル名一覧の長さ
+
+class SessionStore:
+    """スナップショット + 差分ジャーナル方式のセッション保存
+
+    session.json（スナップショット）に対して、カーソル移動や録音済みマークなどの
+    小さな差分を session.journal へ追記していく。差分が一定数たまったら
+    スナップショットを書き直してジャーナルを空にする（コンパクション）。
+    スナップショットの内容の解釈は TextManager が行う。
+
+    起動を速くするため、スナップショットと同じ内容を session.bin（録音済みフラグの
+    バイト列と音声ファイル名の一覧）にも書き出す。session.bin は書き出し時点の
+    session.json のサイズ・更新時刻を記録しており、一致する場合のみ使われる。
+
+    複数の録音端末（プロセス）が同じセッションを共有する場合に備え、ジャーナルへの
+    追記とスナップショットの書き出しは session.lock で排他する。他のプロセスが追記した
+    差分は load_journal に読み終えた位置を渡して取り込む。
+    """
+
+    def __init__(self, session_file="data/session.json", compact_every=5000):
+        self.session_file = Path(session_file)
+        self.journal_file = self.session_file.with_suffix('.journal')
+        self.binary_file = self.session_file.with_suffix('.bin')
+        self.compact_every = compact_every
+        self.journal_entries = 0
+        self._lock = threading.Lock()
+        self.file_lock = FileLock(self.session_file.with_suffix('.lock'))
+        self.journal_position = (None, 0)   # 読み終えたジャーナルの (inode, バイト位置)
+        self._journal = None
+
+    def exists(self):
+        """保存済みのセッションがあるか"""
+        return self.session_file.exists()
+
+    def load(self):
+        """スナップショットとジャーナルの差分一覧を返す（差分の適用は呼び出し側で行う）"""
+        if not self.session_file.exists():
+            return None
+
+        with open(self.session_file, 'r', encoding='utf-8') as f:
+            snapshot = json.load(f)
+        return snapshot, self.load_journal()
+
+    def load_journal(self, position=None):
+        """ジャーナルの差分一覧を読み込み
+
+        position に前回の journal_position を渡すと、その続き（他のプロセスが追記した分）
+        だけを返す。ジャーナルが作り直されていれば先頭から読む。
+        """
+        entries = []
+        try:
+            f = open(self.journal_file, 'rb')
+        except FileNotFoundError:
+            self.journal_position = (None, 0)
+            if position is None:
+                self.journal_entries = 0
+            return entries
+        with f:
+            inode = os.fstat(f.fileno()).st_ino
+            offset = 0
+            if position is not None and position[0] == inode:
+                offset = position[1]
+                f.seek(offset)
+            else:
+                self.journal_entries = 0
+            for raw in f:
+                if not raw.endswith(b"\n"):
+                    break  # 書き込み途中の末尾行（次回はここから読む）
+                offset += len(raw)
+                try:
+                    entries.append(json.loads(raw))
+                except json.JSONDecodeError:
+                    continue  # 異常終了で途切れた行（後続の差分は読み続ける）
+        self.journal_position = (inode, offset)
+        self.journal_entries += len(entries)
+        return entries
+
+    def snapshot_stat(self):
+        """session.json のサイズと更新時刻（他のプロセスによる書き換えの検出用）"""
+        try:
+            return self._snapshot_stat()
+        except FileNotFoundError:
+            return None
+
+    def _snapshot_stat(self):
+        st = os.stat(self.session_file)
+        return [st.st_size, st.st_mtime_ns]
+
+    def write_binary(self, header, flags, names):
+        """バイナリスナップショットを書き出し（write_snapshot の直後に呼ぶ）"""
+        with self.file_lock, self._lock:
+            header_bytes = json.dumps(dict(header, snapshot=self._snapshot_stat()),
+                                      ensure_ascii=False).encode('utf-8')
+            names_bytes = '\n'.join(names).encode('utf-8')
+            temp_file = self.binary_file.with_suffix('.bin.tmp')
+            with open(temp_file, 'wb') as f:
+                f.write(BINARY_HEADER.pack(BINARY_MAGIC, BINARY_VERSION, len(header_bytes),
+                                           len(flags), len(names_bytes)))
+                f.write(header_bytes)
+                f.write(flags)
+                f.write(names_bytes)
+            os.replace(temp_file, self.binary_file)
+
+    def load_binary(self):
+        """バイナリスナップショットを読み込み（session.json と対応しなければ None）
+
+        返り値: (ヘッダ, 録音済みフラグの bytearray, 音声ファイル名の一覧)
+        """
+        try:
+            with open(self.binary_file, 'rb') as f:
+                magic, version, header_len, flags_len, names_len = BINARY_HEADER.unpack(
+                    f.read(BINARY_HEADER.size))
+                if magic != BINARY_MAGIC or version != BINARY_VERSION:
+                    return None
+                header = json.loads(f.read(header_len).decode('utf-8'))
+                if header.get('snapshot') != self._snapshot_stat():
+                    return None
+                flags = bytearray(f.read(flags_len))
+                names_bytes = f.read(names_len)
+        except (OSError, struct.error, ValueError):
+            return None
+        if len(flags) != flags_len or len(names_bytes) != names_len:
+            return None
+        names = names_bytes.decode('utf-8').split('\n') if names_len else []
+        return header, flags, names
+
+    def _truncate_torn_tail(self):
+        """異常終了で途切れた末尾行を切り詰める（次の追記が途切れた行に連結されないように）"""
+        try:
+            f = open(self.journal_file, 'rb+')
+        except FileNotFoundError:
+            return
+        with f:
+            end = f.seek(0, os.SEEK_END)
+            position = end
+            while position > 0:
+                start = max(0, position - 4096)
+                f.seek(start)
+                newline = f.read(position - start).rfind(b"\n")
+                if newline != -1:
+                    position = start + newline + 1
+                    break
+                position = start
+            if position != end:
+                f.truncate(position)
+
+    def append(self, entry, durable=False):
+        """差分を1件追記（返り値: コンパクションが必要か）
+
+        durable=True ならディスクへの書き込み完了（fsync）まで待つ。録音状態・テイク履歴など
+        失うとテイクが宙に浮く差分に使い、カーソル移動のような差分は flush のみにする。
+        """
+        with self.file_lock, self._lock:
+            # 他のプロセスがスナップショットを書き出してジャーナルを削除していれば開き直す
+            if self._journal is not None and not self._is_current_journal():
+                self._journal.close()
+                self._journal = None
+            if self._journal is None:
+                self.session_file.parent.mkdir(parents=True, exist_ok=True)
+                self._truncate_torn_tail()
+                self._journal = open(self.journal_file, 'a', encoding='utf-8')
+            self._journal.write(json.dumps(entry, ensure_ascii=False) + "\n")
+            self._journal.flush()
+            if durable:
+                os.fsync(self._journal.fileno())
+            self.journal_entries += 1
+            return self.journal_entries >= self.compact_every
+
+    def _is_current_journal(self):
+        try:
+            return os.stat(self.journal_file).st_ino == os.fstat(self._journal.fileno()).st_ino
+        except FileNotFoundError:
+            return False
+
+    def set_cursor(self, index, station=None):
+        """現在行の移動を記録（端末名があれば端末ごとの現在行として記録）"""
+        entry = {'op': 'cursor', 'index': index}
+        if station is not None:
+            entry['station'] = station
+        return self.append(entry)
+
+    def set_recorded(self, file_name, line_number, audio_file, recorded=True):
+        """行の録音状態を記録（通し番号ではなく原稿ファイル名と行番号で記録）"""
+        return self.append({'op': 'recorded', 'file': file_name, 'line_number': line_number,
+                            'recorded': recorded, 'audio_file': audio_file}, durable=True)
+
+    def set_takes(self, file_name, line_number, versions, active):
+        """行のテイク履歴（保管庫のハッシュ、古い順）と有効なテイクを記録"""
+        return self.append({'op': 'takes', 'file': file_name, 'line_number': line_number,
+                            'versions': versions, 'active': active}, durable=True)
+
+    def write_snapshot(self, snapshot):
+        """全体をスナップショットとして書き出し、ジャーナルを空にする
+
+        他のプロセスの差分を失わないよう、呼び出し側で file_lock を取って差分を
+        取り込んでから呼ぶ。
+        """
+        with self.file_lock, self._lock:
+            self.session_file.parent.mkdir(parents=True, exist_ok=True)
+            temp_file = self.session_file.with_suffix('.tmp')
+            with open(temp_file, 'w', encoding='utf-8') as f:
+                json.dump(snapshot, f, ensure_ascii=False, separators=(',', ':'))
+            os.replace(temp_file, self.session_file)
+
+            # スナップショット確定後にジャーナルを破棄（差分は冪等なので途中で落ちても安全）
+            if self._journal is not None:
+                self._journal.close()
+                self._journal = None
+            if self.journal_file.exists():
+                self.journal_file.unlink()
+            self.journal_entries = 0
+            self.journal_position = (None, 0)
+
+    def close(self):
+        """ジャーナルを閉じる"""
+        with self._lock:
+            if self._journal is not None:
+                self._journal.close()
+                self._journal = None
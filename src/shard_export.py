@@ -0,0 +1,270 @@
+import os
+import json
+import zlib
+from pathlib import Path
+
+import numpy as np
+from metadata_store import natural_key
+from audio_io import read_pcm16, resolve
+
+MANIFEST_NAME = "manifest.json"
+INDEX_NAME = "index.jsonl"
+COMPACT_RATIO = 0.25   # 録り直し・削除で参照されなくなったデータがシャード全体のこの割合を超えたら詰め直す
+
+class ShardWriter:
+    """録音テイクを大きなシャードファイルへまとめて書き出す
+
+    シャードは int16 サンプルを連結しただけの生データ（shard_NNNNN.pcm）で、
+    各テイクの位置は index.jsonl に (シャード, 開始フレーム, フレーム数, CRC32, テキスト)
+    として追記する。同じテイクが再録音された場合は新しいデータを追記し、
+    index.jsonl の後の行が有効になる。metadata.txt から削除されたテイクは
+    削除の行（removed）を追記する。参照されなくなったデータは compact で回収する。
+    """
+
+    def __init__(self, shard_dir="dataset/shards", shard_size_mb=1024):
+        self.shard_dir = Path(shard_dir)
+        self.shard_bytes = shard_size_mb * 1024 * 1024
+        self.manifest_path = self.shard_dir / MANIFEST_NAME
+        self.index_path = self.shard_dir / INDEX_NAME
+        self.shard_dir.mkdir(parents=True, exist_ok=True)
+
+        self.manifest = {'sample_rate': None, 'channels': None, 'shards': []}
+        if self.manifest_path.exists():
+            with open(self.manifest_path, 'r', encoding='utf-8') as f:
+                self.manifest = json.load(f)
+        self.entries = load_index(self.index_path)
+
+    def _new_shard_name(self):
+        """まだ使っていないシャード名（コンパクション後も番号を使い回さない）"""
+        number = self.manifest.get('next_shard', len(self.manifest['shards']))
+        self.manifest['next_shard'] = number + 1
+        return f"shard_{number:05d}.pcm"
+
+    def _current_shard(self, frame_bytes):
+        """追記先のシャード（容量を超える場合は新しいシャードを作成）"""
+        shards = self.manifest['shards']
+        if not shards or shards[-1]['bytes'] + frame_bytes > self.shard_bytes:
+            shards.append({'name': self._new_shard_name(), 'bytes': 0})
+        return shards[-1]
+
+    def add(self, name, source_path, text):
+        """1テイクを追加（変更がなければ何もしない）。返り値: 追加したか
+
+        source_path は WAV・FLAC のどちらでもよい（シャードには復号した PCM を書く）。
+        """
+        st = os.stat(source_path)
+        previous = self.entries.get(name)
+        if previous and previous['mtime'] == st.st_mtime_ns and previous['size'] == st.st_size:
+            if previous['text'] != text:
+                self._append_index(dict(previous, text=text))
+            return False
+
+        samples, rate = read_pcm16(source_path)
+        channels = samples.shape[1]
+        if self.manifest['sample_rate'] is None:
+            self.manifest['sample_rate'] = rate
+            self.manifest['channels'] = channels
+        elif (rate, channels) != (self.manifest['sample_rate'], self.manifest['channels']):
+            raise ValueError(f"{name}: サンプルレート/チャンネル数がシャードと異なります ({rate} Hz, {channels} ch)")
+
+        data = np.ascontiguousarray(samples, dtype='<i2').tobytes()
+        crc = zlib.crc32(data)
+        if previous and previous['crc32'] == crc and previous['frames'] == len(samples):
+            # 内容は同じでファイルだけ変わった（FLAC への圧縮など）。シャードへは書き直さない
+            self._append_index(dict(previous, text=text, mtime=st.st_mtime_ns, size=st.st_size))
+            return False
+        shard = self._current_shard(len(data))
+        with open(self.shard_dir / shard['name'], 'ab') as f:
+            # 中断でマニフェストが古いままでも、実際のファイル末尾を開始位置にする
+            byte_offset = f.tell()
+            f.write(data)
+        frame_offset = byte_offset // (2 * channels)
+        shard['bytes'] = byte_offset + len(data)
+
+        self._append_index({
+            'name': name,
+            'shard': shard['name'],
+            'offset': frame_offset,
+            'frames': len(samples),
+            'crc32': crc,
+            'text': text,
+            'mtime': st.st_mtime_ns,
+            'size': st.st_size
+        })
+        return True
+
+    def remove(self, name):
+        """テイクを索引から外す（シャード上のデータは compact で回収する）"""
+        if self.entries.pop(name, None) is None:
+            return False
+        with open(self.index_path, 'a', encoding='utf-8') as f:
+            f.write(json.dumps({'name': name, 'removed': True}, ensure_ascii=False) + "\n")
+        return True
+
+    def _append_index(self, entry):
+        self.entries[entry['name']] = entry
+        with open(self.index_path, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+
+    def dead_ratio(self):
+        """シャード全体のうち、どのテイクからも参照されていないデータの割合"""
+        total = sum(shard['bytes'] for shard in self.manifest['shards'])
+        if total == 0:
+            return 0.0
+        live = sum(entry['frames'] for entry in self.entries.values()) * 2 * (self.manifest['channels'] or 1)
+        return max(0.0, 1 - live / total)
+
+    def compact(self):
+        """有効なテイクだけを新しいシャードへ番号順に詰め直し、古いシャードを削除
+
+        新しいシャード・index.jsonl・manifest.json を書き終えてから置き換えるので、
+        中断しても古いシャードと索引はそのまま読める。返り値: 回収したバイト数
+        """
+        old_shards = self.manifest['shards']
+        frame_bytes = 2 * (self.manifest['channels'] or 1)
+        before = sum(shard['bytes'] for shard in old_shards)
+        self.manifest['shards'] = []
+        entries = {}
+        sources = {}
+        out = None
+        try:
+            for name in sorted(self.entries, key=natural_key):
+                entry = self.entries[name]
+                size = entry['frames'] * frame_bytes
+                shard = self._current_shard(size)
+                if out is None or out.name != str(self.shard_dir / shard['name']):
+                    if out is not None:
+                        out.flush()
+                        os.fsync(out.fileno())
+                        out.close()
+                    out = open(self.shard_dir / shard['name'], 'wb')
+                if entry['shard'] not in sources:
+                    sources[entry['shard']] = open(self.shard_dir / entry['shard'], 'rb')
+                source = sources[entry['shard']]
+                source.seek(entry['offset'] * frame_bytes)
+                out.write(source.read(size))
+                entries[name] = dict(entry, shard=shard['name'], offset=shard['bytes'] // frame_bytes)
+                shard['bytes'] += size
+            if out is not None:
+                out.flush()
+                os.fsync(out.fileno())
+        finally:
+            if out is not None:
+                out.close()
+            for source in sources.values():
+                source.close()
+
+        temp_path = self.index_path.with_suffix('.tmp')
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            for name in sorted(entries, key=natural_key):
+                f.write(json.dumps(entries[name], ensure_ascii=False) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        self.close()   # 新しいシャード一覧のマニフェスト
+        os.replace(temp_path, self.index_path)
+        self.entries = entries
+        for shard in old_shards:
+            path = self.shard_dir / shard['name']
+            if path.exists():
+                path.unlink()
+        return before - sum(shard['bytes'] for shard in self.manifest['shards'])
+
+    def close(self):
+        """シャードをディスクへ確定させてからマニフェストを保存"""
+        for shard in self.manifest['shards']:
+            path = self.shard_dir / shard['name']
+            if path.exists():
+                with open(path, 'rb+') as f:
+                    os.fsync(f.fileno())
+        temp_path = self.manifest_path.with_suffix('.tmp')
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.manifest, f, ensure_ascii=False, indent=2)
+        os.replace(temp_path, self.manifest_path)
+
+def load_index(index_path):
+    """index.jsonl を読み込み（同じテイクは後の行が有効）"""
+    entries = {}
+    if Path(index_path).exists():
+        with open(index_path, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    continue  # 中断時の書きかけの行
+                if entry.get('removed'):
+                    entries.pop(entry['name'], None)
+                else:
+                    entries[entry['name']] = entry
+    return entries
+
+def export_dataset(audio_dir="dataset/audio_files", metadata_store=None,
+                   shard_dir="dataset/shards", shard_size_mb=1024, compact_ratio=COMPACT_RATIO):
+    """metadata.txt に載っている全テイクをシャードへ書き出し（差分のみ追記）
+
+    metadata.txt から削除されたテイクは索引から外し、参照されなくなったデータが
+    シャード全体の compact_ratio を超えたらシャードを詰め直す（None なら詰め直さない）。
+    """
+    writer = ShardWriter(shard_dir, shard_size_mb)
+    added = skipped = removed = reclaimed = 0
+    errors = []
+    try:
+        for name in sorted(metadata_store.entries, key=natural_key):
+            source = resolve(Path(audio_dir) / name)
+            if source is None:
+                continue
+            try:
+                if writer.add(name, source, metadata_store.get(name)):
+                    added += 1
+                else:
+                    skipped += 1
+            except ValueError as e:
+                errors.append(str(e))
+        for name in [name for name in writer.entries if metadata_store.get(name) is None]:
+            removed += writer.remove(name)
+        if compact_ratio is not None and writer.manifest['shards'] and writer.dead_ratio() > compact_ratio:
+            reclaimed = writer.compact()
+    finally:
+        writer.close()
+    return {'added': added, 'skipped': skipped, 'removed': removed, 'reclaimed': reclaimed, 'errors': errors}
+
+class ShardReader:
+    """シャードからテイクを読み出す（データはメモリマップのスライスで返す）"""
+
+    def __init__(self, shard_dir="dataset/shards"):
+        self.shard_dir = Path(shard_dir)
+        with open(self.shard_dir / MANIFEST_NAME, 'r', encoding='utf-8') as f:
+            self.manifest = json.load(f)
+        self.sample_rate = self.manifest['sample_rate']
+        self.channels = self.manifest['channels']
+
+        entries = load_index(self.shard_dir / INDEX_NAME)
+        self.names = sorted(entries, key=natural_key)
+        self._entries = [entries[name] for name in self.names]
+        self._positions = {name: i for i, name in enumerate(self.names)}
+        self._maps = {}
+
+    def __len__(self):
+        return len(self.names)
+
+    def _shard(self, shard_name):
+        """シャードをメモリマップで開く（初回のみ）"""
+        if shard_name not in self._maps:
+            data = np.memmap(self.shard_dir / shard_name, dtype='<i2', mode='r')
+            self._maps[shard_name] = data.reshape(-1, self.channels)
+        return self._maps[shard_name]
+
+    def _entry(self, key):
+        return self._entries[self._positions[key] if isinstance(key, str) else key]
+
+    def __getitem__(self, key):
+        """テイクのサンプル（(フレーム数, チャンネル数) の int16、コピーなし）"""
+        entry = self._entry(key)
+        return self._shard(entry['shard'])[entry['offset']:entry['offset'] + entry['frames']]
+
+    def text(self, key):
+        return self._entry(key)['text']
+
+    def verify(self):
+        """全テイクのCRC32を検証し、一致しないテイク名の一覧を返す"""
+        return [entry['name'] for i, entry in enumerate(self._entries)
+                if zlib.crc32(np.ascontiguousarray(self[i]).tobytes()) != entry['crc32']]
@@ -0,0 +1,389 @@
+import os
+import time
+import shutil
+import threading
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor, wait as wait_futures
+
+import metrics
+from audio_io import WAV_SUFFIX, FLAC_SUFFIX, AUDIO_SUFFIXES, encode_flac, pcm_hash
+from dataset_lock import FileLock
+
+try:
+    import fcntl
+except ImportError:   # Windows
+    fcntl = None
+
+MAX_VERSIONS = 5          # 1行あたりに残すテイク数（有効なテイクは必ず残す）
+GC_GRACE_SECONDS = 3600   # 作成直後のテイクは削除しない（他の端末がセッションへ反映する前の分）
+FLAC_WORKERS = 2          # FLAC 圧縮のワーカー数
+FLAC_NICE = 10            # 圧縮スレッドの優先度の下げ幅（録音・保存の処理を先に動かす）
+FICLONE = 0x40049409      # Linux の ioctl（btrfs・XFS などでデータを共有したコピー）
+
+# テイクの内容ハッシュ（WAV でも FLAC でも同じ音声なら同じ値）
+take_hash = pcm_hash
+
+def link_or_clone(source, target):
+    """source と同じ内容の target を作る（ハードリンク → reflink → コピーの順に試す）
+
+    返り値: 'link' / 'reflink' / 'copy'
+    """
+    try:
+        os.link(source, target)
+        return 'link'
+    except OSError:
+        pass
+    if fcntl is not None:
+        try:
+            with open(source, 'rb') as src, open(target, 'wb') as dst:
+                fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+            return 'reflink'
+        except OSError:
+            Path(target).unlink(missing_ok=True)
+    shutil.copyfile(source, target)
+    return 'copy'
+
+class TakeStore:
+    """内容ハッシュで管理するテイクの保管庫
+
+    録音したテイクはすべて dataset/takes/objects/<先頭2文字>/<ハッシュ>.wav に保存し、
+    有効なテイクを dataset/audio_files/audio_N.wav としてハードリンク（使えなければ
+    reflink・コピー）で公開する。撮り直しは新しいテイクを追加して公開し直すだけで、
+    以前のテイクは保管庫に残るため、いつでも元に戻せる。同じ内容のテイクは1つに
+    まとめられる。
+
+    compress で FLAC に圧縮したテイクは <ハッシュ>.flac になり、audio_N.flac として
+    公開される（ハッシュは PCM の内容なので WAV のときと変わらない）。
+
+    どの行がどのテイクを持つかはセッション（TextManager.takes）に記録する。
+    どこからも参照されなくなったテイクは gc で削除する。
+    """
+
+    def __init__(self, root="dataset/takes", audio_dir="dataset/audio_files"):
+        self.root = Path(root)
+        self.objects_dir = self.root / "objects"
+        self.staging_dir = self.root / "staging"
+        self.audio_dir = Path(audio_dir)
+        self._gc_thread = None
+        # 重複テイクの再利用と GC の削除が行き違わないようにする
+        self._lock = threading.Lock()
+        # audio_N の公開（撮り直し・元に戻す）と FLAC への切り替えを端末間で排他する
+        self.publish_lock = FileLock(self.root / "publish.lock")
+
+    def object_path(self, digest, suffix=WAV_SUFFIX):
+        return self.objects_dir / digest[:2] / f"{digest}{suffix}"
+
+    def find(self, digest):
+        """保管中のテイクのパス（FLAC を優先）。なければ None"""
+        for suffix in (FLAC_SUFFIX, WAV_SUFFIX):
+            path = self.object_path(digest, suffix)
+            if path.exists():
+                return path
+        return None
+
+    def contains(self, digest):
+        return self.find(digest) is not None
+
+    def staging_path(self, name):
+        """保管庫へ入れる前のテイクを書き出す場所（同じファイルシステム上なので移動が一瞬で済む）"""
+        self.staging_dir.mkdir(parents=True, exist_ok=True)
+        return self.staging_dir / name
+
+    def add(self, path, move=False):
+        """ファイル（WAV または FLAC）を保管庫に追加してハッシュを返す
+
+        move=True なら元のファイルを移動（同じ内容がすでにあれば元のファイルを削除）、
+        False ならハードリンク（できなければコピー）で取り込む。
+        """
+        digest = take_hash(path)
+        with self._lock:
+            existing = self.find(digest)
+            if existing is not None:
+                try:
+                    # 同じ内容のテイクがある（GC で消されないよう更新時刻を新しくする）
+                    os.utime(existing)
+                except FileNotFoundError:
+                    pass
+                else:
+                    if move:
+                        Path(path).unlink()
+                    return digest
+        target = self.object_path(digest, FLAC_SUFFIX if str(path).endswith(FLAC_SUFFIX) else WAV_SUFFIX)
+        target.parent.mkdir(parents=True, exist_ok=True)
+        if move:
+            os.replace(path, target)
+        else:
+            temp_path = target.with_name(target.name + ".tmp")
+            temp_path.unlink(missing_ok=True)
+            link_or_clone(path, temp_path)
+            os.replace(temp_path, target)
+        return digest
+
+    def adopt(self, audio_filename):
+        """公開中の音声ファイルを保管庫に取り込む（旧バージョンで録音したテイクの撮り直し前など）
+
+        返り値: ハッシュ（ファイルがなければ None）
+        """
+        for suffix in AUDIO_SUFFIXES:
+            try:
+                return self.add((self.audio_dir / audio_filename).with_suffix(suffix))
+            except FileNotFoundError:
+                continue
+        return None
+
+    def _link_published(self, source, audio_filename):
+        """source を audio_N.wav / audio_N.flac（source と同じ形式）として置き換え、もう一方の形式を削除"""
+        target = (self.audio_dir / audio_filename).with_suffix(source.suffix)
+        try:
+            if os.path.samefile(source, target):
+                return 'link'   # 公開済み（同じ inode 同士の rename は何もしないため一時ファイルが残る）
+        except FileNotFoundError:
+            pass
+        temp_path = target.with_name(f".{target.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+        temp_path.unlink(missing_ok=True)
+        method = link_or_clone(source, temp_path)
+        os.replace(temp_path, target)
+        other = FLAC_SUFFIX if source.suffix == WAV_SUFFIX else WAV_SUFFIX
+        target.with_suffix(other).unlink(missing_ok=True)
+        return method
+
+    def promote(self, digest, audio_filename):
+        """テイクを audio_N として公開（置き換えはアトミック。FLAC 圧縮済みなら audio_N.flac）"""
+        with self.publish_lock:
+            for _ in range(2):
+                source = self.find(digest)
+                if source is None:
+                    raise FileNotFoundError(self.object_path(digest))
+                try:
+                    return self._link_published(source, audio_filename)
+                except FileNotFoundError:
+                    continue   # 直前に FLAC へ圧縮されて WAV が削除された
+            raise FileNotFoundError(self.object_path(digest))
+
+    def publish(self, audio_filename, staged=None, adopt=False):
+        """書き出したテイクを保管庫へ移して audio_filename として公開
+
+        adopt=True なら、置き換える前の audio_filename を以前のテイクとして取り込む
+        （テイクの履歴がない行の撮り直し）。staged が None の場合は、公開済みの
+        audio_filename をそのまま取り込む（旧バージョンの保存処理の復旧）。
+        返り値: (公開したテイクのハッシュ, 取り込んだ以前のテイクのハッシュ または None)
+        """
+        previous = self.adopt(audio_filename) if adopt else None
+        if staged is None:
+            digest = previous or self.adopt(audio_filename)
+            if digest is None:
+                raise FileNotFoundError(self.audio_dir / audio_filename)
+            return digest, None
+        digest = self.add(staged, move=True)
+        self.promote(digest, audio_filename)
+        return digest, (previous if previous != digest else None)
+
+    def compress(self, digest, audio_filename=None):
+        """保管中の WAV テイクを FLAC に圧縮（復号して一致を確認済み）し、WAV を削除
+
+        audio_filename の公開中のテイクがこのテイクなら audio_N.flac に切り替える
+        （圧縮済みのテイクでも、audio_N.wav のまま公開されていれば切り替える）。
+        返り値: (元のサイズ, 圧縮後のサイズ)。圧縮済み・削除済みなら None。
+        """
+        wav_path = self.object_path(digest)
+        flac_path = self.object_path(digest, FLAC_SUFFIX)
+        sizes = None
+        if not flac_path.exists():
+            try:
+                sizes = encode_flac(wav_path, flac_path)
+            except FileNotFoundError:
+                if not flac_path.exists():
+                    return None   # 圧縮中に GC で削除された
+        with self.publish_lock:
+            if audio_filename is not None and self._is_published(wav_path, digest, audio_filename):
+                self._link_published(flac_path, audio_filename)
+            with self._lock:
+                wav_path.unlink(missing_ok=True)
+        return sizes
+
+    def _is_published(self, wav_path, digest, audio_filename):
+        """audio_N.wav がこのテイクか（ハードリンクでなければ内容で判定）"""
+        published = self.audio_dir / audio_filename
+        try:
+            if os.path.samefile(wav_path, published):
+                return True
+        except FileNotFoundError:
+            if not published.exists():
+                return False
+        try:
+            return take_hash(published) == digest
+        except FileNotFoundError:
+            return False
+
+    def wav_takes(self):
+        """まだ FLAC に圧縮していないテイクのハッシュ"""
+        return [digest for digest, suffix in self._objects() if suffix == WAV_SUFFIX
+                and not self.object_path(digest, FLAC_SUFFIX).exists()]
+
+    def _objects(self):
+        """保管中のファイルを (ハッシュ, 拡張子) で列挙"""
+        if not self.objects_dir.exists():
+            return
+        for bucket in os.scandir(self.objects_dir):
+            if not bucket.is_dir():
+                continue
+            for entry in os.scandir(bucket.path):
+                stem, suffix = os.path.splitext(entry.name)
+                if suffix in AUDIO_SUFFIXES and not entry.name.startswith('.'):
+                    yield stem, suffix
+
+    def size(self, digest):
+        path = self.find(digest)
+        try:
+            return path.stat().st_size if path is not None else None
+        except FileNotFoundError:
+            return None
+
+    def gc(self, referenced, grace_seconds=GC_GRACE_SECONDS):
+        """参照されていないテイクを削除
+
+        作成（または重複として再追加）から grace_seconds 以内のテイクと、audio_N
+        として公開中（リンク数が2以上）のテイクは残す。FLAC に圧縮済みのテイクの
+        WAV が残っていれば（圧縮の途中で終了した場合など）、公開中でなければ削除する。
+        返り値: {'removed': 件数, 'freed_bytes': バイト数, 'kept': 件数}
+        """
+        result = {'removed': 0, 'freed_bytes': 0, 'kept': 0}
+        deadline = time.time() - grace_seconds
+        if self.staging_dir.exists():
+            # 保管庫へ入れる前に中断されたテイク
+            for entry in os.scandir(self.staging_dir):
+                st = entry.stat()
+                if st.st_mtime < deadline:
+                    os.unlink(entry.path)
+                    result['removed'] += 1
+                    result['freed_bytes'] += st.st_size
+        for digest, suffix in list(self._objects()):
+            path = self.object_path(digest, suffix)
+            with self._lock:
+                try:
+                    st = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                redundant = suffix == WAV_SUFFIX and self.object_path(digest, FLAC_SUFFIX).exists()
+                if st.st_nlink > 1 or (not redundant and (digest in referenced or st.st_mtime > deadline)):
+                    result['kept'] += 1
+                    continue
+                os.unlink(path)
+            result['removed'] += 1
+            result['freed_bytes'] += st.st_size
+        return result
+
+    def gc_in_background(self, referenced_fn, on_done=None):
+        """GC を別スレッドで実行（実行中なら何もしない）。referenced_fn は参照中のハッシュ集合を返す"""
+        if self._gc_thread is not None and self._gc_thread.is_alive():
+            return False
+        def run():
+            result = self.gc(referenced_fn())
+            if on_done is not None:
+                on_done(result)
+        self._gc_thread = threading.Thread(target=run, daemon=True)
+        self._gc_thread.start()
+        return True
+
+    def wait_for_gc(self):
+        if self._gc_thread is not None:
+            self._gc_thread.join()
+            self._gc_thread = None
+
+    def stats(self):
+        """保管中のテイク数（うち FLAC の数）と合計サイズ"""
+        digests, flac, size = set(), 0, 0
+        for digest, suffix in self._objects():
+            digests.add(digest)
+            flac += suffix == FLAC_SUFFIX
+            try:
+                size += self.object_path(digest, suffix).stat().st_size
+            except FileNotFoundError:
+                pass
+        return {'takes': len(digests), 'flac': flac, 'bytes': size}
+
+def _lower_priority():
+    """ワーカースレッドの優先度を下げる（スレッド単位で設定できる Linux のみ有効）"""
+    try:
+        os.setpriority(os.PRIO_PROCESS, threading.get_native_id(), FLAC_NICE)
+    except (AttributeError, OSError):
+        pass
+
+class FlacEncoder:
+    """保存済みのテイクを裏で FLAC に圧縮するワーカープール
+
+    保存は従来どおり WAV で行い（録音画面を待たせない）、公開後にテイクを渡すと
+    別スレッドで圧縮・検証して audio_N.flac に切り替える。失敗したテイクは WAV の
+    まま残す。同じテイクを重ねて渡しても1回だけ圧縮する。
+    """
+
+    def __init__(self, store, workers=FLAC_WORKERS):
+        self.store = store
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="flac",
+                                           initializer=_lower_priority)
+        self.counts = {'encoded': 0, 'failed': 0, 'bytes_before': 0, 'bytes_after': 0}
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._closed = False
+
+    def submit(self, digest, audio_filename=None):
+        """テイクの圧縮を予約（予約済み・終了処理中なら False）"""
+        key = (digest, audio_filename)
+        with self._lock:
+            if self._closed or key in self._pending:
+                return False
+            self._pending[key] = self.executor.submit(self._run, digest, audio_filename)
+        if metrics.registry is not None:
+            metrics.registry.max_gauge('flac_queue_max', len(self._pending))
+        return True
+
+    def _run(self, digest, audio_filename):
+        try:
+            with metrics.timed('flac_encode_seconds'):
+                sizes = self.store.compress(digest, audio_filename)
+        except Exception as e:
+            with self._lock:
+                self.counts['failed'] += 1
+                self._pending.pop((digest, audio_filename), None)
+            if metrics.registry is not None:
+                metrics.registry.inc('flac_encode_failures')
+            print(f"⚠️ FLAC への圧縮に失敗しました（WAV のまま残します）: {digest[:12]} {e}")
+            return
+        with self._lock:
+            self._pending.pop((digest, audio_filename), None)
+            if sizes is not None:
+                self.counts['encoded'] += 1
+                self.counts['bytes_before'] += sizes[0]
+                self.counts['bytes_after'] += sizes[1]
+        if sizes is not None:
+            if metrics.registry is not None:
+                metrics.registry.inc('flac_encoded')
+                metrics.registry.inc('flac_saved_bytes', sizes[0] - sizes[1])
+
+    def sweep(self, published):
+        """まだ WAV のテイクをすべて圧縮予約（published: {audio_N.wav: 公開中のテイクのハッシュ}）
+
+        返り値: 予約した件数
+        """
+        count = 0
+        submitted = set()
+        for audio_filename, digest in published.items():
+            if (self.store.audio_dir / audio_filename).exists():
+                count += self.submit(digest, audio_filename)
+                submitted.add(digest)
+        for digest in self.store.wav_takes():
+            if digest not in submitted:
+                count += self.submit(digest)
+        return count
+
+    def wait(self):
+        """予約済みの圧縮がすべて終わるまで待つ"""
+        with self._lock:
+            futures = list(self._pending.values())
+        wait_futures(futures)
+
+    def close(self, wait=True):
+        """終了処理。wait=False なら未着手の圧縮は取り消す（次回起動時の sweep で再開）"""
+        with self._lock:
+            self._closed = True
+        self.executor.shutdown(wait=True, cancel_futures=not wait)
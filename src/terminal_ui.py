@@ -0,0 +1,387 @@
+import os
+import sys
+import time
+import unicodedata
+import contextlib
+
+# 1キー操作の一覧（画面下部に表示）
+KEY_HELP = [
+    "r:録音開始/撮り直し/再開  p:一時停止  s:停止・保存  l:再生",
+    "n/→:次へ  b/←:前へ  u:次の未録音行  j:行番号へジャンプ  v:テイク履歴",
+    ":コマンド入力 (rf, sync, st, qc, cv, metrics, cleanup)  q:終了",
+]
+ARROW_KEYS = {'\x1b[C': 'n', '\x1b[D': 'b', '\x1b[A': 'b', '\x1b[B': 'n'}
+SCRIPT_ROWS = 3
+ACTIVE_INTERVAL = 0.1   # 録音中・カウントダウン中の再描画間隔（秒）
+IDLE_INTERVAL = 0.5     # 待機中（保存キュー・同期の状態のみ更新）
+
+def char_width(ch):
+    """端末上の表示幅（全角・絵文字は2）"""
+    if unicodedata.combining(ch) or ch in '\u200d\ufe0f':
+        return 0
+    return 2 if unicodedata.east_asian_width(ch) in 'WF' else 1
+
+def fit(text, width):
+    """表示幅 width に収まるよう末尾を切り詰め"""
+    used = 0
+    for i, ch in enumerate(text):
+        used += char_width(ch)
+        if used > width:
+            return text[:i]
+    return text
+
+def wrap(text, width, rows):
+    """表示幅で折り返して rows 行に収める（溢れた分は末尾を … にする）"""
+    lines = []
+    current = []
+    used = 0
+    for ch in text:
+        w = char_width(ch)
+        if used + w > width:
+            lines.append(''.join(current))
+            current, used = [], 0
+        current.append(ch)
+        used += w
+    lines.append(''.join(current))
+    if len(lines) > rows:
+        lines = lines[:rows]
+        lines[-1] = fit(lines[-1], width - 1) + "…"
+    return lines + [""] * (rows - len(lines))
+
+class Screen:
+    """前回の描画内容と比較し、変わった行だけを ANSI エスケープで書き換える画面"""
+
+    def __init__(self, out=None):
+        self.out = out or sys.stdout
+        self.rows = []
+        self.size = None
+        self.bytes_written = 0
+
+    def terminal_size(self):
+        try:
+            size = os.get_terminal_size(self.out.fileno())
+        except (AttributeError, ValueError, OSError):
+            size = None
+        if not size or not size.columns or not size.lines:
+            return os.terminal_size((80, 24))   # サイズを返さない端末（シリアル接続など）
+        return size
+
+    def enter(self):
+        """代替画面に切り替えてカーソルを隠す"""
+        if os.name == 'nt':
+            os.system('')   # Windows のコンソールで ANSI エスケープを有効化（起動時の1回のみ）
+        self._write("\x1b[?1049h\x1b[?25l\x1b[2J")
+        self.rows = []
+
+    def exit(self):
+        """元の画面とカーソルを戻す"""
+        self._write("\x1b[?25h\x1b[?1049l")
+        self.rows = []
+
+    def _write(self, data):
+        self.out.write(data)
+        self.out.flush()
+        self.bytes_written += len(data.encode('utf-8'))
+
+    def render(self, lines):
+        """lines を描画（端末サイズが変わった場合のみ全体を描き直す）"""
+        size = self.terminal_size()
+        parts = []
+        if size != self.size:
+            self.size = size
+            self.rows = []
+            parts.append("\x1b[2J")
+        lines = [fit(line, size.columns - 1) for line in lines[:size.lines]]
+        for row, line in enumerate(lines):
+            if row >= len(self.rows) or self.rows[row] != line:
+                parts.append(f"\x1b[{row + 1};1H{line}\x1b[K")
+        for row in range(len(lines), len(self.rows)):
+            parts.append(f"\x1b[{row + 1};1H\x1b[K")
+        self.rows = lines
+        if parts:
+            self._write(''.join(parts))
+        return len(parts)
+
+class KeyReader:
+    """端末を1文字入力モードにし、Enter なしでキーを読む（Ctrl+C は通常どおり中断）"""
+
+    def __init__(self, stream=None):
+        self.stream = stream or sys.stdin
+        self._saved = None
+        self._pending = ""
+
+    def __enter__(self):
+        if os.name != 'nt':
+            import termios
+            import tty
+            fd = self.stream.fileno()
+            self._saved = termios.tcgetattr(fd)
+            tty.setcbreak(fd)
+        return self
+
+    def __exit__(self, *exc):
+        if self._saved is not None:
+            import termios
+            termios.tcsetattr(self.stream.fileno(), termios.TCSADRAIN, self._saved)
+            self._saved = None
+
+    def read_key(self, timeout=None):
+        """1キー分の文字列（矢印キーは n/b に変換）。timeout 秒以内に入力がなければ None"""
+        if not self._pending:
+            data = self._read_posix(timeout) if os.name != 'nt' else self._read_windows(timeout)
+            if not data:
+                return None
+            self._pending = data
+        for sequence, key in ARROW_KEYS.items():
+            if self._pending.startswith(sequence):
+                self._pending = self._pending[len(sequence):]
+                return key
+        if self._pending.startswith('\x1b['):
+            self._pending = ""   # 未対応のエスケープシーケンスは捨てる
+            return None
+        key, self._pending = self._pending[0], self._pending[1:]
+        return key
+
+    def _read_posix(self, timeout):
+        import select
+        fd = self.stream.fileno()
+        ready, _, _ = select.select([fd], [], [], timeout)
+        if not ready:
+            return None
+        return os.read(fd, 64).decode('utf-8', errors='ignore')
+
+    def _read_windows(self, timeout):
+        import msvcrt
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while not msvcrt.kbhit():
+            if deadline is not None and time.monotonic() >= deadline:
+                return None
+            time.sleep(0.01)
+        ch = msvcrt.getwch()
+        if ch in ('\x00', '\xe0'):
+            return {'M': '\x1b[C', 'K': '\x1b[D', 'H': '\x1b[A', 'P': '\x1b[B'}.get(msvcrt.getwch(), '')
+        return ch
+
+    @contextlib.contextmanager
+    def suspended(self):
+        """一時的に通常の行入力モードへ戻す"""
+        self.__exit__()
+        try:
+            yield
+        finally:
+            self.__enter__()
+
+class TerminalFrontend:
+    """AudioDatasetCreator の1キー操作の画面
+
+    キー入力は待たずに読み、録音中もレベルメーターを更新し続ける。画面は行ごとに
+    前回と比較して変わった行だけを書き換える（録音中に変わるのはメーターの行のみ）。
+    rf・sync などの一覧を表示するコマンドは、通常の画面に戻して従来どおり実行する。
+    """
+
+    def __init__(self, app, countdown=3, screen=None, keys=None):
+        self.app = app
+        self.countdown = countdown
+        self.screen = screen or Screen()
+        self.keys = keys or KeyReader()
+        self.message = ""
+        self.prompt = ""
+        self.countdown_until = None
+
+    # --- 描画 ---
+
+    def _state_line(self, recorder):
+        if self.countdown_until is not None:
+            remaining = max(0.0, self.countdown_until - time.monotonic())
+            return f"🔴 録音開始まで {remaining:.1f} 秒..."
+        if recorder is None or not recorder.is_recording:
+            return "⏹️ 停止中 (r で録音開始)"
+        if recorder.is_paused:
+            return "⏸️ 一時停止中 (r で再開 / s で保存)"
+        meter = recorder.level_meter
+        if meter.auto_stopped:
+            return "⏹️ 無音が続いたため自動停止しました (s で保存 / r で撮り直し)"
+        return f"🎚️ {meter.meter_line()}"
+
+    def frame(self):
+        """画面全体の行リスト"""
+        app = self.app
+        manager = app.text_manager
+        width = self.screen.terminal_size().columns - 1
+        current = manager.get_current_text()
+        progress = manager.get_progress()
+
+        lines = ["🎙️  AI音声学習用データセット作成ツール", "=" * min(width, 60)]
+        if current:
+            status = "✅ 録音済み" if current['recorded'] else "⭕ 未録音"
+            versions, _ = manager.get_takes(manager.current_line)
+            if len(versions) > 1:
+                status += f"  🗂️ テイク {len(versions)} 件"
+            lines.append(f"📄 {current['file']}  📝 {progress['current']}/{progress['total']}  {status}")
+            lines += ["   " + line for line in wrap(current['text'], width - 3, SCRIPT_ROWS)]
+        else:
+            lines += ["📄 原稿がありません (data/input に .txt を配置して :rf)"] + [""] * SCRIPT_ROWS
+
+        filled = int(progress['progress_percent'] / 100 * 30)
+        lines.append(f"📊 [{'█' * filled}{'░' * (30 - filled)}] {progress['recorded']}/{progress['total']}"
+                     f" ({progress['progress_percent']:.1f}%)")
+        lines.append(self._state_line(app._audio_recorder))
+
+        status = []
+        if app.sync_thread is not None and app.sync_thread.is_alive():
+            status.append("🔄 同期中")
+        if app.save_pipeline.pending:
+            status.append(f"💾 保存処理中: {app.save_pipeline.pending} 件")
+        elif app.last_saved:
+            status.append(f"💾 最終保存: {app.last_saved}")
+        if app.save_pipeline.failed:
+            job = app.save_pipeline.failed[-1]
+            status.append(f"❌ 保存失敗 {len(app.save_pipeline.failed)} 件: {job.audio_filename} ({job.error})")
+        lines.append("  ".join(status))
+        lines.append(self.message)
+        lines.append("=" * min(width, 60))
+        lines += KEY_HELP
+        lines.append(self.prompt)
+        return lines
+
+    def refresh(self):
+        self.screen.render(self.frame())
+
+    # --- 入力 ---
+
+    def read_line(self, label, accept=str.isprintable):
+        """画面最下行で文字列を入力（Enter で確定、Esc で取り消し）"""
+        text = ""
+        while True:
+            self.prompt = f"{label}{text}▏"
+            self.refresh()
+            key = self.keys.read_key(ACTIVE_INTERVAL)
+            if key is None:
+                continue
+            if key in ('\r', '\n'):
+                self.prompt = ""
+                return text
+            if key == '\x1b':
+                self.prompt = ""
+                return None
+            if key in ('\x7f', '\b'):
+                text = text[:-1]
+            elif accept(key):
+                text += key
+
+    def run_classic(self, command):
+        """一覧表示などのコマンドを通常の画面で実行"""
+        self.screen.exit()
+        try:
+            with self.keys.suspended():
+                return self.app.handle_command(command)
+        finally:
+            self.screen.enter()
+
+    # --- 操作 ---
+
+    def start_recording(self):
+        recorder = self.app.audio_recorder
+        self.countdown_until = None
+        holder = self.app.claim_current_line()   # カウントダウン中に移動した場合に備えて取り直す
+        if holder is not None:
+            self.message = f"⚠️ この行は {holder} が録音中です"
+        elif recorder.start_recording():
+            self.message = "🎙️ 録音開始！"
+        else:
+            self.message = "❌ 録音開始に失敗しました"
+
+    def tick(self):
+        """カウントダウンの経過を確認"""
+        if self.countdown_until is not None and time.monotonic() >= self.countdown_until:
+            self.start_recording()
+
+    def handle_key(self, key):
+        """1キー分の操作（終了なら False）"""
+        app = self.app
+        manager = app.text_manager
+        if key == 'r':
+            recorder = app.audio_recorder
+            if recorder.is_recording and recorder.is_paused:
+                recorder.resume_recording()
+                self.message = "▶️ 録音再開"
+                return True
+            recorder.reset_recording()
+            holder = app.claim_current_line()
+            if holder is not None:
+                self.message = f"⚠️ この行は {holder} が録音中です"
+            elif self.countdown:
+                self.countdown_until = time.monotonic() + self.countdown
+                self.message = ""
+            else:
+                self.start_recording()
+        elif key == 'p':
+            if app.is_recording:
+                app.audio_recorder.pause_recording()
+                self.message = "⏸️ 録音一時停止"
+        elif key == 's':
+            self.countdown_until = None
+            audio_filename = app.save_take()
+            if audio_filename is False:
+                self.message = "❌ この行は他の端末が録音中のため保存できません"
+            elif audio_filename:
+                self.message = f"💾 保存キューに追加: {audio_filename}"
+        elif key == 'l':
+            if app.current_audio is not None:
+                self.message = "🔊 録音音声を再生中..."
+                self.refresh()
+                app.audio_recorder.play_audio(app.current_audio)
+                self.message = ""
+            else:
+                self.message = "❌ 再生する音声がありません"
+        elif key == 'n':
+            app.go_to_line(manager.current_line + 1)
+            self.message = ""
+        elif key == 'b':
+            app.go_to_line(manager.current_line - 1)
+            self.message = ""
+        elif key == 'u':
+            next_line = app.next_unrecorded_line()
+            if next_line is not None:
+                app.go_to_line(next_line)
+                self.message = ""
+            else:
+                self.message = "🎉 全ての行が録音済みです"
+        elif key == 'v':
+            self.run_classic('v')
+            self.message = ""
+        elif key == 'j':
+            text = self.read_line("ジャンプする行番号: ", str.isdigit)
+            if text:
+                self.message = "" if app.go_to_line(int(text) - 1) else "❌ 無効な行番号です"
+        elif key == ':':
+            command = (self.read_line(":") or "").strip().lower()
+            if len(command) == 1:
+                return self.handle_key(command)
+            if command:
+                return self.run_classic(command)
+        elif key == 'q':
+            return False
+        return True
+
+    def run(self):
+        """メインループ（Ctrl+C などで抜けても、画面を戻してから保存待ちの書き込み・予約の解放を行う）"""
+        try:
+            with self.keys:
+                self.screen.enter()
+                try:
+                    while True:
+                        active = self.countdown_until is not None or self.app.is_recording
+                        key = self.keys.read_key(ACTIVE_INTERVAL if active else IDLE_INTERVAL)
+                        if key is not None:
+                            try:
+                                if not self.handle_key(key):
+                                    break
+                            except Exception as e:
+                                self.message = f"❌ {type(e).__name__}: {e}"
+                        self.tick()
+                        self.refresh()
+                finally:
+                    self.screen.exit()
+        finally:
+            self.app.shutdown()
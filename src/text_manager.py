@@ -1,72 +1,390 @@
-import os
-import json
+import threading
 from pathlib import Path
+from session_store import SessionStore
+from file_index import DatasetFileIndex
+from progress_index import RecordedIndex
+from corpus import Corpus
+from dataset_lock import TakeIdAllocator, AUDIO_NAME_RE
+from take_store import MAX_VERSIONS
+from metadata_store import natural_key
+import metrics
+
+SESSION_VERSION = 2
 
 class TextManager:
-    def __init__(self, input_dir="data/input"):
+    def __init__(self, input_dir="data/input", station=None):
         self.input_dir = Path(input_dir)
         self.current_file = None
         self.current_line = 0
+        # 複数の録音端末でセッションを共有する場合、現在行は端末ごとに記録する
+        self.station = station
+        self.cursors = {}   # 他の端末の現在行
         self.total_lines = 0
-        self.all_texts = []
+        # 行のテキストは Corpus から必要時に読み出し、行ごとの状態は
+        # 録音済みビットマップと「行番号 → 音声ファイル名」の疎な辞書で持つ
+        self.corpus = Corpus(self.input_dir)
+        self.recorded_index = RecordedIndex()
+        self.audio_files = {}
+        self.takes = {}   # 行番号 → (テイク履歴のハッシュ一覧（古い順）, 有効なテイクのハッシュ)
         self.session_file = "data/session.json"
-        
+        self.session_store = SessionStore(self.session_file)
+        self._snapshot_seen = None  # 最後に読み書きした session.json（他のプロセスによる書き換えの検出用）
+        self.take_ids = TakeIdAllocator()
+        self.file_index = DatasetFileIndex()
+        self._marked_during_sync = None  # 同期の走査中に録音済みになったファイル
+        # 保存パイプラインのスレッドからも更新されるため排他制御する
+        self.lock = threading.RLock()
+    
     def load_all_texts(self):
-        """全てのテキストファイルを読み込み"""
-        text_files = list(self.input_dir.glob("*.txt"))
-        self.all_texts = []
-        
-        for file_path in text_files:
-            with open(file_path, 'r', encoding='utf-8') as f:
-                lines = [line.strip() for line in f.readlines() if line.strip()]
-                for i, line in enumerate(lines):
-                    self.all_texts.append({
-                        'file': file_path.name,
-                        'line_number': i + 1,
-                        'text': line,
-                        'recorded': False,
-                        'audio_file': None
-                    })
+        """全てのテキストファイルを読み込み（行位置の索引のみ作成し、本文は必要時に読む）"""
+        with self.lock, metrics.timed('corpus_load_seconds'):
+            self.corpus.load()
+            self.total_lines = len(self.corpus)
+            self.audio_files = {}
+            self.takes = {}
+            self.recorded_index = RecordedIndex(bytearray(self.total_lines), self.corpus.file_bounds())
+        return self.corpus
+    
+    def reload_texts(self):
+        """変更された原稿ファイルだけを再読み込みし、録音状態を内容の一致で引き継ぐ"""
+        with self.lock, self.session_store.file_lock:
+            self.refresh()
+            # 再読み込み前の録音状態と現在行を (ファイル名, ファイル内の行位置) で控えておく
+            recorded = [(self.corpus.line_info(i), audio_file) for i, audio_file in self.audio_files.items()]
+            takes = [(self.corpus.line_info(i), entry) for i, entry in self.takes.items()]
+            current = self.corpus.line_info(self.current_line) if self.total_lines else None
+            
+            changes = self.corpus.reload()
+            
+            def remap(file_name, line_number):
+                if file_name in changes['changed']:
+                    mapping, _ = changes['changed'][file_name]
+                    local_index = mapping.get(line_number - 1)
+                    if local_index is None:
+                        return None
+                    line_number = local_index + 1
+                return self.corpus.index_of(file_name, line_number)
+            
+            self.total_lines = len(self.corpus)
+            self.audio_files = {}
+            self.recorded_index = RecordedIndex(bytearray(self.total_lines), self.corpus.file_bounds())
+            dropped = []
+            for (file_name, line_number), audio_file in recorded:
+                index = remap(file_name, line_number)
+                if index is None:
+                    dropped.append(audio_file)
+                else:
+                    self._set_recorded(index, audio_file)
+            self.takes = {}
+            for line, entry in takes:
+                index = remap(*line)
+                if index is not None:
+                    self.takes[index] = entry
+            
+            new_current = remap(*current) if current else None
+            if new_current is None:
+                # 現在行が削除された場合は元の位置付近（範囲外なら最後の行）へ
+                new_current = min(self.current_line, max(0, self.total_lines - 1))
+            self.current_line = new_current
+            self.save_session()
         
-        self.total_lines = len(self.all_texts)
-        return self.all_texts
+        return {
+            'files': {name: stats for name, (_, stats) in changes['changed'].items()},
+            'removed_files': changes['removed'],
+            'dropped_recordings': sorted(dropped)
+        }
     
-    def save_session(self):
-        """セッション状態を保存"""
-        session_data = {
+    def get_text(self, index):
+        """指定行の台本を取得"""
+        if not 0 <= index < self.total_lines:
+            return None
+        corpus_file, local_index = self.corpus.locate(index)
+        return {
+            'file': corpus_file.name,
+            'line_number': local_index + 1,
+            'text': corpus_file.text(local_index),
+            'recorded': self.recorded_index.is_recorded(index),
+            'audio_file': self.audio_files.get(index)
+        }
+    
+    def _set_recorded(self, index, audio_filename):
+        """1行の録音状態を更新（audio_filename が None なら未録音に戻す）"""
+        if audio_filename is None:
+            self.audio_files.pop(index, None)
+        else:
+            self.audio_files[index] = audio_filename
+        self.recorded_index.set(index, audio_filename is not None)
+    
+    def _snapshot(self):
+        """スナップショット用のセッション状態"""
+        recorded = []
+        for index, audio_file in sorted(self.audio_files.items()):
+            file_name, line_number = self.corpus.line_info(index)
+            recorded.append([file_name, line_number, audio_file])
+        return {
+            'version': SESSION_VERSION,
             'current_index': self.current_line,
-            'texts': self.all_texts
+            'cursors': self._cursor_table(),
+            'recorded': recorded,
+            'takes': self._take_table()
         }
-        with open(self.session_file, 'w', encoding='utf-8') as f:
-            json.dump(session_data, f, ensure_ascii=False, indent=2)
+    
+    def _take_table(self):
+        """スナップショット用のテイク履歴（[原稿ファイル名, 行番号, ハッシュ一覧, 有効なハッシュ]）"""
+        table = []
+        for index, (versions, active) in sorted(self.takes.items()):
+            file_name, line_number = self.corpus.line_info(index)
+            table.append([file_name, line_number, versions, active])
+        return table
+    
+    def _load_take_table(self, table):
+        self.takes = {}
+        for file_name, line_number, versions, active in table:
+            index = self.corpus.index_of(file_name, line_number)
+            if index is not None:
+                self.takes[index] = (versions, active)
+    
+    def _cursor_table(self):
+        """端末ごとの現在行（この端末を含む）"""
+        if self.station is None:
+            return dict(self.cursors)
+        return dict(self.cursors, **{self.station: self.current_line})
+    
+    def save_session(self):
+        """セッション状態を全体保存（テキスト再読み込み・同期など一括変更時に使用）"""
+        with self.lock, self.session_store.file_lock, metrics.timed('session_write_seconds', kind='snapshot'):
+            # 他の端末が追記した差分を取り込んでから書き出す（ジャーナルは削除されるため）
+            self.refresh()
+            self.session_store.write_snapshot(self._snapshot())
+            # 次回起動用に、録音済みフラグをそのまま書き出したバイナリ版も保存
+            header = {'version': SESSION_VERSION, 'current_index': self.current_line,
+                      'cursors': self._cursor_table(), 'takes': self._take_table(),
+                      'corpus': self.corpus.signature()}
+            names = [self.audio_files[i] for i in sorted(self.audio_files)]
+            self.session_store.write_binary(header, self.recorded_index.flags, names)
+            self._snapshot_seen = self.session_store.snapshot_stat()
+    
+    def refresh(self):
+        """他の録音端末（プロセス）がセッションに記録した録音状態を取り込む"""
+        with self.lock:
+            stat = self.session_store.snapshot_stat()
+            if stat is not None and stat != self._snapshot_seen:
+                # 他のプロセスがスナップショットを書き出した（それまでの差分は統合済み）
+                current = self.current_line
+                snapshot, entries = self.session_store.load()
+                self._apply_snapshot(snapshot)
+                self.current_line = current
+            else:
+                entries = self.session_store.load_journal(self.session_store.journal_position)
+            self._snapshot_seen = stat
+            self._apply_entries(entries, move_cursor=False)
+    
+    def _load_binary_session(self):
+        """バイナリスナップショットから復元（原稿が変わっている場合などは False）"""
+        cached = self.session_store.load_binary()
+        if cached is None:
+            return False
+        header, flags, names = cached
+        if (header.get('version') != SESSION_VERSION or header.get('corpus') != self.corpus.signature()
+                or len(flags) != self.total_lines):
+            return False
+        
+        indices = []
+        position = flags.find(1)
+        while position != -1:
+            indices.append(position)
+            position = flags.find(1, position + 1)
+        if len(indices) != len(names):
+            return False
+        
+        self.audio_files = dict(zip(indices, names))
+        self.recorded_index = RecordedIndex(flags, self.corpus.file_bounds())
+        self.cursors = dict(header.get('cursors', {}))
+        self.current_line = self.cursors.pop(self.station, header['current_index'])
+        self._load_take_table(header.get('takes', []))
+        return True
+    
+    def _record_change(self, append_entry):
+        """差分をジャーナルに記録（一定数たまったら全体保存で圧縮）"""
+        with self.session_store.file_lock:
+            if not self.session_store.exists():
+                self.save_session()
+                return
+            with metrics.timed('session_write_seconds', kind='journal'):
+                needs_compaction = append_entry()
+        if needs_compaction:
+            self.save_session()
     
     def load_session(self):
         """セッション状態を復元"""
-        if os.path.exists(self.session_file):
-            with open(self.session_file, 'r', encoding='utf-8') as f:
-                session_data = json.load(f)
-                self.current_line = session_data.get('current_index', 0)
-                self.all_texts = session_data.get('texts', [])
-                self.total_lines = len(self.all_texts)
-                return True
-        return False
+        if not self.session_store.exists():
+            return False
+        
+        with self.lock:
+            self.load_all_texts()
+            
+            with self.session_store.file_lock:
+                self._snapshot_seen = self.session_store.snapshot_stat()
+                if self._load_binary_session():
+                    entries = self.session_store.load_journal()
+                else:
+                    snapshot, entries = self.session_store.load()
+                    self._apply_snapshot(snapshot)
+            self._apply_entries(entries)
+            
+            self.current_line = min(max(self.current_line, 0), max(self.total_lines - 1, 0))
+        return True
+    
+    def _apply_entries(self, entries, move_cursor=True):
+        """ジャーナルの差分を順に適用（他の端末の現在行は cursors に控える）"""
+        for entry in entries:
+            if entry.get('op') == 'cursor':
+                station = entry.get('station')
+                if station is not None and station != self.station:
+                    self.cursors[station] = entry['index']
+                elif move_cursor:
+                    self.current_line = entry['index']
+            elif entry.get('op') == 'recorded':
+                index = self.corpus.index_of(entry['file'], entry['line_number'])
+                if index is not None:
+                    self._set_recorded(index, entry['audio_file'] if entry['recorded'] else None)
+            elif entry.get('op') == 'takes':
+                index = self.corpus.index_of(entry['file'], entry['line_number'])
+                if index is not None:
+                    self.takes[index] = (entry['versions'], entry['active'])
+    
+    def _apply_snapshot(self, snapshot):
+        """session.json の内容を反映"""
+        if 'texts' in snapshot:
+            # 旧形式（全行を保存したsession.json）からの移行
+            recorded = [(t['file'], t['line_number'], t.get('audio_file'))
+                        for t in snapshot['texts'] if t.get('recorded')]
+        else:
+            recorded = snapshot.get('recorded', [])
+        
+        # 録音済みフラグをまとめて作ってから索引を1回で構築
+        flags = bytearray(self.total_lines)
+        audio_files = {}
+        for file_name, line_number, audio_file in recorded:
+            index = self.corpus.index_of(file_name, line_number)
+            if index is not None and audio_file:
+                flags[index] = 1
+                audio_files[index] = audio_file
+        self.audio_files = audio_files
+        self.recorded_index = RecordedIndex(flags, self.corpus.file_bounds())
+        self.cursors = dict(snapshot.get('cursors', {}))
+        self.current_line = self.cursors.pop(self.station, snapshot.get('current_index', 0))
+        self._load_take_table(snapshot.get('takes', []))
+    
+    def close_session(self):
+        """終了時にジャーナルをスナップショットへ統合"""
+        with self.lock:
+            if self.session_store.journal_entries:
+                self.save_session()
+            self.session_store.close()
+            self.corpus.close()
+    
+    def move_to(self, index):
+        """現在行を移動して記録"""
+        with self.lock:
+            self.current_line = index
+            self._record_change(lambda: self.session_store.set_cursor(index, self.station))
     
     def get_current_text(self):
         """現在の台本を取得"""
-        if 0 <= self.current_line < len(self.all_texts):
-            return self.all_texts[self.current_line]
-        return None
-    
-    def mark_as_recorded(self, audio_filename):
-        """録音済みとしてマーク"""
-        if 0 <= self.current_line < len(self.all_texts):
-            self.all_texts[self.current_line]['recorded'] = True
-            self.all_texts[self.current_line]['audio_file'] = audio_filename
-            self.save_session()
+        return self.get_text(self.current_line)
+    
+    def mark_as_recorded(self, audio_filename, index=None):
+        """録音済みとしてマーク（indexを省略した場合は現在行）"""
+        with self.lock:
+            if index is None:
+                index = self.current_line
+            if 0 <= index < self.total_lines:
+                self._set_recorded(index, audio_filename)
+                if self._marked_during_sync is not None:
+                    self._marked_during_sync.add(audio_filename)
+                file_name, line_number = self.corpus.line_info(index)
+                self._record_change(lambda: self.session_store.set_recorded(
+                    file_name, line_number, audio_filename))
+    
+    def get_next_filename(self):
+        """次の音声ファイル番号（audio_N の N）を払い出す（他の録音端末とも重複しない）"""
+        return self.take_ids.allocate()
+    
+    def take_filenames(self, index):
+        """行のテイクを保存するファイル番号・音声ファイル名・メタファイル名
+        
+        録音済みの行の撮り直しは同じ audio_N を使う（以前のテイクはテイク保管庫に残る）。
+        """
+        with self.lock:
+            self.refresh()   # 他の端末がこの行を録音していればそのファイルを使う
+            match = AUDIO_NAME_RE.match(self.audio_files.get(index) or '')
+        file_number = int(match.group(1)) if match else self.get_next_filename()
+        return file_number, f"audio_{file_number}.wav", f"meta_{file_number}.txt"
+    
+    def get_takes(self, index):
+        """行のテイク履歴。返り値: (ハッシュ一覧（古い順）, 有効なハッシュ)"""
+        with self.lock:
+            versions, active = self.takes.get(index, ([], None))
+            return list(versions), active
+    
+    def add_take(self, index, take_hash, previous=None, max_versions=MAX_VERSIONS):
+        """行のテイク履歴に新しいテイクを追加して有効にする
+        
+        previous は撮り直し前のテイク（履歴のない行の場合）。履歴が max_versions を
+        超えたら古いものから外す（外したテイクは GC の対象になる）。
+        """
+        with self.lock:
+            self.refresh()
+            versions, _ = self.takes.get(index, ([], None))
+            versions = [h for h in versions if h not in (take_hash, previous)]
+            if previous is not None:
+                versions.append(previous)
+            versions.append(take_hash)
+            self._set_takes(index, versions[-max_versions:], take_hash)
+    
+    def activate_take(self, index, take_hash):
+        """履歴のテイクを有効にする（ロールバック）"""
+        with self.lock:
+            self.refresh()
+            versions, _ = self.takes.get(index, ([], None))
+            if take_hash not in versions:
+                raise ValueError(f"行 {index + 1} のテイク履歴にありません: {take_hash}")
+            self._set_takes(index, versions, take_hash)
+    
+    def _set_takes(self, index, versions, active):
+        self.takes[index] = (versions, active)
+        file_name, line_number = self.corpus.line_info(index)
+        self._record_change(lambda: self.session_store.set_takes(file_name, line_number, versions, active))
+    
+    def referenced_takes(self):
+        """いずれかの行のテイク履歴に含まれるハッシュ（他の端末の分も取り込んでから集める）"""
+        with self.lock:
+            self.refresh()
+            return {h for versions, _ in self.takes.values() for h in versions}
+    
+    def published_takes(self):
+        """各行の有効なテイク（公開中の audio_N.wav → ハッシュ）"""
+        with self.lock:
+            return {self.audio_files[index]: active for index, (_, active) in self.takes.items()
+                    if self.audio_files.get(index)}
+    
+    def next_unrecorded_line(self, start=None):
+        """現在行の次以降で最初の未録音行（末尾まで行けば先頭から）"""
+        if start is None:
+            start = self.current_line + 1
+        return self.recorded_index.next_unrecorded(start)
+    
+    def get_unrecorded_summary(self, start=0, end=None):
+        """区間内の未録音数と原稿ファイル別の未録音数"""
+        return {
+            'range_unrecorded': self.recorded_index.count_unrecorded(start, end),
+            'per_file': dict(self.recorded_index.unrecorded_per_file)
+        }
     
     def get_progress(self):
         """進捗情報を取得"""
-        recorded_count = sum(1 for text in self.all_texts if text['recorded'])
+        recorded_count = self.recorded_index.recorded_count
         return {
             'current': self.current_line + 1,
             'total': self.total_lines,
@@ -77,19 +395,50 @@ class TextManager:
     
     def sync_with_actual_files(self):
         """実際のファイル存在状況とセッションデータを同期"""
-        audio_dir = Path("dataset/audio_files")
+        self._marked_during_sync = set()
+        with metrics.timed('sync_seconds', step='scan'):
+            index = self.file_index.scan()
+        audio_files = set(index['audio_files'])
         
-        for i, text_item in enumerate(self.all_texts):
-            expected_filename = f"audio_{text_item['file']}_{text_item['line_number']:04d}.wav"
-            audio_file = audio_dir / expected_filename
+        with self.lock, self.session_store.file_lock, metrics.timed('sync_seconds', step='match'):
+            self.refresh()   # 他の端末の録音を取り込んでから照合する
+            changed = []
+            claimed = set()
+            
+            # 1. セッションに記録済みの対応関係を、実在するファイルで検証
+            #    （走査中に保存されたファイルは走査結果になくても有効とする）
+            marked, self._marked_during_sync = self._marked_during_sync, None
+            for i, audio_file in sorted(self.audio_files.items()):
+                exists = audio_file in audio_files or audio_file in marked
+                if exists and audio_file not in claimed:
+                    claimed.add(audio_file)
+                else:
+                    self._set_recorded(i, None)
+                    changed.append((i, None))
+            
+            # 2. セッションに紐づいていないファイルを、テキストの一致で未録音の行へ割り当て
+            #    （同じテキストのファイルは番号順に割り当て、何度同期しても同じ結果にする）
+            unclaimed = {}
+            for audio_file in sorted(index['texts'], key=natural_key):
+                if audio_file in audio_files and audio_file not in claimed:
+                    unclaimed.setdefault(index['texts'][audio_file], []).append(audio_file)
+            if unclaimed:
+                for i in range(self.total_lines):
+                    if self.recorded_index.is_recorded(i):
+                        continue
+                    candidates = unclaimed.get(self.corpus.text(i))
+                    if candidates:
+                        audio_file = candidates.pop(0)
+                        self._set_recorded(i, audio_file)
+                        changed.append((i, audio_file))
             
-            # 実際のファイル存在状況で更新
-            if audio_file.exists():
-                text_item['recorded'] = True
-                text_item['audio_file'] = expected_filename
+            # 変更行が少なければ差分のみ記録
+            if len(changed) > 100 or not self.session_store.exists():
+                self.save_session()
             else:
-                text_item['recorded'] = False
-                text_item['audio_file'] = None
+                for i, audio_file in changed:
+                    file_name, line_number = self.corpus.line_info(i)
+                    self._record_change(lambda: self.session_store.set_recorded(
+                        file_name, line_number, audio_file, audio_file is not None))
         
-        self.save_session()
-        print(f"📊 ファイル同期完了: {sum(1 for t in self.all_texts if t['recorded'])} 件の録音ファイルを確認")
\ No newline at end of file
+        return self.recorded_index.recorded_count
@@ -1,76 +1,468 @@
-def split_text_into_segments(text, min_duration=3, max_duration=5):
-    import re
+import os
+import re
+import time
+import wave
+import queue
+import threading
+from collections import deque
+from pathlib import Path
 
-    # 1. Split the text into sentences
-    sentences = re.split(r'(?<=[.!?]) +', text)
-    
-    segments = []
-    current_segment = ""
-    current_duration = 0
+from wav_stream_writer import commit_file
+
+# 文末記号の連続（「……！？」など）と括弧。ASCII のピリオドは後ろが空白・行末のときだけ文末とみなす
+SCAN_RE = re.compile(r'[。！？!?]+|\.(?=\s|$)|[「『（(【〈]|[」』）)】〉]')
+OPENERS = '「『（(【〈'
+CLOSERS = '」』）)】〉'
+QUOTE_CONTINUE = 'とっ'        # 「…。」と言った のように閉じ括弧の後に続く文
+LONG_QUOTE_CHARS = 200        # これより長い括弧内の文は括弧の途中でも文末で区切る
+CLAUSE_RE = re.compile(r'[^、，,]+[、，,]*')
+
+# 青空文庫形式のルビ・注記
+RUBY_RE = re.compile(r'《[^》]*》|［＃[^］]*］|｜')
+
+# 読み上げ時間の推定（モーラ数 / 話速 + 1テイクあたりの前後の無音）
+# 文字を種類ごとの制御文字に置き換える表。str.translate 1回と count で数えられる
+KANA, SMALL_KANA, KANJI, ALPHA, DIGIT, PAUSE = '\x01\x02\x03\x04\x05\x06'
+
+def _char_classes():
+    table = {}
+    for cls, ranges in ((KANA, ['ぁゖ', 'ァヺ', 'ーー']), (KANJI, ['㐀䶿', '一鿿', '々々', '〆〆', 'ヶヶ']),
+                        (ALPHA, ['AZ', 'az', 'ＡＺ', 'ａｚ']), (DIGIT, ['09', '０９'])):
+        for first, last in ranges:
+            table.update(dict.fromkeys(range(ord(first), ord(last) + 1), cls))
+    table.update(dict.fromkeys(map(ord, 'ぁぃぅぇぉゃゅょゎァィゥェォャュョヮ'), SMALL_KANA))
+    table.update(dict.fromkeys(map(ord, '、，,。！？!?'), PAUSE))
+    return table
+
+CHAR_CLASSES = _char_classes()
+KANJI_MORAE = 1.8      # 漢字1字あたりの平均モーラ数
+ALPHA_MORAE = 1.0
+DIGIT_MORAE = 1.5
+PAUSE_MORAE = 1.5      # 読点・文末の間
+DEFAULT_MORAE_PER_SECOND = 7.0
+DEFAULT_OFFSET_SECONDS = 0.4
+MIN_CALIBRATION_TAKES = 20
+
+DEFAULT_MIN_SECONDS = 2.0
+DEFAULT_MAX_SECONDS = 8.0
+
+def estimate_morae(text):
+    """読み上げのモーラ数の概算（かな1字=1、拗音の小書き=0、漢字・英数字は平均値、句読点は間）"""
+    classes = text.translate(CHAR_CLASSES)
+    return (classes.count(KANA)
+            + KANJI_MORAE * classes.count(KANJI)
+            + ALPHA_MORAE * classes.count(ALPHA)
+            + DIGIT_MORAE * classes.count(DIGIT)
+            + PAUSE_MORAE * classes.count(PAUSE))
+
+class SpeechRate:
+    """読み上げ時間の推定モデル（秒 = offset + モーラ数 / morae_per_second）"""
+
+    def __init__(self, morae_per_second=DEFAULT_MORAE_PER_SECOND, offset=DEFAULT_OFFSET_SECONDS, samples=0):
+        self.morae_per_second = morae_per_second
+        self.offset = offset
+        self.samples = samples   # 校正に使ったテイク数（0 なら既定値）
+
+    def seconds(self, morae):
+        return self.offset + morae / self.morae_per_second
+
+    def estimate(self, text):
+        return self.seconds(estimate_morae(text))
+
+    def __str__(self):
+        source = f"録音 {self.samples} 件から校正" if self.samples else "既定値"
+        return f"{self.morae_per_second:.2f} モーラ/秒 + {self.offset:.2f} 秒 ({source})"
+
+def _fit_line(points):
+    """最小二乗法で 秒 = a + b * モーラ数 を求める"""
+    n = len(points)
+    mean_x = sum(x for x, _ in points) / n
+    mean_y = sum(y for _, y in points) / n
+    sxx = sum((x - mean_x) ** 2 for x, _ in points)
+    if sxx == 0:
+        return None
+    b = sum((x - mean_x) * (y - mean_y) for x, y in points) / sxx
+    return mean_y - b * mean_x, b
+
+def calibrate_rate(metadata_path="dataset/metadata.txt", audio_dir="dataset/audio_files",
+                   min_takes=MIN_CALIBRATION_TAKES):
+    """metadata.txt の録音済みテイクの長さから話速を校正（テイクが少なければ既定値）"""
+    from metadata_store import MetadataStore
+    from audio_io import info, resolve
+
+    metadata_path = Path(metadata_path)
+    if not metadata_path.exists():
+        return SpeechRate()
+    points = []
+    for filename, (_, text) in MetadataStore(metadata_path).entries.items():
+        path = resolve(Path(audio_dir) / filename)
+        morae = estimate_morae(text)
+        if morae <= 0 or path is None:
+            continue
+        try:
+            audio_info = info(path)
+        except (OSError, ValueError):
+            continue
+        points.append((morae, audio_info.frames / audio_info.sample_rate))
+    if len(points) < min_takes:
+        return SpeechRate()
+
+    # 1回目の当てはめから大きく外れたテイク（言い直し・録音ミス）を除いて当てはめ直す
+    fit = _fit_line(points)
+    if fit is not None:
+        residuals = sorted(abs(y - fit[0] - fit[1] * x) for x, y in points)
+        limit = 3 * max(residuals[len(residuals) // 2], 0.05)
+        kept = [(x, y) for x, y in points if abs(y - fit[0] - fit[1] * x) <= limit]
+        fit = _fit_line(kept) if len(kept) >= min_takes else fit
+
+    if fit is None or fit[1] <= 0 or not 0 <= fit[0] <= 3.0:
+        # 当てはめが不安定なら前後の無音は既定値のまま、話速だけを比で求める
+        total_morae = sum(x for x, _ in points)
+        total_seconds = sum(y for _, y in points) - DEFAULT_OFFSET_SECONDS * len(points)
+        if total_seconds <= 0:
+            return SpeechRate()
+        return SpeechRate(total_morae / total_seconds, DEFAULT_OFFSET_SECONDS, len(points))
+    return SpeechRate(1 / fit[1], fit[0], len(points))
+
+def clean_line(line):
+    """ルビ・注記・字下げを除いた本文"""
+    if '《' in line or '［' in line or '｜' in line:
+        line = RUBY_RE.sub('', line)
+    return line.strip().strip('\u3000')
+
+def split_sentences(line):
+    """1行を文に分割（括弧内の文末では区切らない）"""
+    sentences = []
+    start = 0
+    depth = 0
+    for m in SCAN_RE.finditer(line):
+        token = m.group()
+        end = m.end()
+        if token in OPENERS:
+            depth += 1
+        elif token in CLOSERS:
+            if depth:
+                depth -= 1
+            # 「…。」で終わる会話文は、後ろに「と言った」などが続かなければ1文
+            if (depth == 0 and line[m.start() - 1:m.start()] in '。！？!?'
+                    and line[end:end + 1] not in QUOTE_CONTINUE):
+                sentences.append(line[start:end])
+                start = end
+        elif depth == 0 or end - start > LONG_QUOTE_CHARS:
+            if line[end:end + 1] not in CLOSERS:
+                sentences.append(line[start:end])
+                start = end
+    sentences.append(line[start:])
+    return [s for s in (s.strip() for s in sentences) if s]
+
+def iter_sentences(lines):
+    """行の反復から文を順に返す（段落の区切りでは None を返す）"""
+    for line in lines:
+        line = clean_line(line)
+        if line:
+            yield from split_sentences(line)
+        yield None
+
+def _join(parts):
+    """文・文節の連結（英文どうしの間だけ空白を入れる）"""
+    out = [parts[0]]
+    for prev, part in zip(parts, parts[1:]):
+        if prev[-1].isascii() and part[0].isascii():
+            out.append(' ')
+        out.append(part)
+    return ''.join(out)
+
+def _split_clauses(sentence):
+    """長すぎる文を読点で文節に分割"""
+    return [c.strip() for c in CLAUSE_RE.findall(sentence) if c.strip()] or [sentence]
+
+def iter_segments(sentences, rate=None, min_seconds=DEFAULT_MIN_SECONDS, max_seconds=DEFAULT_MAX_SECONDS):
+    """文を推定時間が min_seconds〜max_seconds になるよう束ねて (テキスト, 推定秒数) を返す
+
+    短い文は後続の文とまとめ、max_seconds を超える文は読点で分割する。
+    段落の区切り（None）では min_seconds に達していれば区切る。
+    """
+    rate = rate or SpeechRate()
+    parts = []
+    morae = 0.0
 
-    # 2. Iterate through sentences and create segments
     for sentence in sentences:
-        # Estimate duration based on average speaking rate (about 150 words per minute)
-        estimated_duration = len(sentence.split()) / 150 * 60
-        
-        if current_duration + estimated_duration > max_duration:
-            # If adding this sentence exceeds max duration, save the current segment
-            segments.append(current_segment.strip())
-            current_segment = sentence
-            current_duration = estimated_duration
-        else:
-            # Add sentence to the current segment
-            current_segment += " " + sentence
-            current_duration += estimated_duration
-
-    # Add the last segment if it exists
-    if current_segment:
-        segments.append(current_segment.strip())
-
-    return segments
-
-def create_audio_dataset(input_file, output_dir, metadata_file):
-    import os
-    import sounddevice as sd
-    import numpy as np
-    import wave
-
-    # Read the text from the input file
-    with open(input_file, 'r', encoding='utf-8') as f:
-        text = f.read()
-
-    # Split the text into segments
-    segments = split_text_into_segments(text)
-
-    # Prepare metadata
-    metadata = []
-
-    # Record audio for each segment
-    for i, segment in enumerate(segments):
-        print(f"Recording segment {i + 1}/{len(segments)}: {segment}")
-        
-        # Record audio
-        fs = 44100  # Sample rate
-        duration = 5  # seconds
-        recording = sd.rec(int(duration * fs), samplerate=fs, channels=1, dtype='int16')
-        sd.wait()  # Wait until recording is finished
-
-        # Save the recording
-        audio_file_name = f"audio_segment_{i + 1}.wav"
-        audio_file_path = os.path.join(output_dir, audio_file_name)
-        with wave.open(audio_file_path, 'wb') as wf:
-            wf.setnchannels(1)
+        if sentence is None:
+            if parts and rate.seconds(morae) >= min_seconds:
+                yield _join(parts), rate.seconds(morae)
+                parts, morae = [], 0.0
+            continue
+
+        sentence_morae = estimate_morae(sentence)
+        pieces = [(sentence, sentence_morae)]
+        if rate.seconds(sentence_morae) > max_seconds:
+            pieces = [(c, estimate_morae(c)) for c in _split_clauses(sentence)]
+
+        for text, piece_morae in pieces:
+            if parts and rate.seconds(morae + piece_morae) > max_seconds:
+                # 短すぎる塊は 1.5 倍までなら次とまとめる
+                if (rate.seconds(morae) >= min_seconds
+                        or rate.seconds(morae + piece_morae) > max_seconds * 1.5):
+                    yield _join(parts), rate.seconds(morae)
+                    parts, morae = [], 0.0
+            parts.append(text)
+            morae += piece_morae
+
+    if parts:
+        yield _join(parts), rate.seconds(morae)
+
+def read_lines(path, encoding='utf-8'):
+    """原稿を先頭から順に1行ずつ読む（ファイル全体はメモリに載せない）"""
+    with open(path, 'r', encoding=encoding, errors='replace') as f:
+        yield from f
+
+def split_text_into_segments(text, min_duration=3, max_duration=5, rate=None):
+    """テキスト全体を録音用の区間に分割"""
+    return [segment for segment, _ in iter_segments(iter_sentences(text.splitlines()), rate,
+                                                     min_duration, max_duration)]
+
+def _script_path(output_dir, stem, number):
+    return Path(output_dir) / f"{stem}_{number:03d}.txt"
+
+def write_scripts(segments, output_dir="data/input", stem="script", file_minutes=30.0, overwrite=False):
+    """区間を1行1区間の原稿ファイル（{stem}_001.txt, …）へ順に書き出す
+
+    各ファイルの推定読み上げ時間が file_minutes に達したら次のファイルへ移る。
+    最後のファイルが目標の半分に満たなければ直前のファイルへまとめる。
+    書き込み中は .tmp に書き、完成したファイルから順に .txt へ置き換える。
+    返り値: {'files': [パス], 'segments': 区間数, 'seconds': 推定合計秒数}
+    """
+    output_dir = Path(output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    existing = sorted(output_dir.glob(f"{stem}_[0-9][0-9][0-9].txt"))
+    if existing:
+        if not overwrite:
+            raise FileExistsError(f"{existing[0]} などが既に存在します")
+        for path in existing:
+            path.unlink()
+
+    limit = file_minutes * 60
+    files = []
+    count = 0
+    total = 0.0
+    f = None
+    file_seconds = 0.0
+    for segment, seconds in segments:
+        if f is None or file_seconds >= limit:
+            if f is not None:
+                f.close()
+                os.replace(files[-1].with_suffix('.tmp'), files[-1])
+            files.append(_script_path(output_dir, stem, len(files) + 1))
+            f = open(files[-1].with_suffix('.tmp'), 'w', encoding='utf-8')
+            file_seconds = 0.0
+        f.write(segment + "\n")
+        file_seconds += seconds
+        count += 1
+        total += seconds
+    if f is None:
+        return {'files': [], 'segments': 0, 'seconds': 0.0}
+    f.close()
+
+    last = files[-1].with_suffix('.tmp')
+    if len(files) > 1 and file_seconds < limit / 2:
+        with open(files[-2], 'a', encoding='utf-8') as out, open(last, 'r', encoding='utf-8') as tail:
+            for line in tail:
+                out.write(line)
+        last.unlink()
+        files.pop()
+    else:
+        os.replace(last, files[-1])
+    return {'files': files, 'segments': count, 'seconds': total}
+
+def segment_file(source, output_dir="data/input", stem=None, rate=None, min_seconds=DEFAULT_MIN_SECONDS,
+                 max_seconds=DEFAULT_MAX_SECONDS, file_minutes=30.0, encoding='utf-8', overwrite=False):
+    """長い原稿（小説など）を録音用の原稿ファイル群に変換"""
+    start = time.perf_counter()
+    segments = iter_segments(iter_sentences(read_lines(source, encoding)), rate, min_seconds, max_seconds)
+    result = write_scripts(segments, output_dir, stem or Path(source).stem, file_minutes, overwrite)
+    result['elapsed'] = time.perf_counter() - start
+    return result
+
+class BatchTake:
+    """連続録音の1区間分（バッファとレベル計測は録音開始前に確保しておく）"""
+
+    def __init__(self, number, text, seconds, sample_rate, channels, silence_ms, lead_seconds):
+        from capture_buffer import CaptureBuffer
+        from level_meter import LevelMeter
+
+        self.number = number
+        self.text = text
+        self.seconds = seconds
+        # 読み始めまでの余裕を含めた上限。これを超えたら無音検出を待たずに打ち切る
+        max_seconds = seconds * 2 + lead_seconds
+        self.max_frames = int(max_seconds * sample_rate)
+        self.silence_frames = int(silence_ms * sample_rate / 1000)
+        # 推定の半分も話していないうちの無音は文中の間とみなして打ち切らない
+        self.min_voice_frames = int(max(0.0, seconds - DEFAULT_OFFSET_SECONDS) * 0.5 * sample_rate)
+        self.buffer = CaptureBuffer(sample_rate, channels, 'int16', initial_seconds=max_seconds + 1)
+        self.meter = LevelMeter(sample_rate)
+        self.finished = threading.Event()
+
+    def is_complete(self):
+        """発話の後に無音が続いたか、上限の長さに達したか"""
+        meter = self.meter
+        if (meter.voice_end is not None and meter.frames - meter.voice_end >= self.silence_frames
+                and meter.voice_end - meter.voice_start >= self.min_voice_frames):
+            return True
+        return self.buffer.frames >= self.max_frames
+
+    def trimmed(self):
+        """前後の無音を除いた音声（発話がなければ None）"""
+        points = self.meter.trim_points()
+        if points is None:
+            return None
+        return self.buffer.finalize()[points[0]:points[1]]
+
+class BatchRecorder:
+    """原稿の区間を連続して録音するパイプライン
+
+    入力ストリームは最初から最後まで開いたままにし、コールバックが区間の終わり
+    （発話後の無音・上限時間）を検出したら、用意済みの次の区間へその場で切り替える。
+    録音済みの区間は書き込みスレッドが WAV 書き出しと metadata.txt への追記を行うので、
+    書き込みを待たずに次の区間の録音が始まる。
+    """
+
+    def __init__(self, output_dir, metadata_store, sample_rate=44100, channels=1,
+                 silence_ms=1200, lead_seconds=3.0):
+        self.output_dir = Path(output_dir)
+        self.metadata_store = metadata_store
+        self.sample_rate = sample_rate
+        self.channels = channels
+        self.silence_ms = silence_ms
+        self.lead_seconds = lead_seconds
+        self.current = None           # 録音中の区間（コールバックだけが書き換える）
+        self.upcoming = deque()       # 用意済みの次の区間（コールバックが取り出して切り替える）
+        self.errors = []
+        self.saved = 0
+        self.skipped = []      # 発話が検出されなかった区間
+        self._queue = queue.Queue()
+        self._writer = threading.Thread(target=self._writer_loop, daemon=True)
+        self._writer.start()
+
+    def make_take(self, number, text, seconds):
+        return BatchTake(number, text, seconds, self.sample_rate, self.channels,
+                         self.silence_ms, self.lead_seconds)
+
+    def callback(self, indata, frames, time_info, status):
+        take = self.current
+        if take is None:
+            # current を書き換えるのはコールバックだけにし、メインスレッドとの競合を避ける
+            try:
+                take = self.current = self.upcoming.popleft()
+            except IndexError:
+                return
+        if status:
+            take.buffer.record_status(status)
+        take.buffer.append(indata)
+        take.meter.process(indata)
+        if take.is_complete():
+            self.current = None   # 次のブロックから用意済みの区間へ切り替える
+            take.finished.set()
+
+    @staticmethod
+    def filename(number):
+        return f"audio_segment_{number}.wav"
+
+    def _write(self, take):
+        """1区間分の WAV を書き出して metadata.txt へ追記（WAV が先なので中断時は未録音扱い）"""
+        audio = take.trimmed()
+        if audio is None:
+            self.skipped.append(take.number)
+            return
+        filename = self.filename(take.number)
+        temp_path = self.output_dir / (filename + ".tmp")
+        with wave.open(str(temp_path), 'wb') as wf:
+            wf.setnchannels(self.channels)
             wf.setsampwidth(2)  # 16-bit audio
-            wf.setframerate(fs)
-            wf.writeframes(recording.tobytes())
+            wf.setframerate(self.sample_rate)
+            wf.writeframes(audio.tobytes())
+        commit_file(temp_path, self.output_dir / filename)
+        self.metadata_store.upsert(filename, take.text)
+        self.saved += 1
+
+    def _writer_loop(self):
+        while True:
+            take = self._queue.get()
+            if take is None:
+                break
+            try:
+                self._write(take)
+            except Exception as e:
+                self.errors.append((take.number, e))
+            take.buffer = None
+
+    def prepare(self, take):
+        """次に録音する区間を用意（コールバックが次のブロックで取り出して開始する）"""
+        self.upcoming.append(take)
+
+    def submit(self, take):
+        self._queue.put(take)
+
+    def close(self):
+        """書き込み待ちの区間をすべて書き出して終了"""
+        self._queue.put(None)
+        self._writer.join()
+
+def create_audio_dataset(input_file, output_dir, metadata_file, sample_rate=44100, rate=None,
+                         silence_ms=1200, min_seconds=DEFAULT_MIN_SECONDS, max_seconds=DEFAULT_MAX_SECONDS):
+    """原稿を区間に分けて連続録音する（中断後に再実行すると未録音の区間から再開）
+
+    区間の長さは読み上げ時間の推定に従い、発話後に silence_ms の無音が続いたら次の区間へ進む。
+    """
+    import sounddevice as sd
+    from metadata_store import MetadataStore
+
+    os.makedirs(output_dir, exist_ok=True)
+    store = MetadataStore(metadata_file)
+    segments = list(iter_segments(iter_sentences(read_lines(input_file)), rate, min_seconds, max_seconds))
+
+    # metadata.txt に同じテキストで登録済みかつ音声ファイルがある区間は録音済み
+    pending = [(number, text, seconds) for number, (text, seconds) in enumerate(segments, 1)
+               if store.get(BatchRecorder.filename(number)) != text
+               or not os.path.exists(os.path.join(output_dir, BatchRecorder.filename(number)))]
+    if not pending:
+        print(f"✅ 全 {len(segments)} 区間が録音済みです")
+        return
+    print(f"🎙️ {len(pending)}/{len(segments)} 区間を録音します（中断は Ctrl+C）")
+
+    recorder = BatchRecorder(output_dir, store, sample_rate, silence_ms=silence_ms)
+    takes = deque()
+    for segment in pending[:2]:
+        takes.append(recorder.make_take(*segment))
+        recorder.prepare(takes[-1])
 
-        # Append to metadata
-        metadata.append(f"{audio_file_name}|{segment}")
+    stream = sd.InputStream(samplerate=sample_rate, channels=1, dtype='int16', callback=recorder.callback)
+    stream.start()
+    try:
+        for k, (number, text, seconds) in enumerate(pending):
+            take = takes.popleft()
+            print(f"Recording segment {number}/{len(segments)} (推定 {seconds:.1f} 秒): {text}")
+            while not take.finished.wait(0.1):
+                pass
+            # コールバックは次の区間へ切り替え済み。その次の区間を用意しておく
+            if k + 2 < len(pending):
+                takes.append(recorder.make_take(*pending[k + 2]))
+                recorder.prepare(takes[-1])
+            recorder.submit(take)
+    except KeyboardInterrupt:
+        print("\n⏹️ 中断しました（録音途中の区間は保存しません）")
+    finally:
+        stream.stop()
+        stream.close()
+        recorder.current = None
+        recorder.close()
+        store.close()
 
-    # Write metadata to file
-    with open(metadata_file, 'w', encoding='utf-8') as f:
-        for entry in metadata:
-            f.write(entry + '\n')
+    for number, error in recorder.errors:
+        print(f"❌ segment {number}: {error}")
+    if recorder.skipped:
+        print(f"⚠️ 発話が検出されなかった区間: {', '.join(map(str, recorder.skipped))}")
+    print(f"💾 保存: {recorder.saved} 区間 → {metadata_file}")
 
 # Example usage
 if __name__ == "__main__":
@@ -0,0 +1,238 @@
+import os
+import queue
+import struct
+import threading
+import time
+from pathlib import Path
+from dataset_lock import try_lock
+
+PARTIAL_SUFFIX = ".part"
+HEADER_SIZE = 80          # RIFF(12) + JUNK/ds64(36) + fmt(24) + dataヘッダ(8)
+FMT_CHANNELS_OFFSET = 58
+MAX_RIFF_SIZE = 0xFFFFFFFF
+
+def _build_header(sample_rate, channels, data_size):
+    """WAV/RF64ヘッダを組み立て（4GB超ではRF64に切り替え）"""
+    block_align = channels * 2
+    fmt = struct.pack('<4sIHHIIHH', b'fmt ', 16, 1, channels, sample_rate,
+                      sample_rate * block_align, block_align, 16)
+    riff_size = HEADER_SIZE - 8 + data_size
+
+    if riff_size <= MAX_RIFF_SIZE:
+        # 後でRF64へ昇格できるよう、ds64と同じ大きさのJUNKチャンクを確保しておく
+        head = struct.pack('<4sI4s', b'RIFF', riff_size, b'WAVE')
+        reserve = struct.pack('<4sI', b'JUNK', 28) + b'\x00' * 28
+        data = struct.pack('<4sI', b'data', data_size)
+    else:
+        head = struct.pack('<4sI4s', b'RF64', MAX_RIFF_SIZE, b'WAVE')
+        reserve = struct.pack('<4sIQQQI', b'ds64', 28, riff_size, data_size,
+                              data_size // block_align, 0)
+        data = struct.pack('<4sI', b'data', MAX_RIFF_SIZE)
+    return head + reserve + fmt + data
+
+def _to_int16_bytes(block):
+    """float32ブロックを16bit PCMへ変換"""
+    import numpy as np  # 起動時の復旧処理だけでは numpy を読み込まない
+    if block.dtype == np.int16:
+        return block.tobytes()
+    return (np.clip(block, -1.0, 1.0) * 32767).astype(np.int16).tobytes()
+
+class StreamedTake:
+    """ディスクへ直接書き込まれた録音テイク"""
+
+    def __init__(self, path, sample_rate, channels, duration):
+        self.path = Path(path)
+        self.sample_rate = sample_rate
+        self.channels = channels
+        self.duration = duration
+
+    def load(self):
+        """再生用にファイルから読み込み（FLAC に圧縮済みのテイクも読める）"""
+        import numpy as np
+        from audio_io import read_pcm16
+        samples, _ = read_pcm16(self.path)
+        return np.asarray(samples, dtype=np.float32) / 32767
+
+class WavFileWriter:
+    """16bit PCM のバイト列を一時WAVファイルへ追記（ヘッダは一定間隔で更新）"""
+
+    def __init__(self, path, sample_rate=44100, channels=1, header_interval=1.0):
+        self.path = Path(path)
+        self.sample_rate = sample_rate
+        self.channels = channels
+        self.data_size = 0
+
+        # ヘッダ更新間隔（バイト数換算）
+        self._patch_interval = int(sample_rate * channels * 2 * header_interval)
+        self._unpatched = 0
+        # 書き込み中は他の録音端末の復旧処理（recover_partial_files）の対象にしない。
+        # 開いてからロックするまでの間に復旧処理が削除・改名していたら作り直す
+        while True:
+            self._file = open(self.path, 'wb')
+            while not try_lock(self._file.fileno()):
+                time.sleep(0.01)   # 復旧処理が確認中
+            try:
+                if os.stat(self.path).st_ino == os.fstat(self._file.fileno()).st_ino:
+                    break
+            except FileNotFoundError:
+                pass
+            self._file.close()
+        self._file.write(_build_header(sample_rate, channels, 0))
+
+    def append(self, chunk):
+        self._file.write(chunk)
+        self.data_size += len(chunk)
+        self._unpatched += len(chunk)
+        if self._unpatched >= self._patch_interval:
+            self.patch_header()
+
+    def patch_header(self):
+        """現在のデータ長でヘッダを書き換え（クラッシュ時も有効なWAVを保つ）"""
+        self._file.flush()
+        position = self._file.tell()
+        self._file.seek(0)
+        self._file.write(_build_header(self.sample_rate, self.channels, self.data_size))
+        self._file.seek(position)
+        self._file.flush()
+        self._unpatched = 0
+
+    def close(self):
+        """ヘッダを確定してファイルを閉じる"""
+        self.patch_header()
+        os.fsync(self._file.fileno())
+        self._file.close()
+        return self.path
+
+    def discard(self):
+        """書き込みを中止して一時ファイルを削除"""
+        self._file.close()
+        self.path.unlink(missing_ok=True)
+
+    @property
+    def duration(self):
+        """書き込み済みの長さ（秒）"""
+        return self.data_size / (self.sample_rate * self.channels * 2)
+
+class WavStreamWriter:
+    """録音ブロックを別スレッドで一時WAVファイルへ逐次書き込み"""
+
+    def __init__(self, path, sample_rate=44100, channels=1, queue_blocks=256, header_interval=1.0):
+        self.path = Path(path)
+        self.sample_rate = sample_rate
+        self.channels = channels
+        self.dropped_blocks = 0
+        self.max_queue_depth = 0
+        self.error = None
+
+        self._queue = queue.Queue(maxsize=queue_blocks)
+        self._file = WavFileWriter(path, sample_rate, channels, header_interval)
+        self._thread = threading.Thread(target=self._writer_loop, daemon=True)
+        self._thread.start()
+
+    def write(self, block):
+        """コールバックから呼ばれる（ブロックせず、満杯なら破棄して記録）"""
+        try:
+            self._queue.put_nowait(block)
+        except queue.Full:
+            self.dropped_blocks += 1
+            return
+        depth = self._queue.qsize()
+        if depth > self.max_queue_depth:
+            self.max_queue_depth = depth
+
+    def _writer_loop(self):
+        """キューからブロックを取り出してファイルへ追記"""
+        while True:
+            block = self._queue.get()
+            if block is None:
+                break
+            if self.error is not None:
+                continue
+            try:
+                self._file.append(_to_int16_bytes(block))
+            except OSError as e:
+                self.error = e
+
+    def close(self):
+        """残りのブロックを書き出してファイルを閉じる"""
+        self._queue.put(None)
+        self._thread.join()
+        self._file.close()
+        if self.error is not None:
+            raise self.error
+        return self.path
+
+    @property
+    def data_size(self):
+        return self._file.data_size
+
+    @property
+    def duration(self):
+        """書き込み済みの長さ（秒）"""
+        return self._file.duration
+
+def commit_file(temp_path, final_path):
+    """一時ファイルを最終ファイル名へアトミックに置き換え"""
+    final_path = Path(final_path)
+    final_path.parent.mkdir(parents=True, exist_ok=True)
+    os.replace(temp_path, final_path)
+    return final_path
+
+def truncate_wav(path, frames):
+    """WavStreamWriter で書いたファイルを先頭から frames フレームに切り詰め（データの書き直しなし）"""
+    with open(path, 'r+b') as f:
+        f.seek(FMT_CHANNELS_OFFSET)
+        channels, sample_rate = struct.unpack('<HI', f.read(6))
+        data_size = frames * channels * 2
+        f.seek(0)
+        f.write(_build_header(sample_rate, channels, data_size))
+        f.truncate(HEADER_SIZE + data_size)
+
+def recovered_path(part_path):
+    """recover_partial_files が一時ファイルを復旧したときのファイル名"""
+    part_path = Path(part_path)
+    return part_path.with_name(f"recovered_{part_path.name[:-len(PARTIAL_SUFFIX)].lstrip('.')}")
+
+def recover_partial_files(directory):
+    """中断された録音の一時ファイルを、有効なWAVとして復旧
+
+    各ファイルは開いてロックを取ってから確認し、削除・改名もロック中に行う
+    （他の録音端末が書き込み中のファイルはロックが取れないので触らない）。
+    """
+    recovered = []
+    for part_path in sorted(Path(directory).glob(f"*{PARTIAL_SUFFIX}")):
+        target = recovered_path(part_path)
+        try:
+            f = open(part_path, 'r+b')
+        except FileNotFoundError:
+            continue  # 保存・復旧が済んだ
+        deferred = None
+        with f:
+            if not try_lock(f.fileno()):
+                continue  # 他の録音端末が書き込み中
+            try:
+                if os.stat(part_path).st_ino != os.fstat(f.fileno()).st_ino:
+                    continue  # 開いた後に他の端末が改名した
+            except FileNotFoundError:
+                continue
+            size = os.fstat(f.fileno()).st_size
+            if size <= HEADER_SIZE:
+                action = part_path.unlink
+            else:
+                f.seek(FMT_CHANNELS_OFFSET)
+                channels, sample_rate = struct.unpack('<HI', f.read(6))
+                data_size = size - HEADER_SIZE
+                data_size -= data_size % (channels * 2)  # 途中で切れたフレームを除外
+                f.seek(0)
+                f.write(_build_header(sample_rate, channels, data_size))
+                f.truncate(HEADER_SIZE + data_size)
+                action = lambda: os.replace(part_path, target)
+            try:
+                action()
+            except PermissionError:
+                deferred = action   # Windows では開いているファイルを削除・改名できない
+        if deferred is not None:
+            deferred()
+        if size > HEADER_SIZE:
+            recovered.append(target)
+    return recovered
@@ -0,0 +1,160 @@
+import os
+import json
+import base64
+import struct
+import hashlib
+
+# RFC 6455 の最小限の実装（asyncio の StreamReader / StreamWriter 用）
+GUID = b"258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+OP_CONTINUATION = 0x0
+OP_TEXT = 0x1
+OP_BINARY = 0x2
+OP_CLOSE = 0x8
+OP_PING = 0x9
+OP_PONG = 0xA
+CLOSE_NORMAL = 1000
+CLOSE_PROTOCOL_ERROR = 1002
+CLOSE_TOO_BIG = 1009
+MAX_HEADER_BYTES = 16 * 1024
+
+class ProtocolError(Exception):
+    def __init__(self, message, code=CLOSE_PROTOCOL_ERROR):
+        super().__init__(message)
+        self.code = code
+
+def accept_key(key):
+    """Sec-WebSocket-Key に対する Sec-WebSocket-Accept"""
+    return base64.b64encode(hashlib.sha1(key.encode('ascii') + GUID).digest()).decode('ascii')
+
+async def read_http_head(reader):
+    """HTTP のリクエスト行（またはステータス行）とヘッダ（小文字のキー）"""
+    try:
+        head = await reader.readuntil(b"\r\n\r\n")
+    except Exception as e:
+        raise ProtocolError(f"HTTPヘッダを読み込めません: {e}")
+    if len(head) > MAX_HEADER_BYTES:
+        raise ProtocolError("HTTPヘッダが大きすぎます")
+    lines = head.decode('latin-1').split("\r\n")
+    headers = {}
+    for line in lines[1:]:
+        if ':' in line:
+            name, value = line.split(':', 1)
+            headers[name.strip().lower()] = value.strip()
+    return lines[0], headers
+
+def _mask(payload, mask):
+    """マスク（XOR）。整数演算でまとめて処理するので長いペイロードでも速い"""
+    if not payload:
+        return payload
+    n = len(payload)
+    key = (mask * (n // 4 + 1))[:n]
+    return (int.from_bytes(payload, 'little') ^ int.from_bytes(key, 'little')).to_bytes(n, 'little')
+
+async def read_frame(reader, max_size):
+    """1フレーム読む。返り値: (fin, opcode, payload)。max_size を超えるフレームは拒否"""
+    first, second = await reader.readexactly(2)
+    fin = bool(first & 0x80)
+    opcode = first & 0x0F
+    masked = bool(second & 0x80)
+    length = second & 0x7F
+    if length == 126:
+        length = struct.unpack('!H', await reader.readexactly(2))[0]
+    elif length == 127:
+        length = struct.unpack('!Q', await reader.readexactly(8))[0]
+    if length > max_size:
+        raise ProtocolError(f"フレームが大きすぎます ({length} バイト)", CLOSE_TOO_BIG)
+    mask = await reader.readexactly(4) if masked else None
+    payload = await reader.readexactly(length)
+    if mask is not None:
+        payload = _mask(payload, mask)
+    return fin, opcode, payload
+
+def encode_frame(opcode, payload=b"", mask=False):
+    """1フレーム分のバイト列（クライアントからの送信は mask=True）"""
+    length = len(payload)
+    header = bytearray([0x80 | opcode])
+    mask_bit = 0x80 if mask else 0
+    if length < 126:
+        header.append(mask_bit | length)
+    elif length < 1 << 16:
+        header.append(mask_bit | 126)
+        header += struct.pack('!H', length)
+    else:
+        header.append(mask_bit | 127)
+        header += struct.pack('!Q', length)
+    if mask:
+        key = os.urandom(4)
+        return bytes(header) + key + _mask(payload, key)
+    return bytes(header) + payload
+
+class WebSocket:
+    """確立済みの WebSocket 接続（サーバー側・クライアント側共通）"""
+
+    def __init__(self, reader, writer, client=False, max_size=1024 * 1024):
+        self.reader = reader
+        self.writer = writer
+        self.client = client
+        self.max_size = max_size
+        self.closed = False
+
+    async def send(self, opcode, payload=b""):
+        self.writer.write(encode_frame(opcode, payload, mask=self.client))
+        await self.writer.drain()
+
+    async def send_json(self, message):
+        await self.send(OP_TEXT, json.dumps(message, ensure_ascii=False).encode('utf-8'))
+
+    async def close(self, code=CLOSE_NORMAL, reason=""):
+        if self.closed:
+            return
+        self.closed = True
+        try:
+            await self.send(OP_CLOSE, struct.pack('!H', code) + reason.encode('utf-8')[:120])
+        except ConnectionError:
+            pass
+
+    async def receive(self):
+        """次のメッセージ。返り値: (OP_TEXT, str) / (OP_BINARY, bytes) / (OP_CLOSE, None)
+
+        バイナリの分割フレームは結合せず、届いた断片ごとに返す（受信側でそのまま書き出せる）。
+        ping には自動で応答する。
+        """
+        text_parts = None
+        while True:
+            fin, opcode, payload = await read_frame(self.reader, self.max_size)
+            if opcode == OP_PING:
+                await self.send(OP_PONG, payload)
+            elif opcode == OP_PONG:
+                continue
+            elif opcode == OP_CLOSE:
+                await self.close()
+                return OP_CLOSE, None
+            elif opcode == OP_BINARY or (opcode == OP_CONTINUATION and text_parts is None):
+                return OP_BINARY, payload
+            elif opcode in (OP_TEXT, OP_CONTINUATION):
+                text_parts = (text_parts or []) + [payload]
+                if sum(map(len, text_parts)) > self.max_size:
+                    raise ProtocolError("メッセージが大きすぎます", CLOSE_TOO_BIG)
+                if fin:
+                    return OP_TEXT, b"".join(text_parts).decode('utf-8')
+            else:
+                raise ProtocolError(f"未対応のオペコード: {opcode}")
+
+async def client_handshake(reader, writer, host, path):
+    """クライアント側のハンドシェイク"""
+    key = base64.b64encode(os.urandom(16)).decode('ascii')
+    writer.write((f"GET {path} HTTP/1.1\r\nHost: {host}\r\nUpgrade: websocket\r\n"
+                  f"Connection: Upgrade\r\nSec-WebSocket-Key: {key}\r\n"
+                  f"Sec-WebSocket-Version: 13\r\n\r\n").encode('latin-1'))
+    await writer.drain()
+    status, headers = await read_http_head(reader)
+    if " 101 " not in status or headers.get('sec-websocket-accept') != accept_key(key):
+        raise ProtocolError(f"ハンドシェイクに失敗しました: {status}")
+
+def handshake_response(headers):
+    """サーバー側のハンドシェイク応答（WebSocket の要求でなければ None）"""
+    key = headers.get('sec-websocket-key')
+    if headers.get('upgrade', '').lower() != 'websocket' or not key:
+        return None
+    return ("HTTP/1.1 101 Switching Protocols\r\nUpgrade: websocket\r\nConnection: Upgrade\r\n"
+            f"Sec-WebSocket-Accept: {accept_key(key)}\r\n\r\n").encode('latin-1')
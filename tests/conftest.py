@@ -0,0 +1,5 @@
+import sys
+from pathlib import Path
+
+# script/ と同じく src/ のモジュールを直接 import する
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "src"))
@@ -0,0 +1,52 @@
+"""事前確保型の録音バッファ（CaptureBuffer）のテスト（user-001）"""
+import time
+
+import numpy as np
+import pytest
+from capture_buffer import CaptureBuffer
+
+@pytest.mark.parametrize("initial_seconds, chunk_seconds", [(1, 0.5), (0.3, 0.25), (60, 30)])
+def test_appended_blocks_come_back_in_order(initial_seconds, chunk_seconds):
+    buffer = CaptureBuffer(1000, 2, 'int16', initial_seconds=initial_seconds, chunk_seconds=chunk_seconds)
+    rng = np.random.default_rng(0)
+    blocks = []
+    for i in range(300):
+        block = rng.integers(-1000, 1000, (rng.integers(1, 50), 2)).astype('int16')
+        blocks.append(block)
+        buffer.append(block)
+        if i % 5 == 0:
+            time.sleep(0.002)   # 実際の録音と同じく、確保スレッドに追加チャンクを用意させる
+    expected = np.concatenate(blocks)
+    assert buffer.dropped_blocks == 0
+    assert buffer.frames == len(expected)
+    assert np.array_equal(buffer.finalize(), expected)
+
+def test_short_take_is_returned_without_copy():
+    buffer = CaptureBuffer(1000, 1, 'float32', initial_seconds=1)
+    buffer.append(np.ones((100, 1), dtype='float32'))
+    assert np.shares_memory(buffer.finalize(), buffer._chunks[0])
+
+def test_growth_does_not_copy_recorded_chunks():
+    buffer = CaptureBuffer(1000, 1, 'int16', initial_seconds=0.1, chunk_seconds=0.1)
+    first = buffer._chunks[0]
+    for _ in range(10):
+        buffer.append(np.zeros((50, 1), dtype='int16'))
+        time.sleep(0.002)
+    assert buffer._chunks[0] is first
+    assert len(buffer._chunks) >= 5
+
+def test_take_within_expected_length_allocates_nothing_more():
+    buffer = CaptureBuffer(1000, 1, 'int16', initial_seconds=10)
+    for _ in range(100):
+        buffer.append(np.zeros((50, 1), dtype='int16'))
+    time.sleep(0.01)
+    assert len(buffer._chunks) == 1
+
+def test_block_beyond_capacity_is_dropped_not_allocated():
+    buffer = CaptureBuffer(1000, 1, 'int16', initial_seconds=0.1, chunk_seconds=0.1)
+    assert not buffer.append(np.zeros((1000, 1), dtype='int16'))
+    assert buffer.frames == 0
+    assert buffer.dropped_blocks == 1 and buffer.overflow_count == 1
+
+def test_empty_buffer_finalizes_to_none():
+    assert CaptureBuffer(1000, 1, initial_seconds=0).finalize() is None
@@ -0,0 +1,26 @@
+"""原稿の行位置索引（Corpus）のテスト（user-007）"""
+from corpus import Corpus
+
+def make_corpus(tmp_path, text):
+    input_dir = tmp_path / "input"
+    input_dir.mkdir()
+    (input_dir / "a.txt").write_text(text, encoding='utf-8')
+    corpus = Corpus(input_dir, tmp_path / "corpus_index")
+    corpus.load()
+    return corpus, input_dir / "a.txt"
+
+def test_lines_are_read_lazily(tmp_path):
+    corpus, _ = make_corpus(tmp_path, "一行目\n\n二行目\n")
+    assert len(corpus) == 2
+    assert corpus.text(1) == "二行目"
+    assert corpus.line_info(1) == ("a.txt", 2)
+    corpus.close()
+
+def test_file_shortened_in_place_does_not_crash(tmp_path):
+    corpus, path = make_corpus(tmp_path, ("あ" * 5000 + "\n") * 2)
+    assert corpus.text(0) == "あ" * 5000
+    path.write_text("short\n", encoding='utf-8')
+    assert corpus.text(1) == ""
+    assert corpus.reload()['changed']
+    assert len(corpus) == 1 and corpus.text(0) == "short"
+    corpus.close()
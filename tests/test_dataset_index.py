@@ -0,0 +1,77 @@
+"""テイクの索引・絞り込みと学習用の分割（DatasetIndex・split_dataset）のテスト（user-025）"""
+import numpy as np
+import pytest
+from dataset_index import DatasetIndex, split_dataset, normalize_text, text_key
+
+def make_index(speakers, texts, durations=None):
+    n = len(texts)
+    durations = durations if durations is not None else [1.0 + i % 5 for i in range(n)]
+    encoded = [t.encode('utf-8') for t in texts]
+    columns = {
+        'name': np.array([f"audio_{i + 1}.wav" for i in range(n)]),
+        'number': np.arange(1, n + 1),
+        'speaker': np.array(speakers),
+        'text_key': np.array([text_key(t) for t in texts], dtype=np.int64),
+        'duration': np.array(durations, dtype=np.float64),
+        'text_offsets': np.concatenate([[0], np.cumsum([len(b) for b in encoded])]).astype(np.int64),
+        'text_bytes': np.frombuffer(b''.join(encoded), dtype=np.uint8),
+    }
+    return DatasetIndex(columns)
+
+def assert_disjoint(splits, column):
+    seen = {}
+    for name, part in splits.items():
+        for value in set(part[column].tolist()):
+            assert seen.setdefault(value, name) == name, f"{column}={value} が複数の分割にあります"
+
+def test_normalized_text_ignores_punctuation_and_width():
+    assert normalize_text("ＡＢＣ、です！") == normalize_text("abc です")
+    assert text_key("こんにちは。") == text_key("こんにちは")
+
+@pytest.mark.parametrize("disjoint, columns", [
+    (('text',), ['text_key']),
+    (('speaker',), ['speaker']),
+    (('speaker', 'text'), ['speaker', 'text_key']),
+])
+def test_split_is_disjoint_and_covers_everything(disjoint, columns):
+    rng = np.random.default_rng(0)
+    n = 2000
+    speakers = [f"s{i}" for i in rng.integers(0, 120, n)]
+    # 同じ話者の中でテキストを重複させる（話者をまたぐとグループが1つにつながる）
+    texts = [f"{speakers[i]}の文{rng.integers(0, 5)}。" for i in range(n)]
+    index = make_index(speakers, texts)
+    splits, report = split_dataset(index, disjoint=disjoint, seed=3)
+
+    for column in columns:
+        assert_disjoint(splits, column)
+    assert all(report['overlap'][key] == 0 for key in report['disjoint'])
+    rows = np.concatenate([part.rows for part in splits.values()])
+    assert sorted(rows.tolist()) == list(range(n))
+
+def test_split_is_deterministic_and_seed_dependent():
+    texts = [f"文{i}" for i in range(500)]
+    index = make_index(["default"] * 500, texts)
+    first, _ = split_dataset(index, seed=1)
+    again, _ = split_dataset(index, seed=1)
+    other, _ = split_dataset(index, seed=2)
+    assert all(np.array_equal(first[k].rows, again[k].rows) for k in first)
+    assert not all(np.array_equal(first[k].rows, other[k].rows) for k in first)
+
+def test_text_only_split_is_stable_when_takes_are_added():
+    texts = [f"文{i}" for i in range(400)]
+    before, _ = split_dataset(make_index(["default"] * 400, texts), disjoint=('text',), seed=0)
+    after, _ = split_dataset(make_index(["default"] * 450, texts + [f"追加{i}" for i in range(50)]),
+                             disjoint=('text',), seed=0)
+    for name in before:
+        assert set(before[name].names()) <= set(after[name].names())
+
+def test_filter_sort_sample():
+    index = make_index(["a", "b", "a", "b"], ["一", "二", "三", "四"], durations=[1.0, 5.0, 3.0, 8.0])
+    subset = index.filter(speaker="a", min_duration=2)
+    assert subset.names() == ["audio_3.wav"]
+    assert index.filter(speaker=["a", "b"], max_duration=4).names() == ["audio_1.wav", "audio_3.wav"]
+    assert index.filter(text_contains="四").names() == ["audio_4.wav"]
+    assert index.sort('duration', descending=True).names()[0] == "audio_4.wav"
+    assert index.sample(n=2, seed=0).names() == index.sample(n=2, seed=0).names()
+    with pytest.raises(ValueError):
+        index.filter(unknown=1)
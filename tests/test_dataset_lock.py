@@ -0,0 +1,40 @@
+"""行ごとの録音予約（LineLeases）のテスト（user-022）"""
+import time
+
+from dataset_lock import LineLeases
+
+def test_held_lease_is_renewed_past_ttl(tmp_path):
+    leases = LineLeases("a", path=tmp_path / "line_leases.json", ttl=0.3)
+    other = LineLeases("b", path=tmp_path / "line_leases.json", ttl=0.3)
+    key = LineLeases.key("cocoro.txt", 1)
+    assert leases.acquire(key)
+    time.sleep(0.8)   # 期限を過ぎても延長されている
+    assert not other.acquire(key)
+    assert other.holder(key) == "a"
+    leases.release_all()
+
+def other_holder(tmp_path, key):
+    return LineLeases("b", path=tmp_path / "line_leases.json").holder(key)
+
+def test_released_lease_is_not_renewed(tmp_path):
+    leases = LineLeases("a", path=tmp_path / "line_leases.json", ttl=0.3)
+    key = LineLeases.key("cocoro.txt", 1)
+    assert leases.acquire(key)
+    leases.release(key)
+    leases.renew()
+    assert other_holder(tmp_path, key) is None
+    leases.release_all()
+
+def test_lease_taken_over_after_expiry_is_dropped(tmp_path):
+    leases = LineLeases("a", path=tmp_path / "line_leases.json", ttl=60)
+    other = LineLeases("b", path=tmp_path / "line_leases.json", ttl=60)
+    key = LineLeases.key("cocoro.txt", 1)
+    assert leases.acquire(key)
+    leases._stop.set()
+    leases.release_all()
+    assert other.acquire(key)
+    leases._held.add(key)
+    leases.renew()
+    assert leases.holder(key) == "b"
+    assert key not in leases._held
+    other.release_all()
@@ -0,0 +1,37 @@
+"""dataset/ の1回走査による索引（DatasetFileIndex）のテスト（user-005）"""
+import os
+import wave
+
+from file_index import DatasetFileIndex
+
+def make_dataset(tmp_path):
+    audio_dir = tmp_path / "dataset" / "audio_files"
+    meta_dir = tmp_path / "dataset" / "meta_files"
+    audio_dir.mkdir(parents=True)
+    meta_dir.mkdir()
+    with wave.open(str(audio_dir / "audio_1.wav"), 'wb') as f:
+        f.setnchannels(1)
+        f.setsampwidth(2)
+        f.setframerate(16000)
+        f.writeframes(b"\0\0" * 10)
+    (meta_dir / "meta_1.txt").write_text("こんにちは", encoding='utf-8')
+    return DatasetFileIndex(tmp_path / "dataset", tmp_path / "sync_cache.json")
+
+def test_in_place_meta_edit_invalidates_cache(tmp_path):
+    index = make_dataset(tmp_path)
+    assert index.scan()['texts'] == {"audio_1.wav": "こんにちは"}
+    meta_dir = tmp_path / "dataset" / "meta_files"
+    st = os.stat(meta_dir)
+    (meta_dir / "meta_1.txt").write_text("こんばんは", encoding='utf-8')
+    os.utime(meta_dir, ns=(st.st_atime_ns, st.st_mtime_ns))   # ディレクトリの更新時刻は変わらない
+    assert index.scan()['texts'] == {"audio_1.wav": "こんばんは"}
+
+def test_same_size_metadata_edit_invalidates_cache(tmp_path):
+    index = make_dataset(tmp_path)
+    metadata_path = tmp_path / "dataset" / "metadata.txt"
+    metadata_path.write_text("audio_1.wav|あいう\n", encoding='utf-8')
+    assert index.scan()['texts'] == {"audio_1.wav": "あいう"}
+    st = os.stat(metadata_path)
+    metadata_path.write_text("audio_1.wav|かきく\n", encoding='utf-8')
+    os.utime(metadata_path, ns=(st.st_atime_ns, st.st_mtime_ns + 1))
+    assert index.scan()['texts'] == {"audio_1.wav": "かきく"}
@@ -0,0 +1,57 @@
+"""metadata.txt の索引付き管理（MetadataStore）のテスト（user-009）"""
+from metadata_store import MetadataStore, natural_key
+
+def test_natural_key_orders_numbers():
+    names = ['audio_10.wav', 'audio_2.wav', 'audio_1.wav']
+    assert sorted(names, key=natural_key) == ['audio_1.wav', 'audio_2.wav', 'audio_10.wav']
+
+def test_upsert_and_delete_survive_reload(tmp_path):
+    path = tmp_path / "metadata.txt"
+    store = MetadataStore(path, compact_threshold=1000)
+    store.upsert("audio_1.wav", "一")
+    store.upsert("audio_2.wav", "二")
+    store.upsert("audio_1.wav", "いち")
+    store.delete("audio_2.wav")
+
+    reloaded = MetadataStore(path)
+    assert reloaded.get("audio_1.wav") == "いち"
+    assert reloaded.get("audio_2.wav") is None
+    assert len(reloaded) == 1
+    store.close()
+
+def test_reinsert_after_delete_is_kept(tmp_path):
+    """削除より後に書かれた行は削除ログで消されない"""
+    path = tmp_path / "metadata.txt"
+    store = MetadataStore(path, compact_threshold=1000)
+    store.upsert("audio_1.wav", "古い")
+    store.delete("audio_1.wav")
+    store.upsert("audio_1.wav", "新しい")
+    assert MetadataStore(path).get("audio_1.wav") == "新しい"
+
+def test_other_process_delete_is_seen_on_refresh(tmp_path):
+    path = tmp_path / "metadata.txt"
+    first = MetadataStore(path, compact_threshold=1000)
+    second = MetadataStore(path, compact_threshold=1000)
+    first.upsert("audio_1.wav", "一")
+    second.refresh()
+    assert second.get("audio_1.wav") == "一"
+    first.delete("audio_1.wav")
+    second.refresh()
+    assert second.get("audio_1.wav") is None
+
+def test_compact_writes_live_entries_in_natural_order(tmp_path):
+    path = tmp_path / "metadata.txt"
+    store = MetadataStore(path, compact_threshold=1000)
+    for n in (10, 2, 1, 3):
+        store.upsert(f"audio_{n}.wav", f"text {n}")
+    store.upsert("audio_2.wav", "text 2 retake")
+    store.delete("audio_3.wav")
+    assert store.compact() == 3
+
+    assert path.read_text(encoding='utf-8').splitlines() == [
+        "audio_1.wav|text 1", "audio_2.wav|text 2 retake", "audio_10.wav|text 10"]
+    assert not path.with_suffix('.tombstones').exists()
+    assert store.dead_lines == 0
+    # コンパクション後の追記も他のインスタンスから読める
+    store.upsert("audio_11.wav", "text 11")
+    assert MetadataStore(path).get("audio_11.wav") == "text 11"
@@ -0,0 +1,59 @@
+"""録音済みの行の索引と進捗の件数（RecordedIndex）のテスト（user-006）"""
+import random
+
+import pytest
+from progress_index import RecordedIndex, BLOCK_SIZE
+
+def brute_next(flags, start, wrap=True):
+    for i in range(max(start, 0), len(flags)):
+        if not flags[i]:
+            return i
+    if wrap:
+        for i in range(len(flags)):
+            if not flags[i]:
+                return i
+    return None
+
+@pytest.mark.parametrize("total", [0, 1, BLOCK_SIZE - 1, BLOCK_SIZE, BLOCK_SIZE * 5 + 3])
+def test_next_unrecorded_matches_linear_scan(total):
+    rng = random.Random(total)
+    index = RecordedIndex(bytearray(total))
+    flags = [0] * total
+    for _ in range(total * 3):
+        i = rng.randrange(total) if total else None
+        if i is not None:
+            recorded = rng.random() < 0.7
+            index.set(i, recorded)
+            flags[i] = int(recorded)
+        for start in (0, total // 2, total - 1, total):
+            assert index.next_unrecorded(start) == (brute_next(flags, start) if 0 in flags else None)
+            assert index.next_unrecorded(start, wrap=False) == (
+                brute_next(flags, start, wrap=False) if 0 in flags else None)
+
+def test_all_recorded_returns_none():
+    index = RecordedIndex(bytearray([1]) * (BLOCK_SIZE * 2))
+    assert index.next_unrecorded(0) is None
+    index.set(BLOCK_SIZE + 5, False)
+    assert index.next_unrecorded(BLOCK_SIZE + 6) == BLOCK_SIZE + 5
+    assert index.next_unrecorded(BLOCK_SIZE + 6, wrap=False) is None
+
+def test_fenwick_counts_follow_updates():
+    total = BLOCK_SIZE * 7 + 11
+    bounds = [('a.txt', 0, 100), ('b.txt', 100, total)]
+    flags = bytearray(random.Random(1).choices([0, 1], k=total))
+    index = RecordedIndex(bytearray(flags), bounds)
+    rng = random.Random(2)
+    for _ in range(500):
+        i = rng.randrange(total)
+        recorded = rng.random() < 0.5
+        index.set(i, recorded)
+        flags[i] = int(recorded)
+        start, end = sorted(rng.randrange(total + 1) for _ in range(2))
+        assert index.count_unrecorded(start, end) == flags.count(0, start, end)
+    assert index.recorded_count == flags.count(1)
+    assert index.unrecorded_count == flags.count(0)
+    assert index.unrecorded_per_file == {'a.txt': flags.count(0, 0, 100), 'b.txt': flags.count(0, 100, total)}
+    # 同じ状態への更新は集計を変えない
+    before = index.count_unrecorded()
+    index.set(0, bool(flags[0]))
+    assert index.count_unrecorded() == before
@@ -0,0 +1,62 @@
+"""ジャーナル方式のセッション保存（SessionStore）のテスト（user-004）"""
+from session_store import SessionStore
+
+def make_store(tmp_path):
+    store = SessionStore(tmp_path / "session.json")
+    store.write_snapshot({'version': 2, 'current_index': 0})
+    return store
+
+def test_journal_replays_after_snapshot(tmp_path):
+    store = make_store(tmp_path)
+    store.set_cursor(3)
+    store.set_recorded("a.txt", 1, "audio_1.wav")
+    store.set_takes("a.txt", 1, ["h1"], "h1")
+    store.close()
+
+    snapshot, entries = SessionStore(tmp_path / "session.json").load()
+    assert snapshot['current_index'] == 0
+    assert [e['op'] for e in entries] == ['cursor', 'recorded', 'takes']
+    assert entries[1]['audio_file'] == "audio_1.wav"
+
+def test_snapshot_clears_journal(tmp_path):
+    store = make_store(tmp_path)
+    store.set_cursor(3)
+    store.write_snapshot({'version': 2, 'current_index': 3})
+    assert store.load()[1] == []
+    store.close()
+
+def test_incremental_load_returns_only_new_entries(tmp_path):
+    writer = make_store(tmp_path)
+    reader = SessionStore(tmp_path / "session.json")
+    writer.set_cursor(1)
+    assert len(reader.load_journal()) == 1
+    writer.set_cursor(2)
+    assert [e['index'] for e in reader.load_journal(reader.journal_position)] == [2]
+    writer.close()
+
+def test_torn_tail_is_ignored_and_truncated_before_append(tmp_path):
+    store = make_store(tmp_path)
+    store.set_cursor(1)
+    store.close()
+    journal = tmp_path / "session.journal"
+    with open(journal, 'a', encoding='utf-8') as f:
+        f.write('{"op": "recorded", "fi')   # 異常終了で途切れた行
+
+    reader = SessionStore(tmp_path / "session.json")
+    assert [e['op'] for e in reader.load()[1]] == ['cursor']
+
+    store = SessionStore(tmp_path / "session.json")
+    store.set_recorded("a.txt", 2, "audio_2.wav")
+    store.close()
+    entries = SessionStore(tmp_path / "session.json").load()[1]
+    assert [e['op'] for e in entries] == ['cursor', 'recorded']
+
+def test_corrupt_line_does_not_hide_later_entries(tmp_path):
+    store = make_store(tmp_path)
+    store.set_cursor(1)
+    with open(tmp_path / "session.journal", 'a', encoding='utf-8') as f:
+        f.write('not json\n')
+    store.set_cursor(2)
+    store.close()
+    entries = SessionStore(tmp_path / "session.json").load()[1]
+    assert [e['index'] for e in entries] == [1, 2]
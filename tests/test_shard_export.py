@@ -0,0 +1,55 @@
+"""シャード形式での書き出し（export_dataset・ShardReader）のテスト（user-012）"""
+import os
+import wave
+
+import numpy as np
+
+from metadata_store import MetadataStore
+from shard_export import export_dataset, ShardReader
+
+def write_wav(path, samples, mtime=None):
+    with wave.open(str(path), 'wb') as f:
+        f.setnchannels(1)
+        f.setsampwidth(2)
+        f.setframerate(16000)
+        f.writeframes(np.asarray(samples, dtype='<i2').tobytes())
+    if mtime is not None:
+        os.utime(path, ns=(mtime, mtime))
+
+def make_dataset(tmp_path, count=4, frames=1000):
+    audio_dir = tmp_path / "audio_files"
+    audio_dir.mkdir()
+    store = MetadataStore(tmp_path / "metadata.txt", compact_threshold=1000)
+    for i in range(1, count + 1):
+        write_wav(audio_dir / f"audio_{i}.wav", np.full(frames, i))
+        store.upsert(f"audio_{i}.wav", f"テキスト{i}")
+    return audio_dir, store
+
+def test_deleted_takes_leave_the_index(tmp_path):
+    audio_dir, store = make_dataset(tmp_path)
+    shard_dir = tmp_path / "shards"
+    export_dataset(audio_dir, store, shard_dir, compact_ratio=None)
+    store.delete("audio_2.wav")
+    result = export_dataset(audio_dir, store, shard_dir, compact_ratio=None)
+    assert result['removed'] == 1
+    assert ShardReader(shard_dir).names == ["audio_1.wav", "audio_3.wav", "audio_4.wav"]
+    store.close()
+
+def test_rerecorded_bytes_are_reclaimed_past_threshold(tmp_path):
+    audio_dir, store = make_dataset(tmp_path)
+    shard_dir = tmp_path / "shards"
+    export_dataset(audio_dir, store, shard_dir)
+    write_wav(audio_dir / "audio_1.wav", np.full(1000, 9), mtime=1)
+    result = export_dataset(audio_dir, store, shard_dir)
+    assert result['reclaimed'] == 0   # 回収できるのは 1/5 で閾値未満
+    write_wav(audio_dir / "audio_3.wav", np.full(1000, 7), mtime=1)
+    result = export_dataset(audio_dir, store, shard_dir)
+    assert result['reclaimed'] == 2 * 1000 * 2
+
+    reader = ShardReader(shard_dir)
+    assert sum(shard['bytes'] for shard in reader.manifest['shards']) == 4 * 1000 * 2
+    assert reader.verify() == []
+    assert int(reader["audio_1.wav"][0, 0]) == 9
+    assert int(reader["audio_3.wav"][0, 0]) == 7
+    assert sorted(p.name for p in shard_dir.glob("*.pcm")) == [s['name'] for s in reader.manifest['shards']]
+    store.close()
@@ -0,0 +1,27 @@
+"""日本語の文分割（split_sentences・iter_sentences）のテスト（user-018）"""
+import pytest
+from text_processor import split_sentences, iter_sentences
+
+@pytest.mark.parametrize("line, expected", [
+    ("今日は晴れ。明日は雨！本当？", ["今日は晴れ。", "明日は雨！", "本当？"]),
+    ("驚いた！！ そうだ。", ["驚いた！！", "そうだ。"]),
+    ("「はい。」「いいえ。」", ["「はい。」", "「いいえ。」"]),
+    # 閉じ括弧の後に「と」「っ」が続けば1文
+    ("「行こう。」と言った。それから帰った。", ["「行こう。」と言った。", "それから帰った。"]),
+    # 括弧内の文末では区切らない
+    ("彼は「そうか。まあいい。」と呟いた。", ["彼は「そうか。まあいい。」と呟いた。"]),
+    ("Hello world. Next one", ["Hello world.", "Next one"]),
+    ("句点のない文", ["句点のない文"]),
+])
+def test_split_sentences(line, expected):
+    assert split_sentences(line) == expected
+
+def test_long_quote_is_split_at_sentence_end():
+    inner = "あ" * 250
+    sentences = split_sentences(f"「{inner}。{inner}。」")
+    assert len(sentences) == 2
+    assert "".join(sentences) == f"「{inner}。{inner}。」"
+
+def test_iter_sentences_marks_paragraphs_and_strips_ruby():
+    lines = ["私《わたくし》は歩いた。", "", "　次の段落。"]
+    assert list(iter_sentences(lines)) == ["私は歩いた。", None, None, "次の段落。", None]
@@ -0,0 +1,26 @@
+"""録音の一時ファイルと中断時の復旧（recover_partial_files）のテスト（user-002）"""
+import wave
+
+from wav_stream_writer import WavFileWriter, recover_partial_files, HEADER_SIZE
+
+def test_header_only_file_of_an_active_writer_is_kept(tmp_path):
+    part_path = tmp_path / ".audio_1.wav.part"
+    writer = WavFileWriter(part_path, sample_rate=16000)
+    writer._file.flush()
+    assert part_path.stat().st_size == HEADER_SIZE
+    assert recover_partial_files(tmp_path) == []
+    assert part_path.exists()
+    writer.discard()
+
+def test_abandoned_files_are_recovered_or_removed(tmp_path):
+    empty = WavFileWriter(tmp_path / ".audio_1.wav.part", sample_rate=16000)
+    empty._file.close()   # 異常終了した端末（ロックも外れる）
+    taken = WavFileWriter(tmp_path / ".audio_2.wav.part", sample_rate=16000)
+    taken.append(b"\x01\x00" * 100 + b"\x01")   # 途中で切れたフレームを含む
+    taken._file.close()
+
+    recovered = recover_partial_files(tmp_path)
+    assert [p.name for p in recovered] == ["recovered_audio_2.wav"]
+    assert not (tmp_path / ".audio_1.wav.part").exists()
+    with wave.open(str(recovered[0]), 'rb') as f:
+        assert f.getnframes() == 100
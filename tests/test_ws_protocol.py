@@ -0,0 +1,38 @@
+"""録音サービスの WebSocket フレームのテスト（user-021）"""
+import asyncio
+
+import pytest
+from ws_protocol import (encode_frame, read_frame, accept_key, handshake_response, ProtocolError,
+                         OP_BINARY, OP_TEXT, CLOSE_TOO_BIG)
+
+def decode(data, max_size=1 << 20):
+    async def run():
+        reader = asyncio.StreamReader()
+        reader.feed_data(data)
+        reader.feed_eof()
+        return await read_frame(reader, max_size)
+    return asyncio.run(run())
+
+@pytest.mark.parametrize("size", [0, 1, 125, 126, 65535, 65536, 200000])
+@pytest.mark.parametrize("mask", [False, True])
+def test_frame_round_trip(size, mask):
+    payload = bytes(range(256)) * (size // 256) + bytes(range(size % 256))
+    assert decode(encode_frame(OP_BINARY, payload, mask=mask)) == (True, OP_BINARY, payload)
+
+def test_masked_frame_differs_on_the_wire():
+    payload = "こんにちは".encode('utf-8')
+    frame = encode_frame(OP_TEXT, payload, mask=True)
+    assert payload not in frame
+    assert decode(frame)[2] == payload
+
+def test_oversized_frame_is_rejected():
+    with pytest.raises(ProtocolError) as e:
+        decode(encode_frame(OP_BINARY, b"x" * 1000), max_size=999)
+    assert e.value.code == CLOSE_TOO_BIG
+
+def test_handshake_accept_key():
+    # RFC 6455 の例
+    assert accept_key("dGhlIHNhbXBsZSBub25jZQ==") == "s3pPLMBiTxaQ9kYGzzhZRbK+xOo="
+    response = handshake_response({'upgrade': 'websocket', 'sec-websocket-key': "dGhlIHNhbXBsZSBub25jZQ=="})
+    assert b"s3pPLMBiTxaQ9kYGzzhZRbK+xOo=" in response
+    assert handshake_response({'sec-websocket-key': 'x'}) is None